@@ -0,0 +1,199 @@
+import re
+import abc
+from typing import Optional, List, Dict, Callable
+
+# CJK统一表意文字、假名与全角标点，每个字符约占1个token
+_CJK_RE = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+MESSAGE_OVERHEAD = 4  # 每条消息的角色与分隔符开销
+SUMMARY_PREFIX = "[历史摘要]"
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：CJK字符每个计1个token，其余字符约4个字符计1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+class ContextPolicy(abc.ABC):
+    """超出预算时的处理策略基类，子类必须实现apply（未实现时在创建实例时即报错）"""
+
+    @abc.abstractmethod
+    def apply(self, window: "ContextWindow", messages: List[Dict[str, str]], limit: int):
+        """
+        原地修改messages，使其token总数尽量不超过limit
+
+        只能改动window.evictable_range(messages)给出的区间
+        """
+
+class DropOldestPolicy(ContextPolicy):
+    """按轮次丢弃最旧的对话"""
+
+    def apply(self, window, messages, limit):
+        start, end = window.evictable_range(messages)
+        total = window.total(messages)
+        drop_end = start
+        while total > limit and drop_end < end:
+            total -= window.count(messages[drop_end])
+            drop_end += 1
+            # 整轮丢弃：保留的历史从一条user消息开始
+            while drop_end < end and messages[drop_end]["role"] != "user":
+                total -= window.count(messages[drop_end])
+                drop_end += 1
+        del messages[start:drop_end]
+
+class TruncatePolicy(ContextPolicy):
+    """把最旧的长消息截断到固定长度，仍超出预算时再整轮丢弃"""
+
+    def __init__(self, max_message_tokens: int = 200):
+        self.max_message_tokens = max_message_tokens
+
+    def apply(self, window, messages, limit):
+        start, end = window.evictable_range(messages)
+        total = window.total(messages)
+        for i in range(start, end):
+            if total <= limit:
+                return
+            message = messages[i]
+            tokens = window.count(message)
+            if tokens - MESSAGE_OVERHEAD <= self.max_message_tokens:
+                continue
+            content = message["content"]
+            # 按比例估算保留的字符数
+            keep = max(1, len(content) * self.max_message_tokens // (tokens - MESSAGE_OVERHEAD))
+            messages[i] = {"role": message["role"], "content": content[:keep] + "…[已截断]"}
+            total += window.count(messages[i]) - tokens
+        if total > limit:
+            DropOldestPolicy().apply(window, messages, limit)
+
+def extractive_summary(messages: List[Dict[str, str]], chars_per_message: int = 60) -> str:
+    """不调用模型的摘要：保留每条消息的开头部分"""
+    lines = []
+    for message in messages:
+        content = message["content"].replace("\n", " ")
+        if len(content) > chars_per_message:
+            content = content[:chars_per_message] + "…"
+        lines.append(f"{message['role']}: {content}")
+    return "\n".join(lines)
+
+class SummarizePolicy(ContextPolicy):
+    """
+    把最旧的若干轮折叠为一条摘要消息，放在系统提示之后
+
+    summarizer接收被折叠的消息列表并返回摘要文本，可替换为调用模型的实现
+    """
+
+    def __init__(self,
+                 summarizer: Optional[Callable[[List[Dict[str, str]]], str]] = None,
+                 max_summary_tokens: int = 1000):
+        self.summarizer = summarizer or extractive_summary
+        self.max_summary_tokens = max_summary_tokens
+
+    def apply(self, window, messages, limit):
+        start, end = window.evictable_range(messages)
+        has_summary = start < end and messages[start]["content"].startswith(SUMMARY_PREFIX)
+        fold_start = start + 1 if has_summary else start
+
+        # 先确定需要折叠多少条，给摘要本身预留空间
+        total = window.total(messages) + self.max_summary_tokens
+        fold_end = fold_start
+        while total > limit and fold_end < end:
+            total -= window.count(messages[fold_end])
+            fold_end += 1
+            while fold_end < end and messages[fold_end]["role"] != "user":
+                total -= window.count(messages[fold_end])
+                fold_end += 1
+        if fold_end == fold_start:
+            return
+
+        folded = messages[fold_start:fold_end]
+        previous = messages[start]["content"][len(SUMMARY_PREFIX):].strip() if has_summary else ""
+        summary = self.summarizer(folded)
+        if previous:
+            summary = previous + "\n" + summary
+        # 摘要过长时保留最新的部分
+        while estimate_tokens(summary) > self.max_summary_tokens and "\n" in summary:
+            summary = summary.split("\n", 1)[1]
+
+        summary_message = {"role": "system", "content": f"{SUMMARY_PREFIX}\n{summary}"}
+        messages[start:fold_end] = [summary_message]
+        if window.total(messages) > limit:
+            DropOldestPolicy().apply(window, messages, limit)
+
+POLICIES = {
+    "drop": DropOldestPolicy,
+    "truncate": TruncatePolicy,
+    "summarize": SummarizePolicy,
+}
+
+class ContextWindow:
+    """
+    按token预算管理对话上下文
+
+    每条消息的token数只在首次出现时计算一次并缓存；系统提示始终保留，
+    最近keep_recent条消息不参与淘汰，超出预算时交给policy处理最旧的部分
+    """
+
+    def __init__(self,
+                 budget: int = 32000,
+                 policy: Optional[ContextPolicy] = None,
+                 counter: Callable[[str], int] = estimate_tokens,
+                 keep_recent: int = 2):
+        """
+        参数:
+            budget: 上下文总token预算（含为回复预留的部分）
+            policy: 超出预算时的处理策略，默认整轮丢弃
+            counter: token计数函数，可替换为精确的分词器
+            keep_recent: 始终保留的最近消息条数
+        """
+        self.budget = budget
+        self.policy = policy or DropOldestPolicy()
+        self.counter = counter
+        self.keep_recent = max(1, keep_recent)
+        self._cache: Dict[int, tuple] = {}  # id(消息) -> (内容对象, token数)
+        self.evicted_count = 0  # 累计被移出或折叠的消息数
+
+    def count(self, message: Dict[str, str]) -> int:
+        """单条消息的token数（带缓存）"""
+        content = message["content"]
+        cached = self._cache.get(id(message))
+        if cached is not None and cached[0] is content:
+            return cached[1]
+        tokens = self.counter(content) + MESSAGE_OVERHEAD
+        self._cache[id(message)] = (content, tokens)
+        return tokens
+
+    def total(self, messages: List[Dict[str, str]]) -> int:
+        """消息列表的token总数"""
+        return sum(self.count(message) for message in messages)
+
+    def evictable_range(self, messages: List[Dict[str, str]]) -> tuple:
+        """可被淘汰的区间[start, end)：跳过开头的系统提示与末尾的最近消息"""
+        start = 1 if messages and messages[0]["role"] == "system" else 0
+        end = max(start, len(messages) - self.keep_recent)
+        return start, end
+
+    def fit(self, messages: List[Dict[str, str]], reserve: int = 0) -> List[Dict[str, str]]:
+        """
+        原地裁剪messages使其不超过预算
+
+        参数:
+            messages: 对话历史（会被原地修改）
+            reserve: 为模型回复预留的token数
+        """
+        limit = self.budget - reserve
+        before = len(messages)
+        if self.total(messages) > limit:
+            self.policy.apply(self, messages, limit)
+            self.evicted_count += max(0, before - len(messages))
+        # 清理已不在历史中的缓存项
+        if len(self._cache) > 2 * len(messages) + 16:
+            live = {id(message) for message in messages}
+            self._cache = {key: value for key, value in self._cache.items() if key in live}
+        return messages
+
+def create_context_window(budget: int, policy: str = "drop") -> ContextWindow:
+    """按名称创建上下文管理器，policy可选drop/truncate/summarize"""
+    if policy not in POLICIES:
+        raise ValueError(f"未知的上下文策略: {policy}，可选: {', '.join(POLICIES)}")
+    return ContextWindow(budget=budget, policy=POLICIES[policy]())
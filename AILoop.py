@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import concurrent.futures
+from typing import Optional, Coroutine, Any
+
+class EventLoopThread:
+    """在独立线程中运行的asyncio事件循环，Qt主线程与其它线程都通过它提交协程"""
+
+    def __init__(self, name: str = "AILoop"):
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        """事件循环线程主体"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    def in_loop_thread(self) -> bool:
+        """当前线程是否就是事件循环线程"""
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """
+        提交协程到事件循环（线程安全）
+
+        返回:
+            concurrent.futures.Future，可用add_done_callback把结果桥接回Qt信号
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """在事件循环中运行协程并阻塞等待结果，供同步接口使用"""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("不能在事件循环线程内同步等待协程，请直接await")
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        """停止事件循环"""
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+_shared_loop: Optional[EventLoopThread] = None
+_shared_loop_lock = threading.Lock()
+
+def get_event_loop_thread() -> EventLoopThread:
+    """获取进程内共享的事件循环线程"""
+    global _shared_loop
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = EventLoopThread()
+        return _shared_loop
@@ -1,128 +1,823 @@
-import subprocess
-import sys
-import threading
-import time
-import os
-import queue
-from datetime import datetime, timedelta
-from typing import Optional, Tuple, List, Dict
-
-import requests
-
-class AIWife:
-    """AI聊天功能封装类"""
-    
-    def __init__(self, 
-                 api_key: str = "",
-                 system_prompt: str = "",
-                 temperature: float = 0.7,
-                 max_tokens: int = 1024,
-                 model: str = "Pro/deepseek-ai/DeepSeek-V3",
-                 api_url: str = "https://api.siliconflow.cn/v1/chat/completions"):
-        """
-        初始化AI聊天实例
-        
-        参数:
-            api_key: API密钥
-            system_prompt: 系统提示词
-            temperature: 生成文本的随机性(0-1)
-            max_tokens: 最大生成token数
-            model: 使用的模型名称
-            api_url: API端点URL
-        """
-        self.messages: List[Dict[str, str]] = []
-        self.api_key = api_key
-        self.system_prompt = system_prompt
-        self.temperature = temperature
-        self.max_tokens = max_tokens
-        self.model = model
-        self.api_url = api_url
-        self.max_response_tokens = 10000  # 单次回复最大token限制
-        
-        # 初始化系统提示
-        if system_prompt:
-            self.messages.append({"role": "system", "content": system_prompt})
-    
-    def set_api_key(self, key: str):
-        """设置API密钥"""
-        self.api_key = key.strip()
-    
-    def set_system_prompt(self, prompt: str):
-        """设置系统提示词"""
-        self.system_prompt = prompt
-        if self.messages and self.messages[0]["role"] == "system":
-            self.messages[0]["content"] = prompt
-        else:
-            self.messages.insert(0, {"role": "system", "content": prompt})
-    
-    def set_max_tokens(self, max_tokens: int) -> Tuple[int, str]:
-        """
-        设置最大token数
-        
-        返回:
-            (实际设置的值, 警告信息)
-        """
-        if max_tokens <= 0:
-            self.max_tokens = 8049
-            return self.max_tokens, "已重置为默认值8049"
-        if max_tokens > self.max_response_tokens:
-            self.max_tokens = self.max_response_tokens
-            return self.max_tokens, f"超过单次回复最大限制，已设置为{self.max_response_tokens}"
-        self.max_tokens = max_tokens
-        return self.max_tokens, ""
-    
-    def set_temperature(self, temperature: float):
-        """设置温度参数(0-1)"""
-        self.temperature = max(0.0, min(1.0, temperature))
-    
-    def add_message(self, role: str, content: str):
-        """添加消息到历史"""
-        self.messages.append({"role": role, "content": content})
-    
-    def clear_history(self):
-        """清空聊天历史"""
-        if self.messages and self.messages[0]["role"] == "system":
-            self.messages = [self.messages[0]]
-        else:
-            self.messages = []
-    
-    def get_response(self, user_message: str) -> str:
-        """
-        获取AI回复
-        
-        参数:
-            user_message: 用户消息
-            
-        返回:
-            AI回复内容或错误信息
-        """
-        if not self.api_key:
-            return "错误：请先设置API密钥"
-            
-        self.add_message("user", user_message)
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": self.model,
-            "messages": self.messages,
-            "temperature": self.temperature,
-            "max_tokens": self.max_tokens,
-            "response_format": {"type": "text"}
-        }
-        
-        try:
-            response = requests.post(self.api_url, json=payload, headers=headers)
-            response.raise_for_status()
-            ai_response = response.json()['choices'][0]['message']['content']
-            self.add_message("assistant", ai_response)
-            return ai_response
-        except Exception as e:
-            return f"API请求失败: {str(e)}"
-    
-    def chat(self, user_message: str) -> str:
-        """与get_response功能相同，提供更简洁的接口"""
-        return self.get_response(user_message)
\ No newline at end of file
+import subprocess
+import sys
+import asyncio
+import threading
+import time
+import os
+import queue
+import json
+import random
+import socket
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List, Dict, Callable, Iterator, AsyncIterator
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import aiohttp  # 异步客户端依赖，仅AsyncAIWife需要
+    # 请求发出之前的失败（建连失败、建连超时），只有这些可以安全重试
+    _ASYNC_RETRY_ERRORS = (aiohttp.ClientConnectorError, getattr(aiohttp, "ConnectionTimeoutError", aiohttp.ClientConnectorError))
+except ImportError:
+    aiohttp = None
+
+ASYNC_AVAILABLE = aiohttp is not None
+
+from AIContext import ContextWindow
+
+# 当前线程最近一次建连的耗时(秒)，由计时连接类写入
+_connection_timing = threading.local()
+
+class _TimedConnectionMixin:
+    """记录DNS解析、TCP建连与TLS握手耗时的urllib3连接"""
+    
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            return super()._new_conn()  # 交给urllib3抛出标准的解析错误
+        resolved = time.perf_counter()
+        _connection_timing.dns = resolved - start
+        
+        original_host = self._dns_host
+        last_error = None
+        try:
+            for address in addresses:
+                # 直接连接已解析的地址，避免二次解析
+                self._dns_host = address[4][0]
+                try:
+                    sock = super()._new_conn()
+                    break
+                except Exception as e:
+                    last_error = e
+            else:
+                raise last_error
+        finally:
+            self._dns_host = original_host
+        _connection_timing.connect = time.perf_counter() - resolved
+        return sock
+    
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        elapsed = time.perf_counter() - start
+        _connection_timing.tls = max(0.0, elapsed - getattr(_connection_timing, "dns", 0.0)
+                                     - getattr(_connection_timing, "connect", 0.0))
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """使用计时连接类的连接池适配器"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+def _failed_before_send(error: requests.ConnectionError) -> bool:
+    """请求是否在发出之前就失败了（建连失败或建连超时）；读取超时等发出之后的错误重试会让服务端重复处理"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)  # urllib3的MaxRetryError包着真正的原因
+    return isinstance(reason, NewConnectionError)
+
+class HttpTransport:
+    """
+    基于requests.Session的HTTP传输层
+    
+    连接池复用keep-alive连接，请求带连接/读取超时，遇到429/5xx或请求发出之前的网络错误时按带抖动的
+    指数退避重试（请求已发出后的读取超时、断连不重试，避免重复计费），并记录每次请求的DNS/建连/TLS/首字节/总耗时
+    """
+    
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    
+    def __init__(self,
+                 pool_size: int = 10,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0,
+                 max_retries: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0):
+        """
+        参数:
+            pool_size: 每个主机保持的最大连接数
+            connect_timeout: 建连超时(秒)
+            read_timeout: 读取超时(秒)，流式响应中指两段数据之间的最长间隔
+            max_retries: 最大重试次数(不含首次请求)
+            backoff_base: 退避基准时间(秒)
+            backoff_max: 单次退避上限(秒)
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._local = threading.local()
+        
+        self.session = requests.Session()
+        adapter = _TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    
+    @property
+    def last_timing(self) -> Optional[Dict]:
+        """当前线程最近一次请求的耗时信息"""
+        return getattr(self._local, "timing", None)
+    
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """计算第attempt次重试前的等待时间，优先遵循Retry-After"""
+        if retry_after:
+            try:
+                return min(float(retry_after), 60.0)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+    
+    def post(self, url: str, json: Optional[Dict] = None, headers: Optional[Dict] = None,
+             stream: bool = False) -> requests.Response:
+        """
+        发送POST请求
+        
+        返回的response带有timing属性(毫秒)：dns_ms/connect_ms/tls_ms/ttfb_ms/total_ms、attempts与reused；
+        stream=True时需在读取完响应体后调用finish()补记total_ms
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            _connection_timing.dns = _connection_timing.connect = _connection_timing.tls = 0.0
+            start = time.perf_counter()
+            try:
+                # 始终以流式发送，返回时刚好收到响应头，即首字节时间
+                response = self.session.post(url, json=json, headers=headers, stream=True,
+                                             timeout=(self.connect_timeout, self.read_timeout))
+            except requests.ConnectionError as e:
+                if attempt > self.max_retries or not _failed_before_send(e):
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            ttfb = time.perf_counter() - start
+            
+            if response.status_code in self.RETRY_STATUS and attempt <= self.max_retries:
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+                time.sleep(self._backoff(attempt, retry_after))
+                continue
+            
+            timing = {
+                "dns_ms": round(_connection_timing.dns * 1000, 2),
+                "connect_ms": round(_connection_timing.connect * 1000, 2),
+                "tls_ms": round(_connection_timing.tls * 1000, 2),
+                "ttfb_ms": round(ttfb * 1000, 2),
+                "total_ms": None,
+                "attempts": attempt,
+                "reused": _connection_timing.connect == 0.0,
+                "status": response.status_code,
+            }
+            if not stream:
+                response.content  # 读取完整响应体
+                timing["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            response.timing = timing
+            response.started_at = start
+            self._local.timing = timing
+            return response
+    
+    def finish(self, response: requests.Response):
+        """流式响应读取完毕后补记总耗时"""
+        response.timing["total_ms"] = round((time.perf_counter() - response.started_at) * 1000, 2)
+    
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+class AsyncHttpTransport:
+    """
+    基于aiohttp的异步传输层，连接池、超时与重试策略与HttpTransport一致
+    
+    所有请求都是事件循环上的协程，大量并发请求不再各占一个线程
+    """
+    
+    RETRY_STATUS = HttpTransport.RETRY_STATUS
+    
+    def __init__(self,
+                 pool_size: int = 10,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0,
+                 max_retries: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0):
+        """参数同HttpTransport，pool_size为连接池总连接数上限"""
+        if aiohttp is None:
+            raise ImportError("异步传输层需要aiohttp，请先安装: pip install aiohttp")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sessions: Dict[asyncio.AbstractEventLoop, "aiohttp.ClientSession"] = {}
+    
+    _backoff = HttpTransport._backoff
+    
+    @staticmethod
+    def _build_trace_config():
+        """通过aiohttp的trace钩子记录DNS与建连耗时"""
+        trace = aiohttp.TraceConfig()
+        
+        def mark(name):
+            async def hook(session, ctx, params):
+                ctx.trace_request_ctx[name] = time.perf_counter()
+            return hook
+        
+        trace.on_dns_resolvehost_start.append(mark("dns_start"))
+        trace.on_dns_resolvehost_end.append(mark("dns_end"))
+        trace.on_connection_create_start.append(mark("connect_start"))
+        trace.on_connection_create_end.append(mark("connect_end"))
+        return trace
+    
+    def _get_session(self):
+        """
+        aiohttp会话只能在创建它的事件循环中使用，每个循环各保留一个会话，首次在该循环上使用时创建；
+        循环切换时不替换其它循环的会话，各自的连接仍可复用，关闭时统一释放
+        """
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            # 已关闭的循环无法再关闭其会话，只丢弃引用
+            for stale in [other for other in self._sessions if other.is_closed()]:
+                del self._sessions[stale]
+            session = self._sessions[loop] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+                trace_configs=[self._build_trace_config()],
+            )
+        return session
+    
+    async def post(self, url: str, json: Optional[Dict] = None, headers: Optional[Dict] = None,
+                   stream: bool = False):
+        """
+        发送POST请求，返回aiohttp响应对象，timing属性含义同HttpTransport.post
+        
+        stream=True时需在读取完响应体后调用finish()补记total_ms
+        """
+        session = self._get_session()
+        attempt = 0
+        while True:
+            attempt += 1
+            marks = {}
+            start = time.perf_counter()
+            try:
+                response = await session.post(url, json=json, headers=headers, trace_request_ctx=marks)
+            except _ASYNC_RETRY_ERRORS:
+                if attempt > self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            ttfb = time.perf_counter() - start
+            
+            if response.status in self.RETRY_STATUS and attempt <= self.max_retries:
+                retry_after = response.headers.get("Retry-After")
+                response.release()
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+                continue
+            
+            def span(begin, end):
+                if begin in marks and end in marks:
+                    return round((marks[end] - marks[begin]) * 1000, 2)
+                return 0.0
+            
+            timing = {
+                "dns_ms": span("dns_start", "dns_end"),
+                "connect_ms": span("connect_start", "connect_end"),  # aiohttp的建连耗时包含TLS握手
+                "tls_ms": None,
+                "ttfb_ms": round(ttfb * 1000, 2),
+                "total_ms": None,
+                "attempts": attempt,
+                "reused": "connect_start" not in marks,
+                "status": response.status,
+            }
+            if not stream:
+                await response.read()
+                timing["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            response.timing = timing
+            response.started_at = start
+            return response
+    
+    finish = HttpTransport.finish
+    
+    async def close(self):
+        """关闭所有事件循环上的连接池（其它仍在运行的循环上的会话交给该循环关闭）"""
+        current = asyncio.get_running_loop()
+        sessions, self._sessions = self._sessions, {}
+        for loop, session in sessions.items():
+            if session.closed or loop.is_closed():
+                continue
+            if loop is current:
+                await session.close()
+            elif loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+
+_default_transport: Optional[HttpTransport] = None
+_default_async_transport: Optional[AsyncHttpTransport] = None
+_transport_options: Dict = {}
+_default_transport_lock = threading.Lock()
+
+def get_default_transport() -> HttpTransport:
+    """获取进程内共享的默认传输层"""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HttpTransport(**_transport_options)
+        return _default_transport
+
+def get_default_async_transport() -> AsyncHttpTransport:
+    """获取进程内共享的默认异步传输层"""
+    global _default_async_transport
+    with _default_transport_lock:
+        if _default_async_transport is None:
+            _default_async_transport = AsyncHttpTransport(**_transport_options)
+        return _default_async_transport
+
+def configure_default_transport(**kwargs) -> HttpTransport:
+    """按参数重建共享的默认传输层（同步与异步共用同一组参数），参数同HttpTransport"""
+    global _default_transport, _default_async_transport, _transport_options
+    with _default_transport_lock:
+        if _default_transport is not None:
+            _default_transport.close()
+        _transport_options = dict(kwargs)
+        _default_transport = HttpTransport(**kwargs)
+        _default_async_transport = None  # 异步传输层在事件循环中按需重建
+        return _default_transport
+
+class ChatCancelled(Exception):
+    """调用方通过cancel事件取消了本次请求，用户消息已从历史中撤回"""
+
+class _Exchange:
+    """
+    一次AI请求中与收发方式无关的部分：写入用户消息、构造请求体、逐段解析SSE、记录耗时与usage、
+    录制/回放以及把回复写入历史。AIWife与AsyncAIWife共用，两者只负责发送请求、读取响应与等待
+    """
+
+    def __init__(self, ai: "AIWife", user_message: str, stream: bool, context: Optional[str], route=None):
+        self.ai = ai
+        self.stream = stream
+        ai.add_message("user", user_message)
+        self.message = ai.messages[-1]  # 取消时按对象撤回（上下文裁剪可能改变它的位置）
+        self.finished = False
+        ai.last_usage = None
+        build_started = time.perf_counter()
+        self.payload = ai._build_payload(stream=stream, context=context, route=route)
+        self.build_ms = (time.perf_counter() - build_started) * 1000
+        self.model, self.url, _ = ai._endpoint(route)
+        self.headers = ai._build_headers(route)
+        self.response = None
+        self.entry = None  # 回放模式下匹配到的录制
+        self.started = 0.0  # 计算各段到达时间的起点（perf_counter）
+        self.chunks: List[str] = []
+        self.arrivals: List[float] = []  # 各段到达时相对请求开始的毫秒数（录制用）
+        self.parse_seconds = 0.0
+        if ai.cassette is not None and ai.cassette.replaying:
+            self.entry = ai.cassette.lookup(ai.messages)
+            if self.entry is None:
+                raise RuntimeError("录制中没有与本次请求匹配的回复")
+            ai.last_usage = self.entry.usage
+            ai.last_timing = {"build_ms": round(self.build_ms, 2), "parse_ms": 0.0, "replayed": True}
+
+    # ---- 网络请求 ----
+
+    def start(self, response):
+        """收到响应头后调用"""
+        self.response = response
+        self.started = response.started_at
+        response.timing["build_ms"] = round(self.build_ms, 2)
+        self.ai.last_timing = response.timing
+
+    def feed(self, line: str) -> Optional[str]:
+        """
+        解析一行SSE数据
+        
+        返回:
+            增量文本；非数据行返回None，流结束时返回"[DONE]"
+        """
+        parse_started = time.perf_counter()
+        delta = self.ai._parse_stream_line(line) if line.strip() else None
+        self.parse_seconds += time.perf_counter() - parse_started
+        if delta and delta != "[DONE]":
+            self.arrived(delta)
+        return delta
+
+    def finish_body(self, body: bytes) -> str:
+        """非流式请求：解析完整响应体，返回回复内容"""
+        parse_started = time.perf_counter()
+        data = json.loads(body)
+        self.response.timing["parse_ms"] = round((time.perf_counter() - parse_started) * 1000, 2)
+        self.ai.last_usage = data.get("usage")
+        self.chunks = [data['choices'][0]['message']['content']]
+        self.arrivals = [self.response.timing["total_ms"]]
+        return self.finish()
+
+    # ---- 回放 ----
+
+    def schedule(self) -> Iterator[Tuple[float, str]]:
+        """回放节奏：产出(相对回放开始的秒数, 增量文本)，调用方等到wait()为0后交给arrived()"""
+        self.started = time.perf_counter()
+        return self.entry.schedule(self.ai.cassette.speed)
+
+    def wait(self, at: float) -> float:
+        """距离该段的回放时刻还需等待的秒数"""
+        return at - (time.perf_counter() - self.started)
+
+    # ---- 共用 ----
+
+    def arrived(self, delta: str):
+        """记下一段增量及其到达时间"""
+        elapsed = (time.perf_counter() - self.started) * 1000
+        timing = self.ai.last_timing
+        if not self.chunks:
+            timing["first_token_ms"] = round(elapsed, 2)
+            if self.entry is not None:
+                timing["ttfb_ms"] = timing["first_token_ms"]
+        self.arrivals.append(elapsed)
+        self.chunks.append(delta)
+
+    def finish(self) -> str:
+        """回复完整收到后调用：补记耗时，录制模式下记下回复，写入历史并返回完整回复"""
+        ai = self.ai
+        if self.entry is not None:
+            ai.last_timing["total_ms"] = round((time.perf_counter() - self.started) * 1000, 2)
+        elif self.stream:
+            self.response.timing["parse_ms"] = round(self.parse_seconds * 1000, 2)
+            ai.transport.finish(self.response)
+        text = "".join(self.chunks)
+        if self.entry is None and ai.cassette is not None and ai.cassette.recording:
+            ai.cassette.record(self.model, ai.messages, list(zip(self.arrivals, self.chunks)), self.stream,
+                               ai.last_timing, ai.last_usage)
+        ai.add_message("assistant", text)
+        self.finished = True
+        return text
+
+    def cancel(self):
+        """请求被取消：回复不写入历史，并撤回本次写入的用户消息，历史回到请求之前"""
+        if self.finished:
+            return
+        messages = self.ai.messages
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index] is self.message:
+                del messages[index]
+                break
+
+    def check(self, cancel: Optional[threading.Event]):
+        """同步客户端在每段数据之间检查取消事件，已取消时撤回并抛出ChatCancelled"""
+        if cancel is not None and cancel.is_set():
+            self.cancel()
+            raise ChatCancelled("请求已取消")
+
+class AIWife:
+    """AI聊天功能封装类"""
+    
+    def __init__(self, 
+                 api_key: str = "",
+                 system_prompt: str = "",
+                 temperature: float = 0.7,
+                 max_tokens: int = 1024,
+                 model: str = "Pro/deepseek-ai/DeepSeek-V3",
+                 api_url: str = "https://api.siliconflow.cn/v1/chat/completions",
+                 transport: Optional[HttpTransport] = None,
+                 context_window: Optional[ContextWindow] = None):
+        """
+        初始化AI聊天实例
+        
+        参数:
+            api_key: API密钥
+            system_prompt: 系统提示词
+            temperature: 生成文本的随机性(0-1)
+            max_tokens: 最大生成token数
+            model: 使用的模型名称
+            api_url: API端点URL
+            transport: HTTP传输层，默认使用进程内共享的连接池
+            context_window: 上下文管理器，设置后每次请求前按token预算裁剪历史
+        """
+        self.messages: List[Dict[str, str]] = []
+        self.api_key = api_key
+        self.system_prompt = system_prompt
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.model = model
+        self.api_url = api_url
+        self.max_response_tokens = 10000  # 单次回复最大token限制
+        self.transport = transport or get_default_transport()
+        self.last_timing: Optional[Dict] = None  # 最近一次请求的耗时信息
+        self.last_usage: Optional[Dict] = None  # 最近一次请求的token用量（服务端返回usage时）
+        self.context_window = context_window
+        self.cassette = None  # 请求录制/回放（MorCassette.Cassette），回放时不访问网络
+        
+        # 初始化系统提示
+        if system_prompt:
+            self.messages.append({"role": "system", "content": system_prompt})
+    
+    def set_api_key(self, key: str):
+        """设置API密钥"""
+        self.api_key = key.strip()
+    
+    def set_system_prompt(self, prompt: str):
+        """设置系统提示词"""
+        self.system_prompt = prompt
+        if self.messages and self.messages[0]["role"] == "system":
+            self.messages[0]["content"] = prompt
+        else:
+            self.messages.insert(0, {"role": "system", "content": prompt})
+    
+    def set_max_tokens(self, max_tokens: int) -> Tuple[int, str]:
+        """
+        设置最大token数
+        
+        返回:
+            (实际设置的值, 警告信息)
+        """
+        if max_tokens <= 0:
+            self.max_tokens = 8049
+            return self.max_tokens, "已重置为默认值8049"
+        if max_tokens > self.max_response_tokens:
+            self.max_tokens = self.max_response_tokens
+            return self.max_tokens, f"超过单次回复最大限制，已设置为{self.max_response_tokens}"
+        self.max_tokens = max_tokens
+        return self.max_tokens, ""
+    
+    def set_temperature(self, temperature: float):
+        """设置温度参数(0-1)"""
+        self.temperature = max(0.0, min(1.0, temperature))
+    
+    def add_message(self, role: str, content: str):
+        """添加消息到历史"""
+        self.messages.append({"role": role, "content": content})
+    
+    def clear_history(self):
+        """清空聊天历史"""
+        if self.messages and self.messages[0]["role"] == "system":
+            self.messages = [self.messages[0]]
+        else:
+            self.messages = []
+    
+    def _endpoint(self, route=None) -> Tuple[str, str, str]:
+        """
+        本次请求的(模型, URL, API密钥)
+        route为本次请求使用的模型路由（MorRouter.Route），未单独配置的项沿用实例自身的设置
+        """
+        if route is None:
+            return self.model, self.api_url, self.api_key
+        return route.model or self.model, route.api_url or self.api_url, route.api_key or self.api_key
+    
+    def _build_headers(self, route=None) -> Dict[str, str]:
+        """构造请求头"""
+        return {
+            "Authorization": f"Bearer {self._endpoint(route)[2]}",
+            "Content-Type": "application/json"
+        }
+    
+    def _build_payload(self, stream: bool = False, context: Optional[str] = None, route=None) -> Dict:
+        """
+        构造请求体，设置了上下文管理器时先按预算裁剪历史
+
+        context为只随本次请求发送的补充信息（如检索到的记忆），作为系统消息插在最后一条消息之前，
+        不写入历史
+        """
+        if self.context_window:
+            reserve = self.max_tokens + (self.context_window.counter(context) if context else 0)
+            self.context_window.fit(self.messages, reserve=reserve)
+        messages = self.messages
+        if context:
+            messages = messages[:-1] + [{"role": "system", "content": context}] + messages[-1:]
+        payload = {
+            "model": self._endpoint(route)[0],
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "response_format": {"type": "text"}
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    def _parse_stream_line(self, line: str) -> Optional[str]:
+        """
+        解析一行SSE数据，带有usage的数据块记入last_usage
+        
+        返回:
+            增量文本；非数据行返回None，流结束时返回"[DONE]"
+        """
+        line = line.strip()
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return data
+        chunk = json.loads(data)
+        if chunk.get("usage"):
+            self.last_usage = chunk["usage"]
+        choices = chunk.get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content") or ""
+    
+    def _replay(self, exchange: _Exchange, cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """按录制时的节奏（cassette.speed倍速）产出回复，不访问网络；结束后写入历史"""
+        for at, delta in exchange.schedule():
+            wait = exchange.wait(at)
+            if wait > 0:
+                time.sleep(wait)
+            exchange.check(cancel)
+            exchange.arrived(delta)
+            yield delta
+        exchange.finish()
+    
+    def stream_response(self, user_message: str, context: Optional[str] = None, route=None,
+                        cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        以流式(SSE)方式获取AI回复，逐段产出增量文本
+        
+        完整回复只在流正常结束后才写入历史；请求失败时抛出异常。
+        cancel被设置后在下一段数据到达时停止读取，撤回用户消息并抛出ChatCancelled
+        """
+        if not self.api_key:
+            raise RuntimeError("请先设置API密钥")
+        
+        exchange = _Exchange(self, user_message, True, context, route)
+        if exchange.entry is not None:
+            yield from self._replay(exchange, cancel)
+            return
+        response = self.transport.post(exchange.url, json=exchange.payload, headers=exchange.headers, stream=True)
+        exchange.start(response)
+        try:
+            response.raise_for_status()
+            response.encoding = 'utf-8'  # SSE响应常不带charset，避免中文乱码
+            for line in response.iter_lines(decode_unicode=True):
+                exchange.check(cancel)
+                delta = exchange.feed(line)
+                if delta == "[DONE]":
+                    break
+                if delta:
+                    yield delta
+            exchange.finish()
+        finally:
+            response.close()
+    
+    def get_response(self, user_message: str, stream: bool = False,
+                     on_delta: Optional[Callable[[str, str], None]] = None,
+                     context: Optional[str] = None, route=None,
+                     cancel: Optional[threading.Event] = None) -> str:
+        """
+        获取AI回复
+        
+        参数:
+            user_message: 用户消息
+            stream: 是否使用流式(SSE)响应
+            on_delta: 流式模式下每收到一段增量时回调 on_delta(增量文本, 当前累计文本)
+            context: 只随本次请求发送、不写入历史的补充信息
+            route: 本次请求使用的模型路由（MorRouter.Route），为None时使用model/api_url/api_key
+            cancel: 取消事件（供在其它线程中运行时取消），设置后尽快停止，本次提问不留在历史中
+            
+        返回:
+            AI回复内容或错误信息；被cancel取消时抛出ChatCancelled
+        """
+        if not self.api_key:
+            return "错误：请先设置API密钥"
+        
+        if stream:
+            text = ""
+            try:
+                for delta in self.stream_response(user_message, context=context, route=route, cancel=cancel):
+                    text += delta
+                    if on_delta:
+                        on_delta(delta, text)
+                return text
+            except ChatCancelled:
+                raise
+            except Exception as e:
+                return f"API请求失败: {str(e)}"
+        
+        try:
+            exchange = _Exchange(self, user_message, False, context, route)
+            if exchange.entry is not None:
+                return "".join(self._replay(exchange, cancel))
+            response = self.transport.post(exchange.url, json=exchange.payload, headers=exchange.headers)
+            exchange.check(cancel)
+            exchange.start(response)
+            response.raise_for_status()
+            return exchange.finish_body(response.content)
+        except ChatCancelled:
+            raise
+        except Exception as e:
+            return f"API请求失败: {str(e)}"
+    
+    def chat(self, user_message: str, stream: bool = False,
+             on_delta: Optional[Callable[[str, str], None]] = None,
+             context: Optional[str] = None, route=None,
+             cancel: Optional[threading.Event] = None) -> str:
+        """与get_response功能相同，提供更简洁的接口"""
+        return self.get_response(user_message, stream=stream, on_delta=on_delta, context=context, route=route,
+                                 cancel=cancel)
+
+class AsyncAIWife(AIWife):
+    """
+    AIWife的asyncio版本，get_response/chat/stream_response均为协程
+    
+    消息历史、提示词与参数设置与AIWife完全一致，请求经由AsyncHttpTransport发出；
+    请求体、SSE解析、计时与录制/回放由同一个_Exchange完成，这里只有收发与等待是异步的。
+    协程被取消时撤回本次写入的用户消息，历史回到请求之前（取代同步版本的cancel事件）
+    """
+    
+    def __init__(self, *args, transport: Optional[AsyncHttpTransport] = None, **kwargs):
+        super().__init__(*args, transport=transport or get_default_async_transport(), **kwargs)
+    
+    async def _replay(self, exchange: _Exchange) -> AsyncIterator[str]:
+        """同AIWife._replay，等待时不阻塞事件循环"""
+        for at, delta in exchange.schedule():
+            wait = exchange.wait(at)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            exchange.arrived(delta)
+            yield delta
+        exchange.finish()
+    
+    async def stream_response(self, user_message: str, context: Optional[str] = None,
+                              route=None) -> AsyncIterator[str]:
+        """同AIWife.stream_response"""
+        if not self.api_key:
+            raise RuntimeError("请先设置API密钥")
+        
+        exchange = _Exchange(self, user_message, True, context, route)
+        try:
+            if exchange.entry is not None:
+                async for delta in self._replay(exchange):
+                    yield delta
+                return
+            response = await self.transport.post(exchange.url, json=exchange.payload, headers=exchange.headers, stream=True)
+            exchange.start(response)
+            try:
+                response.raise_for_status()
+                async for raw_line in response.content:
+                    delta = exchange.feed(raw_line.decode('utf-8', errors='replace'))
+                    if delta == "[DONE]":
+                        break
+                    if delta:
+                        yield delta
+                exchange.finish()
+            finally:
+                response.release()
+        except asyncio.CancelledError:
+            exchange.cancel()
+            raise
+    
+    async def get_response(self, user_message: str, stream: bool = False,
+                           on_delta: Optional[Callable[[str, str], None]] = None,
+                           context: Optional[str] = None, route=None) -> str:
+        """参数与返回值同AIWife.get_response"""
+        if not self.api_key:
+            return "错误：请先设置API密钥"
+        
+        if stream:
+            text = ""
+            try:
+                async for delta in self.stream_response(user_message, context=context, route=route):
+                    text += delta
+                    if on_delta:
+                        on_delta(delta, text)
+                return text
+            except Exception as e:
+                return f"API请求失败: {str(e)}"
+        
+        exchange = None
+        try:
+            exchange = _Exchange(self, user_message, False, context, route)
+            if exchange.entry is not None:
+                return "".join([delta async for delta in self._replay(exchange)])
+            response = await self.transport.post(exchange.url, json=exchange.payload, headers=exchange.headers)
+            exchange.start(response)
+            response.raise_for_status()
+            return exchange.finish_body(await response.read())
+        except asyncio.CancelledError:
+            if exchange is not None:
+                exchange.cancel()
+            raise
+        except Exception as e:
+            return f"API请求失败: {str(e)}"
+    
+    async def chat(self, user_message: str, stream: bool = False,
+                   on_delta: Optional[Callable[[str, str], None]] = None,
+                   context: Optional[str] = None, route=None) -> str:
+        """与get_response功能相同，提供更简洁的接口"""
+        return await self.get_response(user_message, stream=stream, on_delta=on_delta, context=context, route=route)
@@ -0,0 +1,585 @@
+import sys
+import os
+import queue
+import threading
+import time
+import asyncio
+import concurrent.futures
+from collections import OrderedDict
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
+                            QTextEdit, QLineEdit, QPushButton, QLabel, QScrollArea, QSizePolicy,
+                            QFrame, QGridLayout, QListView, QStyledItemDelegate, QAbstractItemView)
+from PyQt5.QtCore import QTimer, Qt, QObject, pyqtSignal, QSize, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QFont, QTextCursor, QPalette, QColor, QKeySequence, QTextDocument
+
+# 导入核心功能模块
+from MorMain import MorSystem, async_process_user_message, visible_stream_text
+from AILoop import get_event_loop_thread
+from MorSnapshot import initialize_session
+from MorTurns import TurnScheduler
+from MorEvents import PRIORITY_SYSTEM, PRIORITY_USER
+from MorTranscript import TranscriptStore, TranscriptWindow
+from PyQt5.QtGui import QMovie
+
+class MessageBroker(QObject):
+    """用于线程间通信的信号代理"""
+    system_message = pyqtSignal(str)
+    ai_response = pyqtSignal(str)
+    ai_partial = pyqtSignal(str)  # 流式回复的当前累计文本
+    user_message = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+    status_update = pyqtSignal(str)
+    turn_cancelled = pyqtSignal()
+
+class TranscriptModel(QAbstractListModel):
+    """把TranscriptWindow的增删转成Qt的行插入/删除通知，视图只重绘变化的行"""
+
+    def __init__(self, window, parent=None):
+        super().__init__(parent)
+        self.window = window
+        window.observer = self
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.window)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.window):
+            return None
+        entry = self.window[index.row()]
+        if role == Qt.DisplayRole:
+            return entry.html
+        if role == Qt.UserRole:
+            return entry.key
+        return None
+
+    # TranscriptWindow的observer接口
+    def begin_insert(self, first, last):
+        self.beginInsertRows(QModelIndex(), first, last)
+
+    def end_insert(self):
+        self.endInsertRows()
+
+    def begin_remove(self, first, last):
+        self.beginRemoveRows(QModelIndex(), first, last)
+
+    def end_remove(self):
+        self.endRemoveRows()
+
+    def changed(self, row):
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+class TranscriptDelegate(QStyledItemDelegate):
+    """
+    用QTextDocument绘制每条消息的HTML
+
+    排版结果按(消息key, 宽度)缓存，新消息只排版它自己；
+    字体变化时清空缓存，宽度变化时自然换用新的缓存项
+    """
+
+    PADDING = 8
+
+    def __init__(self, view, font, cache_size=1000):
+        super().__init__(view)
+        self.view = view
+        self.font = font
+        self.cache_size = cache_size
+        self._documents = OrderedDict()
+
+    def set_font(self, font):
+        self.font = font
+        self._documents.clear()
+
+    def _document(self, index):
+        width = max(50, self.view.viewport().width() - 2 * self.PADDING)
+        key = (index.data(Qt.UserRole), width)
+        document = self._documents.get(key)
+        if document is not None:
+            self._documents.move_to_end(key)
+            return document
+        document = QTextDocument()
+        document.setDefaultFont(self.font)
+        document.setHtml(index.data(Qt.DisplayRole) or "")
+        document.setTextWidth(width)
+        self._documents[key] = document
+        if len(self._documents) > self.cache_size:
+            self._documents.popitem(last=False)
+        return document
+
+    def paint(self, painter, option, index):
+        document = self._document(index)
+        painter.save()
+        painter.translate(option.rect.left() + self.PADDING, option.rect.top())
+        document.drawContents(painter)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        document = self._document(index)
+        return QSize(int(document.textWidth()) + 2 * self.PADDING, int(document.size().height()))
+
+class ChatGUI(QMainWindow):
+    CONVERSATION = "main"  # 桌宠只有一个会话，用户输入、提醒与初始化序列都排在它的队列里
+    MAX_PENDING_TURNS = 8
+    TRANSCRIPT_MAX_ITEMS = 300  # 聊天区最多显示的消息条数，更早的消息向上翻动时从transcript.db分页读取
+    TRANSCRIPT_PAGE_SIZE = 50
+
+    def __init__(self, ai, system):
+        super().__init__()
+        self.ai = ai
+        self.system = system
+        self.broker = MessageBroker()
+        self.loop = get_event_loop_thread()  # 所有AI对话协程共用的事件循环
+        self.base_font_size = 10  # 基础字体大小
+        self.base_window_size = QSize(400, 500)  # 基础窗口大小
+        self.transcript = TranscriptWindow(TranscriptStore("transcript.db", session=system.session_id),
+                                           max_items=self.TRANSCRIPT_MAX_ITEMS,
+                                           page_size=self.TRANSCRIPT_PAGE_SIZE)
+        self.init_ui()
+        self.setup_workers()
+        
+        # 连接信号
+        self.broker.system_message.connect(self.display_system_message)
+        self.broker.ai_response.connect(self.display_ai_message)
+        self.broker.ai_partial.connect(self.display_ai_partial)
+        self.broker.user_message.connect(self.process_user_input)
+        self.broker.error_occurred.connect(self.display_error)
+        self.broker.status_update.connect(self.update_status)
+        self.broker.turn_cancelled.connect(self.on_turn_cancelled)
+        
+        # 启动初始化序列
+        QTimer.singleShot(100, self.run_init_sequence)
+        
+        # 初始化完成标志
+        self.initialization_complete = False
+
+    def init_ui(self):
+        """初始化用户界面"""
+        self.setWindowTitle("AI Companion System")
+        self.setGeometry(500, 100, self.base_window_size.width(), self.base_window_size.height())
+        
+        # 设置主窗口背景为透明
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.WindowMinMaxButtonsHint)
+        
+        # 主布局
+        main_widget = QWidget()
+        self.main_layout = QGridLayout(main_widget)
+        self.main_layout.setContentsMargins(5, 5, 5, 5)  # 减小整体边距
+        self.main_layout.setSpacing(3)  # 减小整体间距
+        
+        # 设置主部件透明
+        main_widget.setAttribute(Qt.WA_TranslucentBackground)
+        
+        # === 状态栏 - 减小高度 ===
+        self.status_label = QLabel("系统正在初始化...")
+        self.status_label.setStyleSheet("""
+            background-color: rgba(240, 240, 240, 180);
+            color: #333;
+            padding: 2px 5px;
+            border-radius: 3px;
+            font-size: 9pt;
+            min-height: 20px;
+            max-height: 20px;
+        """)
+        self.status_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+        self.main_layout.addWidget(self.status_label, 0, 0, 1, 2)
+        
+        # === 聊天区域 ===
+        chat_container = QWidget()
+        chat_layout = QVBoxLayout(chat_container)
+        chat_layout.setContentsMargins(0, 0, 0, 0)
+        
+        # 聊天记录用模型/视图列表显示：只为可见的行绘制，消息数有上限
+        self.chat_display = QListView()
+        self.transcript_model = TranscriptModel(self.transcript, self.chat_display)
+        self.chat_display.setModel(self.transcript_model)
+        self.transcript_delegate = TranscriptDelegate(self.chat_display, QFont("Arial", self.base_font_size))
+        self.chat_display.setItemDelegate(self.transcript_delegate)
+        self.chat_display.setResizeMode(QListView.Adjust)
+        self.chat_display.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.chat_display.setSelectionMode(QAbstractItemView.NoSelection)
+        self.chat_display.setFocusPolicy(Qt.NoFocus)
+        self.chat_display.setUniformItemSizes(False)
+        self.chat_display.setStyleSheet("""
+            background-color: white;
+            color: #333333;
+            border: 1px solid #d0d0d0;
+            border-radius: 8px;
+            padding: 8px;
+        """)
+        self.chat_display.verticalScrollBar().valueChanged.connect(self.on_transcript_scrolled)
+        chat_layout.addWidget(self.chat_display)
+        
+        # 将聊天区域添加到网格布局的第1行第0列
+        self.main_layout.addWidget(chat_container, 1, 0, 2, 1)
+        
+        # === 右上角正方形区域 ===
+        self.square_container = QFrame()
+        self.square_container.setStyleSheet("""
+            background-color: white;
+            border: 1px solid #d0d0d0;
+            border-radius: 8px;
+        """)
+        self.square_container.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+
+                # 创建用于显示GIF的标签
+        self.gif_label = QLabel(self.square_container)
+        self.gif_label.setAlignment(Qt.AlignCenter)
+
+        # 设置GIF
+        gif_path = os.path.join("gif", "01.gif")
+        if os.path.exists(gif_path):
+            movie = QMovie(gif_path)
+            self.gif_label.setMovie(movie)
+            movie.start()
+        else:
+            self.gif_label.setText("GIF未找到")
+
+        # 将GIF标签添加到容器中
+        square_layout = QVBoxLayout(self.square_container)
+        square_layout.setContentsMargins(0, 0, 0, 0)
+        square_layout.addWidget(self.gif_label)
+        self.main_layout.addWidget(self.square_container, 1, 1)
+        
+        # === 输入区域 ===
+        input_container = QWidget()
+        input_layout = QVBoxLayout(input_container)
+        input_layout.setContentsMargins(0, 0, 0, 0)
+        input_layout.setSpacing(3)  # 减小内部间距
+        
+        self.user_input = QLineEdit()
+        self.user_input.setFont(QFont("Arial", self.base_font_size))
+        self.user_input.setStyleSheet("""
+            background-color: white;
+            color: #333333;
+            border: 1px solid #d0d0d0;
+            border-radius: 5px;
+            padding: 8px;
+        """)
+        self.user_input.returnPressed.connect(self.send_message)
+        
+        send_button = QPushButton("发送")
+        send_button.setFont(QFont("Arial", self.base_font_size, QFont.Bold))
+        send_button.setStyleSheet("""
+            background-color: rgba(74, 134, 232, 180);
+            color: white;
+            padding: 6px 12px;
+            border-radius: 3px;
+        """)
+        send_button.clicked.connect(self.send_message)
+        
+        input_layout.addWidget(self.user_input)  # 移除了"输入消息:"标签以减少高度
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        button_layout.addWidget(send_button)
+        input_layout.addLayout(button_layout)
+        
+        # 将输入区域添加到第3行第0列
+        self.main_layout.addWidget(input_container, 3, 0, 1, 1)  # 跨越1列
+        
+        self.setCentralWidget(main_widget)
+        
+        self.broker.status_update.emit("系统就绪，等待输入")
+
+    def resizeEvent(self, event):
+        """窗口大小改变时调整正方形尺寸"""
+        super().resizeEvent(event)
+        window_size = self.size()
+        square_size = min(window_size.height() * 0.25, window_size.height() * 0.25)
+        self.square_container.setFixedSize(int(square_size), int(square_size))
+
+    def keyPressEvent(self, event):
+        """处理键盘快捷键"""
+        if event.key() == Qt.Key_Escape:  # Esc 取消正在进行和排队中的对话
+            if self.turns.cancel(self.CONVERSATION):
+                self.broker.status_update.emit("已取消当前对话")
+        if event.modifiers() == Qt.ControlModifier:
+            if event.key() == Qt.Key_Plus:  # Ctrl + "+" 放大
+                self.zoom_in()
+            elif event.key() == Qt.Key_Minus:  # Ctrl + "-" 缩小
+                self.zoom_out()
+        super().keyPressEvent(event)
+
+    def zoom_in(self):
+        """放大窗口和字体"""
+        self.base_font_size += 1
+        self.resize(self.width() * 1.1, self.height() * 1.1)
+        self.update_font_sizes()
+
+    def zoom_out(self):
+        """缩小窗口和字体"""
+        if self.base_font_size > 8:  # 最小字体大小限制
+            self.base_font_size -= 1
+            self.resize(self.width() * 0.9, self.height() * 0.9)
+            self.update_font_sizes()
+
+    def update_font_sizes(self):
+        """更新所有控件的字体大小"""
+        self.transcript_delegate.set_font(QFont("Arial", self.base_font_size))
+        self.chat_display.doItemsLayout()
+        self.user_input.setFont(QFont("Arial", self.base_font_size))
+        self.status_label.setStyleSheet(f"""
+            background-color: rgba(240, 240, 240, 180);
+            color: #333;
+            padding: 2px 5px;
+            border-radius: 3px;
+            font-size: {self.base_font_size-1}pt;
+            min-height: 20px;
+            max-height: 20px;
+        """)
+
+    def setup_workers(self):
+        """创建对话轮次调度器：同一会话的轮次按顺序执行，由固定数量的工作协程处理"""
+        self.turns = TurnScheduler(self.run_turn, workers=3, max_pending=self.MAX_PENDING_TURNS,
+                                   loop_thread=self.loop)
+        self.system_turn = None  # 尚未完成的系统事件轮次
+
+    def send_message(self):
+        """发送用户消息"""
+        user_text = self.user_input.text().strip()
+        if user_text and self.turns.is_full(self.CONVERSATION):
+            # 背压：队列已满时保留输入框中的内容，等AI处理完再发送
+            self.broker.status_update.emit("AI正忙，排队的消息已满，请稍后再发送")
+            return
+        if user_text:
+            self.display_user_message(user_text)
+            self.user_input.clear()
+            self.broker.user_message.emit(user_text)
+
+    def format_ai_message(self, message):
+        """生成AI回复的HTML"""
+        formatted_message = message.replace('\n', '<br>')
+        return f'<div style="color:#e60073; margin-bottom:12px;"><b>Nike:</b> {formatted_message}</div>'
+
+    def display_ai_partial(self, text):
+        """原地刷新流式回复行，只展示可见部分"""
+        visible = visible_stream_text(text)
+        if not visible:
+            self.clear_stream_block()
+            return
+        follow = self.is_at_bottom()
+        self.transcript.set_partial(self.format_ai_message(visible))
+        if follow:
+            self.scroll_to_bottom()
+
+    def clear_stream_block(self):
+        """移除流式回复行"""
+        self.transcript.clear_partial()
+
+    def append_transcript(self, role, html):
+        """保存一条消息并显示；之前停在底部时跟随滚动，正在翻看历史时不打扰"""
+        follow = self.is_at_bottom()
+        self.transcript.append(role, html)
+        if follow:
+            self.scroll_to_bottom()
+
+    def display_ai_message(self, message):
+        """显示AI回复（流式回复结束时以最终内容替换流式行）"""
+        self.clear_stream_block()
+        if message and not message.startswith("NULL"):
+            self.append_transcript("ai", self.format_ai_message(message))
+
+    def display_user_message(self, message):
+        """显示用户消息"""
+        formatted_message = message.replace('\n', '<br>')
+        self.append_transcript("user", f'<div style="color:#1a75ff; margin-bottom:8px;"><b>你:</b> {formatted_message}</div>')
+
+    def display_system_message(self, message):
+        """显示系统消息"""
+        if "初始化完成" in message or "设置提醒" in message:
+            formatted_message = message.replace('\n', '<br>')
+            self.append_transcript("system", f'<div style="color:#009900; margin-bottom:5px;"><i>系统:</i> {formatted_message}</div>')
+
+    def display_error(self, error):
+        """显示错误消息"""
+        formatted_message = error.replace('\n', '<br>')
+        self.append_transcript("error", f'<div style="color:#ff0000; margin-bottom:12px;"><b>错误:</b> {formatted_message}</div>')
+
+    def update_status(self, status):
+        """更新状态栏"""
+        self.status_label.setText(status)
+
+    def is_at_bottom(self):
+        """聊天区是否停在最新消息处"""
+        bar = self.chat_display.verticalScrollBar()
+        return self.transcript.at_latest and bar.value() >= bar.maximum() - 4
+
+    def scroll_to_bottom(self):
+        """滚动到聊天底部"""
+        QTimer.singleShot(0, self.chat_display.scrollToBottom)  # 等新插入的行完成布局
+
+    def on_transcript_scrolled(self, value):
+        """翻到顶部时读入更早的一页，翻到底部时读回较新的一页，并保持当前看到的消息不动"""
+        bar = self.chat_display.verticalScrollBar()
+        if value <= bar.minimum() and self.transcript.has_older:
+            loaded = self.transcript.load_older()
+            if loaded:
+                self.chat_display.scrollTo(self.transcript_model.index(loaded), QAbstractItemView.PositionAtTop)
+        elif value >= bar.maximum() and not self.transcript.at_latest:
+            last = len(self.transcript) - 1
+            loaded = self.transcript.load_newer()
+            if loaded:
+                trimmed = last + 1 + loaded - len(self.transcript)  # 顶部被裁掉的行数
+                self.chat_display.scrollTo(self.transcript_model.index(max(0, last - trimmed)),
+                                           QAbstractItemView.PositionAtBottom)
+
+    def run_init_sequence(self):
+        """执行初始化序列（作为会话队列中的第一轮，之前发送的消息排在它后面）"""
+        future = self.turns.submit(self.CONVERSATION, "", source="init", priority=PRIORITY_USER)
+        future.add_done_callback(self.on_init_done)
+        # 系统事件（提醒、CMD输出等）由MorSystem的聚合器推送，不再定时轮询
+        self.system.events.connect(self.on_system_batch, gate=self.system_events_ready)
+
+    async def initialize(self):
+        init_file = "Init.txt"
+        if os.path.exists(init_file):
+            self.broker.status_update.emit("执行初始化序列...")
+            # 提示词、Init.txt与模型都没变时直接从快照恢复，不再逐条重放
+            restored = await initialize_session(self.ai, self.system, init_file=init_file,
+                                                on_response=self.broker.ai_response.emit)
+            self.broker.status_update.emit("已从快照恢复，系统就绪" if restored else "初始化完成，系统就绪")
+            self.broker.system_message.emit("初始化完成")
+        else:
+            self.broker.status_update.emit("未找到初始化文件")
+
+    def on_init_done(self, future):
+        try:
+            future.result()
+        except concurrent.futures.CancelledError:
+            self.broker.status_update.emit("初始化已取消")
+        except Exception as e:
+            self.broker.error_occurred.emit(f"初始化错误: {str(e)}")
+        finally:
+            self.initialization_complete = True
+            # 初始化结束1秒后再发出第一条消息；本回调在事件循环线程中执行，不能用QTimer定时
+            loop = self.loop.loop
+            loop.call_soon_threadsafe(loop.call_later, 1.0, self.broker.user_message.emit, "额头太高了")
+
+    async def run_turn(self, turn):
+        """调度器工作协程中执行一轮：初始化序列或一条用户/系统消息"""
+        if turn.source == "init":
+            return await self.initialize()
+        return await async_process_user_message(
+            turn.text, self.ai, self.system,
+            on_delta=lambda delta, text: self.broker.ai_partial.emit(text), source=turn.source,
+            queue_wait=turn.started_at - turn.enqueued_at)
+
+    def process_user_input(self, user_input, source="user", priority=PRIORITY_USER):
+        """把消息排入会话队列（用户输入排在排队中的系统事件之前），完成后通过信号回到Qt主线程"""
+        future = self.turns.submit(self.CONVERSATION, user_input, source=source, priority=priority)
+        if future is None:
+            self.broker.error_occurred.emit("对话队列已满，消息未发送")
+            return None
+        future.add_done_callback(self.on_turn_done)
+        return future
+
+    def on_turn_done(self, future):
+        """对话轮次结束回调（在事件循环线程中执行，只通过信号与界面交互）"""
+        try:
+            self.broker.ai_response.emit(future.result())
+        except concurrent.futures.CancelledError:
+            self.broker.turn_cancelled.emit()
+        except Exception as e:
+            self.broker.error_occurred.emit(f"处理消息时出错: {str(e)}")
+        finally:
+            self.system.events.kick()  # 积压的系统事件可以投递了
+
+    def on_turn_cancelled(self):
+        """轮次被取消"""
+        self.clear_stream_block()
+
+    def system_events_ready(self):
+        """
+        上一轮系统事件处理完且会话队列未满时才投递下一批；
+        在此之前到达的提醒、CMD输出继续在聚合器中合并，最终只触发一轮对话
+        """
+        return ((self.system_turn is None or self.system_turn.done())
+                and not self.turns.is_full(self.CONVERSATION))
+
+    def on_system_batch(self, batch):
+        """一批系统事件（在事件循环线程中调用）：逐条显示，合成一轮对话排入会话队列"""
+        try:
+            for event in batch.events:
+                self.broker.system_message.emit(event.text)
+            if batch.size > 1:
+                self.broker.status_update.emit(f"已将{batch.size}条系统消息合并为一轮对话")
+            self.system_turn = self.process_user_input(batch.text, source=batch.source, priority=PRIORITY_SYSTEM)
+        except Exception as e:
+            self.broker.error_occurred.emit(f"系统消息处理错误: {str(e)}")
+
+    def closeEvent(self, event):
+        """关闭窗口时的清理工作"""
+        self.turns.close()
+        self.system.shutdown()
+        self.transcript.store.close()  # 提交尚在队列中的聊天记录
+        self.broker.status_update.emit("系统关闭中...")
+        time.sleep(0.5)
+        event.accept()
+        
+    def mousePressEvent(self, event):
+        """支持拖动窗口"""
+        if event.button() == Qt.LeftButton:
+            self.drag_start_position = event.globalPos() - self.frameGeometry().topLeft()
+            event.accept()
+            
+    def mouseMoveEvent(self, event):
+        """支持拖动窗口"""
+        if event.buttons() == Qt.LeftButton:
+            self.move(event.globalPos() - self.drag_start_position)
+            event.accept()
+
+def run_gui(ai, system) -> int:
+    """创建QApplication与桌宠窗口并进入Qt事件循环，返回退出码"""
+    app = QApplication(sys.argv)
+    app.setStyle("Fusion")
+    app.setStyleSheet("""
+        QMainWindow {
+            background: transparent;
+        }
+        QWidget {
+            background: transparent;
+            color: #333333;
+        }
+        QPushButton {
+            background-color: rgba(74, 134, 232, 180);
+            color: white;
+            border: none;
+            padding: 6px 12px;
+            border-radius: 3px;
+        }
+        QPushButton:hover {
+            background-color: rgba(59, 125, 224, 200);
+        }
+        QPushButton:pressed {
+            background-color: rgba(45, 98, 184, 200);
+        }
+        QLineEdit {
+            background-color: white;
+            color: #333333;
+            border: 1px solid #d0d0d0;
+            padding: 8px;
+            border-radius: 5px;
+        }
+        QLabel {
+            color: #333333;
+            background: transparent;
+        }
+        QScrollArea {
+            border: none;
+            background: transparent;
+        }
+        QScrollBar:vertical {
+            background: transparent;
+            width: 8px;
+            margin: 0px;
+        }
+        QScrollBar::handle:vertical {
+            background: rgba(100, 100, 100, 100);
+            min-height: 20px;
+            border-radius: 4px;
+        }
+    """)
+    
+    window = ChatGUI(ai, system)
+    window.show()
+    return app.exec_()
@@ -1,475 +1,269 @@
-import sys
-import os
-import queue
-import threading
-import time
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                            QTextEdit, QLineEdit, QPushButton, QLabel, QScrollArea, QSizePolicy,
-                            QFrame, QGridLayout)
-from PyQt5.QtCore import QTimer, Qt, QObject, pyqtSignal, QSize
-from PyQt5.QtGui import QFont, QTextCursor, QPalette, QColor, QKeySequence
-
-# 导入核心功能模块
-from MorMain import MorSystem, process_user_message
-from AIchat import AIWife
-from PyQt5.QtGui import QMovie
-
-class MessageBroker(QObject):
-    """用于线程间通信的信号代理"""
-    system_message = pyqtSignal(str)
-    ai_response = pyqtSignal(str)
-    user_message = pyqtSignal(str)
-    error_occurred = pyqtSignal(str)
-    status_update = pyqtSignal(str)
-
-class ChatGUI(QMainWindow):
-    def __init__(self, ai, system):
-        super().__init__()
-        self.ai = ai
-        self.system = system
-        self.broker = MessageBroker()
-        self.base_font_size = 10  # 基础字体大小
-        self.base_window_size = QSize(400, 500)  # 基础窗口大小
-        self.init_ui()
-        self.setup_workers()
-        
-        # 连接信号
-        self.broker.system_message.connect(self.display_system_message)
-        self.broker.ai_response.connect(self.display_ai_message)
-        self.broker.user_message.connect(self.process_user_input)
-        self.broker.error_occurred.connect(self.display_error)
-        self.broker.status_update.connect(self.update_status)
-        
-        # 启动初始化序列
-        QTimer.singleShot(100, self.run_init_sequence)
-        
-        # 初始化完成标志
-        self.initialization_complete = False
-
-    def init_ui(self):
-        """初始化用户界面"""
-        self.setWindowTitle("AI Companion System")
-        self.setGeometry(500, 100, self.base_window_size.width(), self.base_window_size.height())
-        
-        # 设置主窗口背景为透明
-        self.setAttribute(Qt.WA_TranslucentBackground)
-        self.setWindowFlags(Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.WindowMinMaxButtonsHint)
-        
-        # 主布局
-        main_widget = QWidget()
-        self.main_layout = QGridLayout(main_widget)
-        self.main_layout.setContentsMargins(5, 5, 5, 5)  # 减小整体边距
-        self.main_layout.setSpacing(3)  # 减小整体间距
-        
-        # 设置主部件透明
-        main_widget.setAttribute(Qt.WA_TranslucentBackground)
-        
-        # === 状态栏 - 减小高度 ===
-        self.status_label = QLabel("系统正在初始化...")
-        self.status_label.setStyleSheet("""
-            background-color: rgba(240, 240, 240, 180);
-            color: #333;
-            padding: 2px 5px;
-            border-radius: 3px;
-            font-size: 9pt;
-            min-height: 20px;
-            max-height: 20px;
-        """)
-        self.status_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
-        self.main_layout.addWidget(self.status_label, 0, 0, 1, 2)
-        
-        # === 聊天区域 ===
-        chat_container = QWidget()
-        chat_layout = QVBoxLayout(chat_container)
-        chat_layout.setContentsMargins(0, 0, 0, 0)
-        
-        self.chat_display = QTextEdit()
-        self.chat_display.setReadOnly(True)
-        self.chat_display.setFont(QFont("Arial", self.base_font_size))
-        self.chat_display.setStyleSheet("""
-            background-color: white;
-            color: #333333;
-            border: 1px solid #d0d0d0;
-            border-radius: 8px;
-            padding: 8px;
-        """)
-        
-        chat_scroll = QScrollArea()
-        chat_scroll.setWidgetResizable(True)
-        chat_scroll.setWidget(self.chat_display)
-        chat_scroll.setStyleSheet("background: transparent; border: none;")
-        chat_layout.addWidget(chat_scroll)
-        
-        # 将聊天区域添加到网格布局的第1行第0列
-        self.main_layout.addWidget(chat_container, 1, 0, 2, 1)
-        
-        # === 右上角正方形区域 ===
-        self.square_container = QFrame()
-        self.square_container.setStyleSheet("""
-            background-color: white;
-            border: 1px solid #d0d0d0;
-            border-radius: 8px;
-        """)
-        self.square_container.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-
-                # 创建用于显示GIF的标签
-        self.gif_label = QLabel(self.square_container)
-        self.gif_label.setAlignment(Qt.AlignCenter)
-
-        # 设置GIF
-        gif_path = os.path.join("gif", "01.gif")
-        if os.path.exists(gif_path):
-            movie = QMovie(gif_path)
-            self.gif_label.setMovie(movie)
-            movie.start()
-        else:
-            self.gif_label.setText("GIF未找到")
-
-        # 将GIF标签添加到容器中
-        square_layout = QVBoxLayout(self.square_container)
-        square_layout.setContentsMargins(0, 0, 0, 0)
-        square_layout.addWidget(self.gif_label)
-        self.main_layout.addWidget(self.square_container, 1, 1)
-        
-        # === 输入区域 ===
-        input_container = QWidget()
-        input_layout = QVBoxLayout(input_container)
-        input_layout.setContentsMargins(0, 0, 0, 0)
-        input_layout.setSpacing(3)  # 减小内部间距
-        
-        self.user_input = QLineEdit()
-        self.user_input.setFont(QFont("Arial", self.base_font_size))
-        self.user_input.setStyleSheet("""
-            background-color: white;
-            color: #333333;
-            border: 1px solid #d0d0d0;
-            border-radius: 5px;
-            padding: 8px;
-        """)
-        self.user_input.returnPressed.connect(self.send_message)
-        
-        send_button = QPushButton("发送")
-        send_button.setFont(QFont("Arial", self.base_font_size, QFont.Bold))
-        send_button.setStyleSheet("""
-            background-color: rgba(74, 134, 232, 180);
-            color: white;
-            padding: 6px 12px;
-            border-radius: 3px;
-        """)
-        send_button.clicked.connect(self.send_message)
-        
-        input_layout.addWidget(self.user_input)  # 移除了"输入消息:"标签以减少高度
-        button_layout = QHBoxLayout()
-        button_layout.addStretch()
-        button_layout.addWidget(send_button)
-        input_layout.addLayout(button_layout)
-        
-        # 将输入区域添加到第3行第0列
-        self.main_layout.addWidget(input_container, 3, 0, 1, 1)  # 跨越1列
-        
-        self.setCentralWidget(main_widget)
-        
-        # 系统计时器
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.check_system_messages)
-        self.timer.start(500)
-        
-        self.broker.status_update.emit("系统就绪，等待输入")
-
-    def resizeEvent(self, event):
-        """窗口大小改变时调整正方形尺寸"""
-        super().resizeEvent(event)
-        window_size = self.size()
-        square_size = min(window_size.height() * 0.25, window_size.height() * 0.25)
-        self.square_container.setFixedSize(int(square_size), int(square_size))
-
-    def keyPressEvent(self, event):
-        """处理键盘快捷键"""
-        if event.modifiers() == Qt.ControlModifier:
-            if event.key() == Qt.Key_Plus:  # Ctrl + "+" 放大
-                self.zoom_in()
-            elif event.key() == Qt.Key_Minus:  # Ctrl + "-" 缩小
-                self.zoom_out()
-        super().keyPressEvent(event)
-
-    def zoom_in(self):
-        """放大窗口和字体"""
-        self.base_font_size += 1
-        self.resize(self.width() * 1.1, self.height() * 1.1)
-        self.update_font_sizes()
-
-    def zoom_out(self):
-        """缩小窗口和字体"""
-        if self.base_font_size > 8:  # 最小字体大小限制
-            self.base_font_size -= 1
-            self.resize(self.width() * 0.9, self.height() * 0.9)
-            self.update_font_sizes()
-
-    def update_font_sizes(self):
-        """更新所有控件的字体大小"""
-        self.chat_display.setFont(QFont("Arial", self.base_font_size))
-        self.user_input.setFont(QFont("Arial", self.base_font_size))
-        self.status_label.setStyleSheet(f"""
-            background-color: rgba(240, 240, 240, 180);
-            color: #333;
-            padding: 2px 5px;
-            border-radius: 3px;
-            font-size: {self.base_font_size-1}pt;
-            min-height: 20px;
-            max-height: 20px;
-        """)
-
-    # 以下方法保持不变...
-    def setup_workers(self):
-        """设置后台工作线程"""
-        self.message_worker = threading.Thread(target=self.handle_system_messages)
-        self.message_worker.daemon = True
-        self.message_worker.start()
-        
-        self.ai_thread_pool = []
-        for _ in range(3):
-            thread = threading.Thread(target=self.ai_processing_worker)
-            thread.daemon = True
-            thread.start()
-            self.ai_thread_pool.append(thread)
-        
-        self.error_handler = threading.Thread(target=self.error_handling_worker)
-        self.error_handler.daemon = True
-        self.error_handler.start()
-
-    def send_message(self):
-        """发送用户消息"""
-        user_text = self.user_input.text().strip()
-        if user_text:
-            self.display_user_message(user_text)
-            self.user_input.clear()
-            self.broker.user_message.emit(user_text)
-
-    def display_ai_message(self, message):
-        """显示AI回复"""
-        if message and not message.startswith("NULL"):
-            formatted_message = message.replace('\n', '<br>')
-            self.chat_display.append(f'<div style="color:#e60073; margin-bottom:12px;"><b>Nike:</b> {formatted_message}</div>')
-            self.scroll_to_bottom()
-
-    def display_user_message(self, message):
-        """显示用户消息"""
-        formatted_message = message.replace('\n', '<br>')
-        self.chat_display.append(f'<div style="color:#1a75ff; margin-bottom:8px;"><b>你:</b> {formatted_message}</div>')
-        self.scroll_to_bottom()
-
-    def display_system_message(self, message):
-        """显示系统消息"""
-        if "初始化完成" in message or "设置提醒" in message:
-            formatted_message = message.replace('\n', '<br>')
-            self.chat_display.append(f'<div style="color:#009900; margin-bottom:5px;"><i>系统:</i> {formatted_message}</div>')
-            self.scroll_to_bottom()
-
-    def display_error(self, error):
-        """显示错误消息"""
-        formatted_message = error.replace('\n', '<br>')
-        self.chat_display.append(f'<div style="color:#ff0000; margin-bottom:12px;"><b>错误:</b> {formatted_message}</div>')
-        self.scroll_to_bottom()
-
-    def update_status(self, status):
-        """更新状态栏"""
-        self.status_label.setText(status)
-
-    def scroll_to_bottom(self):
-        """滚动到聊天底部"""
-        self.chat_display.moveCursor(QTextCursor.End)
-        self.chat_display.ensureCursorVisible()
-
-    def run_init_sequence(self):
-        """执行初始化序列"""
-        def init_worker():
-            try:
-                init_file = "Init.txt"
-                if os.path.exists(init_file):
-                    self.broker.status_update.emit("执行初始化序列...")
-                    with open(init_file, 'r', encoding='utf-8') as f:
-                        for line_num, line in enumerate(f, 1):
-                            line = line.strip()
-                            if line and not line.startswith('#'):
-                                response = process_user_message(line, self.ai, self.system)
-                                if response:
-                                    self.broker.ai_response.emit(response)
-                                time.sleep(0.5)
-                    self.broker.status_update.emit("初始化完成，系统就绪")
-                    self.broker.system_message.emit("初始化完成")
-                else:
-                    self.broker.status_update.emit("未找到初始化文件")
-            except Exception as e:
-                self.broker.error_occurred.emit(f"初始化错误: {str(e)}")
-            finally:
-                self.initialization_complete = True
-                QTimer.singleShot(1000, lambda: self.broker.user_message.emit("额头太高了"))
-        
-        init_thread = threading.Thread(target=init_worker)
-        init_thread.daemon = True
-        init_thread.start()
-
-    def process_user_input(self, user_input):
-        """处理用户输入"""
-        def process():
-            try:
-                response = process_user_message(user_input, self.ai, self.system)
-                self.broker.ai_response.emit(response)
-            except Exception as e:
-                self.broker.error_occurred.emit(f"处理消息时出错: {str(e)}")
-        
-        thread = threading.Thread(target=process)
-        thread.daemon = True
-        thread.start()
-
-    def check_system_messages(self):
-        """检查系统消息队列"""
-        try:
-            while not self.system.message_queue.empty():
-                msg = self.system.message_queue.get()
-                self.broker.system_message.emit(msg)
-                self.broker.user_message.emit(msg)
-        except Exception as e:
-            self.broker.error_occurred.emit(f"系统消息处理错误: {str(e)}")
-
-    def handle_system_messages(self):
-        """后台处理系统消息"""
-        while self.system.running:
-            try:
-                time.sleep(0.3)
-            except Exception as e:
-                self.broker.error_occurred.emit(f"系统处理线程错误: {str(e)}")
-                time.sleep(1)
-
-    def ai_processing_worker(self):
-        """AI处理工作线程"""
-        while True:
-            time.sleep(1)
-
-    def error_handling_worker(self):
-        """错误处理工作线程"""
-        while True:
-            time.sleep(5)
-
-    def closeEvent(self, event):
-        """关闭窗口时的清理工作"""
-        self.system.shutdown()
-        self.broker.status_update.emit("系统关闭中...")
-        self.timer.stop()
-        time.sleep(0.5)
-        event.accept()
-        
-    def mousePressEvent(self, event):
-        """支持拖动窗口"""
-        if event.button() == Qt.LeftButton:
-            self.drag_start_position = event.globalPos() - self.frameGeometry().topLeft()
-            event.accept()
-            
-    def mouseMoveEvent(self, event):
-        """支持拖动窗口"""
-        if event.buttons() == Qt.LeftButton:
-            self.move(event.globalPos() - self.drag_start_position)
-            event.accept()
-
-# 以下main()函数保持不变...
-def load_key_config():
-    """从Key.txt加载API密钥配置"""
-    config = {}
-    try:
-        with open("Key.txt", 'r') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                if '=' in line:
-                    key, value = line.split('=', 1)
-                    config[key.strip()] = value.strip()
-        required_keys = ['api_key', 'api_url', 'model']
-        for key in required_keys:
-            if key not in config:
-                raise ValueError(f"Key.txt中缺少必需的配置项: {key}")
-        return config
-    except FileNotFoundError:
-        raise FileNotFoundError("找不到Key.txt配置文件")
-    except Exception as e:
-        raise RuntimeError(f"加载Key.txt配置出错: {str(e)}")
-
-def main():
-    try:
-        key_config = load_key_config()
-        print(f"成功加载API配置: {key_config}")
-    except Exception as e:
-        print(f"致命错误: {str(e)}")
-        sys.exit(1)
-    
-    ai = AIWife()
-    ai.api_key = key_config['api_key']
-    ai.api_url = key_config['api_url']
-    ai.model = key_config['model']
-    
-    system = MorSystem(ai)
-    
-    try:
-        with open("System_prompt.txt", 'r', encoding='utf-8') as f:
-            system_prompt = f.read()
-            ai.set_system_prompt(system_prompt)
-            system._log_entry("SYSTEM", "系统提示词已加载", "SYSTEM")
-    except FileNotFoundError:
-        print("警告: 未找到系统提示词文件 System_prompt.txt")
-    
-    app = QApplication(sys.argv)
-    app.setStyle("Fusion")
-    app.setStyleSheet("""
-        QMainWindow {
-            background: transparent;
-        }
-        QWidget {
-            background: transparent;
-            color: #333333;
-        }
-        QPushButton {
-            background-color: rgba(74, 134, 232, 180);
-            color: white;
-            border: none;
-            padding: 6px 12px;
-            border-radius: 3px;
-        }
-        QPushButton:hover {
-            background-color: rgba(59, 125, 224, 200);
-        }
-        QPushButton:pressed {
-            background-color: rgba(45, 98, 184, 200);
-        }
-        QLineEdit {
-            background-color: white;
-            color: #333333;
-            border: 1px solid #d0d0d0;
-            padding: 8px;
-            border-radius: 5px;
-        }
-        QLabel {
-            color: #333333;
-            background: transparent;
-        }
-        QScrollArea {
-            border: none;
-            background: transparent;
-        }
-        QScrollBar:vertical {
-            background: transparent;
-            width: 8px;
-            margin: 0px;
-        }
-        QScrollBar::handle:vertical {
-            background: rgba(100, 100, 100, 100);
-            min-height: 20px;
-            border-radius: 4px;
-        }
-    """)
-    
-    window = ChatGUI(ai, system)
-    window.show()
-    sys.exit(app.exec_())
-
-if __name__ == "__main__":
+import sys
+import argparse
+from datetime import datetime
+
+# 导入核心功能模块（不导入PyQt5，图形界面只在需要时加载，无界面模式不依赖它）
+from MorMain import MorSystem, ShellPool
+from AIchat import AIWife, AsyncAIWife, ASYNC_AVAILABLE, configure_default_transport
+from AIContext import create_context_window
+from MorWorker import PythonWorkerPool
+from MorMemory import MemoryStore
+from MorSummarizer import SummaryWorker
+from MorRetrieval import MemoryRetriever
+from MorLog import AsyncLogWriter
+from MorRouter import ModelRouter, Route, SOURCES
+from MorMetrics import MetricsRegistry
+from MorCassette import Cassette
+
+def load_key_config():
+    """从Key.txt加载API密钥配置"""
+    config = {}
+    try:
+        with open("Key.txt", 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    config[key.strip()] = value.strip()
+        required_keys = ['api_key', 'api_url', 'model']
+        for key in required_keys:
+            if key not in config:
+                raise ValueError(f"Key.txt中缺少必需的配置项: {key}")
+        return config
+    except FileNotFoundError:
+        raise FileNotFoundError("找不到Key.txt配置文件")
+    except Exception as e:
+        raise RuntimeError(f"加载Key.txt配置出错: {str(e)}")
+
+def load_transport_options(config):
+    """从Key.txt的可选配置项中读取连接池/超时/重试参数"""
+    options = {}
+    for key, cast in (("pool_size", int), ("connect_timeout", float),
+                      ("read_timeout", float), ("max_retries", int)):
+        if config.get(key):
+            options[key] = cast(config[key])
+    return options
+
+def load_context_window(config):
+    """根据Key.txt的可选配置项context_budget/context_policy创建上下文管理器"""
+    if not config.get("context_budget"):
+        return None
+    return create_context_window(int(config["context_budget"]), config.get("context_policy") or "drop")
+
+def load_python_pool(config):
+    """根据Key.txt的可选配置项创建Rcte工作进程池"""
+    options = {}
+    for key, name, cast in (("rcte_workers", "size", int), ("rcte_timeout", "timeout", float),
+                            ("rcte_memory_mb", "memory_limit_mb", int), ("rcte_max_jobs", "max_jobs", int)):
+        if config.get(key):
+            options[name] = cast(config[key])
+    if config.get("rcte_preload"):
+        options["preload"] = config["rcte_preload"].split(",")
+    return PythonWorkerPool(**options)
+
+def load_model_router(config):
+    """
+    从Key.txt读取路由配置：
+        route_<名称>_model / route_<名称>_url / route_<名称>_key  定义一条路由（url与key可省略，沿用主配置）
+        route_user / route_system / route_timer / route_tool      各来源使用的路由名
+        route_escalate = false                                    关闭含命令块时转交主模型
+    只定义了fast路由而未写规则时，system/timer/tool默认使用fast
+    """
+    routes = {}
+    rules = {}
+    for key, value in config.items():
+        if not key.startswith("route_") or key == "route_escalate":
+            continue
+        name = key[len("route_"):]
+        for suffix, attr in (("_model", "model"), ("_url", "api_url"), ("_key", "api_key")):
+            if name.endswith(suffix):
+                route_name = name[:-len(suffix)]
+                route = routes.setdefault(route_name, Route(route_name))
+                setattr(route, attr, value)
+                break
+        else:
+            if name in SOURCES:
+                rules[name] = value
+    if "fast" in routes and not rules:
+        rules = {"system": "fast", "timer": "fast", "tool": "fast"}
+    escalate = config.get("route_escalate", "true").lower() != "false"
+    return ModelRouter(routes, rules, escalate=escalate)
+
+def load_metrics(config, on_error=None):
+    """
+    根据Key.txt的可选配置项创建轮次指标：metrics_file（轮次结束后写出JSON快照）、
+    metrics_interval（两次写出快照的最短间隔，秒，默认1）、metrics_profile_dir（按轮cProfile采样）
+    """
+    return MetricsRegistry(snapshot_path=config.get("metrics_file") or None,
+                           profile_dir=config.get("metrics_profile_dir") or None,
+                           snapshot_interval=float(config.get("metrics_interval") or 1),
+                           on_error=on_error)
+
+def log_errors(log_writer, source, message):
+    """各会话共用的组件出错时写入共用日志的回调（格式同MorSystem._log_entry）"""
+    def on_error(error):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        log_writer.write(f"[{timestamp}] [ERROR] [{source}] {message}: {str(error)}\n")
+    return on_error
+
+def load_cassette(config, on_error=None):
+    """
+    根据Key.txt的可选配置项创建请求录制：cassette（录制文件路径）、cassette_mode（record录制 / replay回放，默认record）、
+    cassette_speed（回放速度，1为原始节奏，默认0即不等待）；未配置cassette时返回None
+    """
+    if not config.get("cassette"):
+        return None
+    return Cassette(config["cassette"], mode=config.get("cassette_mode") or "record",
+                    speed=float(config.get("cassette_speed") or 0), on_error=on_error)
+
+def load_system_prompt():
+    """读取System_prompt.txt，不存在时返回None"""
+    try:
+        with open("System_prompt.txt", 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        print("警告: 未找到系统提示词文件 System_prompt.txt", file=sys.stderr)
+        return None
+
+def create_ai(key_config, system_prompt=None, cassette=None):
+    """根据Key.txt配置创建AI实例（连接池与录制为进程内共用）"""
+    ai = AsyncAIWife() if ASYNC_AVAILABLE else AIWife()
+    ai.context_window = load_context_window(key_config)
+    ai.cassette = cassette
+    ai.api_key = key_config['api_key']
+    ai.api_url = key_config['api_url']
+    ai.model = key_config['model']
+    if system_prompt is not None:
+        ai.set_system_prompt(system_prompt)
+    return ai
+
+def configure_system(system, key_config):
+    """把Key.txt中的对话相关选项应用到MorSystem"""
+    for key in ("memory_top_k", "memory_budget"):
+        if key_config.get(key):
+            setattr(system, key, int(key_config[key]))
+    system.stream_execute = key_config.get("stream_execute", "true").lower() != "false"
+    # 系统事件合并窗口：最后一条事件后等待event_window秒，最长不超过event_max_wait秒
+    if key_config.get("event_window"):
+        system.events.window = float(key_config["event_window"])
+    if key_config.get("event_max_wait"):
+        system.events.max_wait = float(key_config["event_max_wait"])
+
+def create_agent(key_config):
+    """根据Key.txt配置创建AI实例与MorSystem（图形界面与无界面模式共用）"""
+    system_prompt = load_system_prompt()
+    ai = create_ai(key_config, system_prompt, load_cassette(key_config))
+    
+    command_workers = int(key_config.get("command_workers") or 4)
+    memory = MemoryStore(key_config.get("memory_db") or "memory.db")
+    retriever = MemoryRetriever(memory)
+    summarizer = SummaryWorker(memory, ai, model=key_config.get("summary_model") or None,
+                               max_concurrency=int(key_config.get("summary_concurrency") or 1))
+    system = MorSystem(ai, python_pool=load_python_pool(key_config), command_workers=command_workers,
+                       memory=memory, retriever=retriever, summarizer=summarizer)
+    configure_system(system, key_config)
+    system.router = load_model_router(key_config)
+    system.metrics = load_metrics(
+        key_config, on_error=lambda e: system._log_entry("ERROR", f"写出指标失败: {str(e)}", "METRICS"))
+    if ai.cassette is not None:
+        ai.cassette.on_error = lambda e: system._log_entry("ERROR", f"写入录制失败: {str(e)}", "CASSETTE")
+        if ai.cassette.rebuilt:
+            system._log_entry("WARNING", f"录制索引不完整，已从数据文件补齐{ai.cassette.rebuilt}条", "CASSETTE")
+    if system_prompt is not None:
+        system._log_entry("SYSTEM", "系统提示词已加载", "SYSTEM")
+    return ai, system
+
+def create_session_manager(key_config):
+    """
+    创建多会话服务的会话管理器：所有会话共用连接池、Rcte工作进程池、CMD控制台上限、
+    记忆库（按会话隔离检索与摘要）和日志文件
+    """
+    from MorServer import SessionManager
+    
+    system_prompt = load_system_prompt()
+    log_writer = AsyncLogWriter("ServerLog.log", compress=True)
+    # 所有会话写入同一个录制文件
+    cassette = load_cassette(key_config, on_error=log_errors(log_writer, "CASSETTE", "写入录制失败"))
+    command_workers = int(key_config.get("command_workers") or 4)
+    python_pool = load_python_pool(key_config)
+    shell_pool = ShellPool(int(key_config.get("server_shells") or 16))
+    memory = MemoryStore(key_config.get("memory_db") or "memory.db")
+    retriever = MemoryRetriever(memory)
+    summarizer = SummaryWorker(memory, create_ai(key_config, cassette=cassette), model=key_config.get("summary_model") or None,
+                               max_concurrency=int(key_config.get("summary_concurrency") or 1),
+                               per_session=True)
+    router = load_model_router(key_config)  # 各会话共用，计数为全部会话的合计
+    metrics = load_metrics(key_config, on_error=log_errors(log_writer, "METRICS", "写出指标失败"))
+    
+    def factory(session_id, reminders):
+        ai = create_ai(key_config, system_prompt, cassette)
+        system = MorSystem(ai, log_writer=log_writer, python_pool=python_pool, command_workers=command_workers,
+                           memory=memory, retriever=retriever, summarizer=summarizer,
+                           session_id=session_id, reminders=reminders, shell_pool=shell_pool)
+        system.log_tag = session_id
+        system.memory_isolated = True
+        configure_system(system, key_config)
+        system.router = router
+        system.metrics = metrics
+        return ai, system
+    
+    def close_shared():
+        python_pool.close()
+        summarizer.stop()
+        memory.close()
+        retriever.save()
+        log_writer.close()
+    
+    options = {}
+    for key, name, cast in (("server_max_sessions", "max_active", int), ("server_idle_timeout", "idle_timeout", float),
+                            ("server_max_turns", "max_turns", int)):
+        if key_config.get(key):
+            options[name] = cast(key_config[key])
+    manager = SessionManager(factory, state_dir=key_config.get("server_state_dir") or "sessions",
+                             on_close=close_shared, log_writer=log_writer, **options)
+    manager.router = router
+    manager.metrics = metrics
+    manager.cassette = cassette
+    return manager
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI桌宠Agent")
+    parser.add_argument("--headless", action="store_true",
+                        help="无界面模式：通过stdin/stdout按行收发JSON")
+    parser.add_argument("--socket", metavar="HOST:PORT",
+                        help="无界面模式：在本地TCP端口上按行收发JSON（隐含--headless）")
+    parser.add_argument("--serve", metavar="HOST:PORT",
+                        help="多会话服务：在HTTP/WebSocket接口上托管多个相互隔离的会话")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    headless = args.headless or bool(args.socket) or bool(args.serve)
+    try:
+        key_config = load_key_config()
+        # 无界面模式下stdout是协议通道，提示信息写到stderr
+        print(f"成功加载API配置: {key_config}", file=sys.stderr if headless else sys.stdout)
+        configure_default_transport(**load_transport_options(key_config))
+        if args.serve:
+            manager = create_session_manager(key_config)
+        else:
+            ai, system = create_agent(key_config)
+    except Exception as e:
+        print(f"致命错误: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    
+    if args.serve:
+        from MorServer import run_server
+        sys.exit(run_server(manager, args.serve))
+    
+    if headless:
+        from MorDaemon import run_daemon
+        sys.exit(run_daemon(ai, system, socket_address=args.socket))
+    
+    from ChatGUI import run_gui
+    sys.exit(run_gui(ai, system))
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
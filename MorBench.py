@@ -0,0 +1,683 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import itertools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, List, Tuple, Callable
+
+try:
+    import psutil  # 可选，用于读取常驻内存；不可用时Linux下读/proc
+except ImportError:
+    psutil = None
+
+from AIchat import AIWife, AsyncAIWife, ASYNC_AVAILABLE
+from AIContext import estimate_tokens
+from AILoop import get_event_loop_thread
+from MorMain import MorSystem, process_user_message
+from MorParser import CommandParser, extract_command_blocks
+from MorScheduler import ReminderScheduler
+from MorWorker import PythonWorkerPool
+from MorMemory import MemoryStore
+from MorRetrieval import MemoryRetriever
+from MorSummarizer import SummaryWorker
+from MorLog import AsyncLogWriter
+from MorMetrics import Histogram, MetricsRegistry
+from MorCassette import Cassette
+
+# 模拟服务的回复：按最后一条消息是否包含关键字依次匹配，关键字为空的一项兜底
+DEFAULT_REPLIES = [
+    ("命令执行结果", "好的，都处理完了，还有什么需要吗？"),
+    ("[System", "NULL"),
+    ("bench:rcte", "我来算一下~Rcte{\nimport math\nprint(round(sum(math.sqrt(i) for i in range(1000)), 3))\n}"),
+    ("bench:cmd", "看看控制台Cmd{echo bench}"),
+    ("bench:time", "好的，一小时后提醒你Time{喝水,3600}"),
+    ("bench:multi", "都安排上Rcte{print({'a': [1, 2, 3]})}Cmd{echo multi}Time{休息一下,3600}"),
+    ("", "好的主人，有什么可以帮你的吗？"),
+]
+
+# 端到端对话场景依次发送的消息类型
+TURN_KINDS = ("chat", "rcte", "cmd", "time", "multi")
+# 回放录制时跳过的请求：命令结果反馈与CMD输入提示由轮次自身产生，不作为新一轮的输入
+TURN_INTERNAL_PREFIXES = ("命令执行结果", "[CMD")
+BENCH_SYSTEM_PROMPT = "你是桌宠助手（压测）"
+
+def rss_mb() -> Optional[float]:
+    """当前进程的常驻内存(MB)；没有psutil且不是Linux时返回None"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1048576
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持连接，与真实服务一样复用连接池
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        mock: "MockChatServer" = self.server.mock
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"未知路径: {self.path}"}})
+            return
+        try:
+            payload = json.loads(body)
+            messages = payload["messages"]
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {"error": {"message": "请求体不是合法的chat/completions请求"}})
+            return
+        reply = mock.reply_for(messages)
+        usage = {"prompt_tokens": sum(estimate_tokens(m.get("content") or "") for m in messages),
+                 "completion_tokens": estimate_tokens(reply)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        mock.count(payload.get("stream", False))
+        chunks = [reply[i:i + mock.chunk_chars] for i in range(0, len(reply), mock.chunk_chars)] or [""]
+        time.sleep(mock.latency())
+        if not payload.get("stream"):
+            time.sleep(mock.chunk_ms * len(chunks) / 1000)
+            self._send_json(200, {"id": "bench", "object": "chat.completion", "model": payload.get("model"),
+                                  "choices": [{"index": 0, "message": {"role": "assistant", "content": reply},
+                                               "finish_reason": "stop"}],
+                                  "usage": usage})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, chunk in enumerate(chunks):
+                if i:
+                    time.sleep(mock.chunk_ms / 1000)
+                self._send_event({"choices": [{"index": 0, "delta": {"content": chunk}}]})
+            self._send_event({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage})
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # 客户端提前断开（如流式请求被取消）
+
+    def _send_event(self, data: Dict):
+        self._send_chunk(("data: " + json.dumps(data, ensure_ascii=False) + "\n\n").encode("utf-8"))
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, status: int, data: Dict):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class MockChatServer:
+    """
+    本地的OpenAI兼容/v1/chat/completions模拟服务，不需要网络与API密钥
+
+    回复从replies中按关键字选取（可含Rcte/Cmd/Time命令块），支持流式(SSE)与非流式响应并返回usage；
+    latency_ms为首字节前的延迟（另加±jitter_ms的随机抖动），流式时每段chunk_chars个字符、段间隔chunk_ms，
+    非流式时按同样的生成时间一次返回
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 replies: Optional[List[Tuple[str, str]]] = None,
+                 latency_ms: float = 50.0, jitter_ms: float = 0.0,
+                 chunk_ms: float = 2.0, chunk_chars: int = 4):
+        self.replies = replies or DEFAULT_REPLIES
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.chunk_ms = chunk_ms
+        self.chunk_chars = max(1, chunk_chars)
+        self.requests = 0
+        self.stream_requests = 0
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def reply_for(self, messages: List[Dict]) -> str:
+        content = (messages[-1].get("content") or "") if messages else ""
+        for keyword, reply in self.replies:
+            if keyword in content:
+                return reply
+        return "NULL"
+
+    def latency(self) -> float:
+        """本次请求首字节前等待的秒数"""
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def count(self, stream: bool):
+        with self._lock:
+            self.requests += 1
+            self.stream_requests += 1 if stream else 0
+
+    def start(self) -> "MockChatServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MockChatServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class MemorySampler:
+    """后台线程每隔interval秒记录一次常驻内存，得到整个压测过程中的内存曲线"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.samples: List[Tuple[float, float]] = []  # (相对开始的秒数, MB)
+        self._start = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._worker, name="MemorySampler", daemon=True)
+
+    def start(self) -> "MemorySampler":
+        self.sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def sample(self) -> Optional[float]:
+        value = rss_mb()
+        if value is not None:
+            self.samples.append((round(time.perf_counter() - self._start, 3), round(value, 2)))
+        return value
+
+    def window(self, begin: float, end: float) -> Dict:
+        """begin~end（perf_counter时刻）之间的内存：开始、结束与峰值"""
+        begin, end = begin - self._start, end - self._start
+        values = [mb for t, mb in self.samples if begin <= t <= end]
+        if not values:
+            return {}
+        return {"rss_start_mb": values[0], "rss_end_mb": values[-1], "rss_peak_mb": max(values)}
+
+    def _worker(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+class BenchResult:
+    """一个场景的结果：操作数、耗时、逐次延迟的直方图与失败数"""
+
+    def __init__(self, name: str, unit: str = "ops"):
+        self.name = name
+        self.unit = unit
+        self.latency = Histogram(window=1 << 20)
+        self.errors = 0
+        self.last_error = ""
+        self.seconds = 0.0
+        self.memory: Dict = {}
+        self.extra: Dict = {}
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms: float, ok: bool = True, error: str = ""):
+        with self._lock:
+            self.latency.add(elapsed_ms)
+            if not ok:
+                self.errors += 1
+                self.last_error = error or self.last_error
+
+    @property
+    def throughput(self) -> float:
+        return self.latency.count / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> Dict:
+        data = {
+            "unit": self.unit,
+            "count": self.latency.count,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "throughput": round(self.throughput, 2),
+            "latency_ms": self.latency.summary(),
+            "memory": self.memory,
+        }
+        if self.last_error:
+            data["last_error"] = self.last_error
+        data.update(self.extra)
+        return data
+
+def run_load(result: BenchResult, fn: Callable[[int, int], bool], count: int, concurrency: int = 1) -> BenchResult:
+    """
+    用concurrency个线程共执行count次fn(线程序号, 序号)，逐次记录延迟；
+    fn返回False或抛出异常记为失败。同一线程序号的调用不会并发，可按序号分配各自的实例
+    """
+    counter = itertools.count()
+
+    def worker(index: int):
+        while True:
+            i = next(counter)
+            if i >= count:
+                return
+            started = time.perf_counter()
+            try:
+                ok, error = fn(index, i) is not False, ""
+            except Exception as e:
+                ok, error = False, str(e)
+            result.record((time.perf_counter() - started) * 1000, ok, error)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(max(1, concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.seconds += time.perf_counter() - started
+    return result
+
+def _failed(response: str) -> bool:
+    return response.startswith("API请求失败") or response.startswith("错误：")
+
+class Benchmark:
+    """
+    离线压测：启动本地模拟服务，按场景驱动命令块解析、AIWife请求、完整对话轮次（process_user_message）、
+    提醒调度与CMD控制台，统计各场景的吞吐、延迟分位数与内存变化
+
+    会话日志、记忆库等文件写到临时目录（或workdir），结束后删除临时目录
+    """
+
+    SCENARIOS = ("parser", "aiwife", "aiwife_async", "turns", "reminders", "cmd", "replay")
+
+    def __init__(self, iterations: int = 200, concurrency: int = 4, latency_ms: float = 50.0,
+                 jitter_ms: float = 0.0, chunk_ms: float = 2.0, chunk_chars: int = 4,
+                 reminders: int = 2000, workdir: Optional[str] = None, memory_interval: float = 0.5,
+                 cassette: Optional[str] = None, replay_speed: float = 0.0, system_prompt: Optional[str] = None):
+        """
+        参数:
+            iterations: 每个网络场景的请求/轮次数（parser场景为其50倍）
+            concurrency: 并发线程或协程数
+            latency_ms / jitter_ms / chunk_ms / chunk_chars: 模拟服务的延迟与流式分段设置
+            reminders: reminders场景添加的提醒数
+            workdir: 日志与记忆库的目录，默认使用临时目录
+            memory_interval: 内存采样间隔(秒)
+            cassette / replay_speed: replay场景回放的录制文件与回放速度（1为原始节奏，0为不等待）
+            system_prompt: replay场景使用的系统提示词，与录制时相同才能按哈希命中
+        """
+        self.iterations = max(1, iterations)
+        self.concurrency = max(1, concurrency)
+        self.reminders = max(1, reminders)
+        self.mock_options = {"latency_ms": latency_ms, "jitter_ms": jitter_ms,
+                             "chunk_ms": chunk_ms, "chunk_chars": chunk_chars}
+        self.workdir = workdir
+        self.memory_interval = memory_interval
+        self.cassette = cassette
+        self.replay_speed = replay_speed
+        self.system_prompt = system_prompt
+        self.server: Optional[MockChatServer] = None
+        self.sampler: Optional[MemorySampler] = None
+        self._shared = None
+
+    def config(self) -> Dict:
+        return {"iterations": self.iterations, "concurrency": self.concurrency,
+                "reminders": self.reminders, "cassette": self.cassette, "replay_speed": self.replay_speed,
+                **self.mock_options}
+
+    def run(self, names: Optional[List[str]] = None,
+            progress: Optional[Callable[[str, BenchResult], None]] = None) -> Dict:
+        """依次运行各场景，返回JSON可序列化的报告"""
+        names = list(names or self.SCENARIOS)
+        for name in names:
+            if name not in self.SCENARIOS:
+                raise ValueError(f"未知的场景: {name}（可选: {', '.join(self.SCENARIOS)}）")
+        temp_dir = None
+        if self.workdir is None:
+            temp_dir = self.workdir = tempfile.mkdtemp(prefix="morbench-")
+        self.server = MockChatServer(**self.mock_options).start()
+        self.sampler = MemorySampler(self.memory_interval).start()
+        scenarios = {}
+        try:
+            for name in names:
+                started = time.perf_counter()
+                self.sampler.sample()
+                for result in getattr(self, f"bench_{name}")():
+                    self.sampler.sample()
+                    result.memory = self.sampler.window(started, time.perf_counter())
+                    scenarios[result.name] = result.to_dict()
+                    if progress is not None:
+                        progress(result.name, result)
+        finally:
+            self._close_shared()
+            self.sampler.stop()
+            self.server.stop()
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                self.workdir = None
+        return {
+            "time": time.time(),
+            "platform": sys.platform,
+            "python": sys.version.split()[0],
+            "config": self.config(),
+            "scenarios": scenarios,
+            "mock_requests": {"total": self.server.requests, "stream": self.server.stream_requests},
+            "memory": {"samples": self.sampler.samples},
+        }
+
+    # ---- 场景 ----
+
+    def bench_parser(self) -> List[BenchResult]:
+        """整条回复解析与按流式分段增量解析，纯CPU"""
+        corpus = [reply for _, reply in DEFAULT_REPLIES]
+        corpus.append("".join(f"第{i}步Rcte{{\nd = {{'k': '{{}}'}}\nprint(d)  # }}\n}}Cmd{{echo \"{i}}}\"}}"
+                              for i in range(20)))
+        count = self.iterations * 50
+        whole = run_load(BenchResult("parser"),
+                         lambda _, i: bool(extract_command_blocks(corpus[i % len(corpus)])), count)
+
+        def feed(_, i):
+            text = corpus[i % len(corpus)]
+            parser = CommandParser()
+            for start in range(0, len(text), 4):
+                parser.feed(text[start:start + 4])
+            parser.finish()
+
+        stream = run_load(BenchResult("parser_stream"), feed, count)
+        return [whole, stream]
+
+    def _new_ai(self, ai_class=AIWife, system_prompt: str = BENCH_SYSTEM_PROMPT) -> AIWife:
+        return ai_class(api_key="bench", api_url=self.server.url, model="bench-main", system_prompt=system_prompt)
+
+    def bench_aiwife(self) -> List[BenchResult]:
+        """同步AIWife：concurrency个线程各用一个实例，流式与非流式各iterations次"""
+        results = []
+        for name, stream in (("aiwife", False), ("aiwife_stream", True)):
+            ais = [self._new_ai() for _ in range(self.concurrency)]
+
+            def chat(worker, i, ais=ais, stream=stream):
+                ai = ais[worker]
+                ai.clear_history()  # 每次请求的上下文长度保持一致
+                return not _failed(ai.chat(f"bench:chat #{i}", stream=stream))
+
+            results.append(run_load(BenchResult(name), chat, self.iterations, self.concurrency))
+        return results
+
+    def bench_aiwife_async(self) -> List[BenchResult]:
+        """AsyncAIWife：在共享事件循环上并发concurrency个协程（需要aiohttp）"""
+        if not ASYNC_AVAILABLE:
+            return []
+        result = BenchResult("aiwife_async")
+        counter = itertools.count()
+
+        async def worker():
+            ai = self._new_ai(AsyncAIWife)
+            while next(counter) < self.iterations:
+                ai.clear_history()
+                started = time.perf_counter()
+                response = await ai.chat("bench:chat", stream=True)
+                result.record((time.perf_counter() - started) * 1000, not _failed(response), response[:200])
+
+        async def run_all():
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+        started = time.perf_counter()
+        get_event_loop_thread().run(run_all())
+        result.seconds = time.perf_counter() - started
+        return [result]
+
+    def bench_turns(self) -> List[BenchResult]:
+        """
+        完整对话轮次：每个线程一个AIWife + MorSystem，依次发送闲聊、Rcte、Cmd、Time与多命令消息，
+        命令真实执行（Rcte进工作进程、Cmd进控制台、Time进提醒调度器），结果再反馈给模拟服务
+        """
+        metrics = MetricsRegistry()
+        agents = [self._new_agent(metrics) for _ in range(self.concurrency)]
+        startup = self._warm_up([system for _, system in agents])
+        kinds = {kind: Histogram() for kind in TURN_KINDS}
+        kinds_lock = threading.Lock()
+        result = BenchResult("turns", unit="turns")
+
+        def turn(worker, i):
+            ai, system = agents[worker]
+            kind = TURN_KINDS[i % len(TURN_KINDS)]
+            started = time.perf_counter()
+            response = process_user_message(f"bench:{kind} #{i}", ai, system)
+            with kinds_lock:
+                kinds[kind].add((time.perf_counter() - started) * 1000)
+            if len(ai.messages) > 41:
+                ai.clear_history()
+            return not _failed(response)
+
+        try:
+            run_load(result, turn, self.iterations, self.concurrency)
+        finally:
+            for _, system in agents:
+                self._release_agent(system)
+        result.extra["console_startup_ms"] = startup.latency.summary()
+        result.extra["kinds_ms"] = {kind: histogram.summary() for kind, histogram in kinds.items()}
+        result.extra["phases_ms"] = metrics.snapshot(recent=0)["phases_ms"]
+        return [result]
+
+    def bench_reminders(self) -> List[BenchResult]:
+        """提醒调度器：添加大量1秒内到期的提醒，统计添加耗时与触发延迟（实际触发时刻晚于到期时刻的毫秒数）"""
+        add = BenchResult("reminders_add")
+        fired = BenchResult("reminders", unit="fires")
+        done = threading.Event()
+
+        def on_fire(reminder):
+            fired.record((time.monotonic() - reminder.due) * 1000)
+            if fired.latency.count >= self.reminders:
+                done.set()
+
+        scheduler = ReminderScheduler(on_fire)
+        scheduler.start()
+        rng = random.Random(0)
+        started = time.perf_counter()
+        run_load(add, lambda _, i: bool(scheduler.add(f"bench {i}", rng.uniform(0.05, 1.0))), self.reminders)
+        done.wait(30)
+        fired.seconds = time.perf_counter() - started
+        scheduler.stop()
+        fired.errors = self.reminders - fired.latency.count  # 超时仍未触发的提醒
+        return [add, fired]
+
+    def bench_cmd(self) -> List[BenchResult]:
+        """CMD控制台：逐条执行短命令的往返延迟，以及一条大量输出的命令的读取速度"""
+        _, system = self._new_agent(MetricsRegistry())
+        result = BenchResult("cmd", unit="commands")
+        result.extra["console_startup_ms"] = self._warm_up([system]).latency.summary()
+        try:
+            run_load(result, lambda _, i: system.execute_cmd_command(f"echo bench {i}", timeout=10)[1],
+                     self.iterations)
+            lines = 20000
+            command = f"for /L %i in (1,1,{lines}) do @echo %i" if sys.platform == "win32" else f"seq 1 {lines}"
+            started = time.perf_counter()
+            output, success = system.execute_cmd_command(command, timeout=60)
+            elapsed = time.perf_counter() - started
+            result.extra["burst"] = {"lines": len(output.splitlines()), "seconds": round(elapsed, 3),
+                                     "lines_per_s": round(len(output.splitlines()) / elapsed, 1),
+                                     "success": success}
+        finally:
+            self._release_agent(system)
+        return [result]
+
+    def bench_replay(self) -> List[BenchResult]:
+        """
+        回放录制的会话：按录制顺序重新发送其中的用户输入与系统事件，AIWife从录制中取回复（不访问网络），
+        命令照常真实执行；需要给出cassette
+        """
+        if not self.cassette:
+            return []
+        cassette = Cassette(self.cassette, "replay", speed=self.replay_speed)
+        system_prompt = self.system_prompt or BENCH_SYSTEM_PROMPT
+        inputs = [entry.input for entry in cassette.entries(system_prompt)
+                  if not entry.input.startswith(TURN_INTERNAL_PREFIXES)]
+        ai, system = self._new_agent(MetricsRegistry(), system_prompt)
+        ai.cassette = cassette
+        result = BenchResult("replay", unit="turns")
+        try:
+            self._warm_up([system])
+            run_load(result, lambda _, i: not _failed(process_user_message(inputs[i], ai, system)), len(inputs))
+        finally:
+            self._release_agent(system)
+            cassette.close()
+        result.extra["cassette"] = cassette.stats()
+        result.extra["phases_ms"] = system.metrics.snapshot(recent=0)["phases_ms"]
+        return [result]
+
+    # ---- 会话 ----
+
+    def _new_agent(self, metrics: MetricsRegistry,
+                   system_prompt: str = BENCH_SYSTEM_PROMPT) -> Tuple[AIWife, MorSystem]:
+        """创建一个使用共用工作进程池、记忆库与日志的会话（与多会话服务相同的组合方式）"""
+        if self._shared is None:
+            memory = MemoryStore(os.path.join(self.workdir, "bench_memory.db"))
+            self._shared = {
+                "python_pool": PythonWorkerPool(),
+                "memory": memory,
+                "retriever": MemoryRetriever(memory),
+                "log_writer": AsyncLogWriter(os.path.join(self.workdir, "bench.log")),
+                "summarizer": SummaryWorker(memory, self._new_ai()),
+            }
+        ai = self._new_ai(system_prompt=system_prompt)
+        system = MorSystem(ai, command_workers=4, **self._shared)
+        system.metrics = metrics
+        return ai, system
+
+    @staticmethod
+    def _warm_up(systems: List[MorSystem]) -> BenchResult:
+        """等各会话的CMD控制台加载完启动脚本，启动耗时单独统计，不计入场景的延迟"""
+        return run_load(BenchResult("console_startup"),
+                        lambda _, i: systems[i].execute_cmd_command("echo ready", timeout=60)[1],
+                        len(systems), len(systems))
+
+    @staticmethod
+    def _release_agent(system: MorSystem):
+        system.release()
+        system.reminders.stop()
+
+    def _close_shared(self):
+        if self._shared is None:
+            return
+        self._shared["summarizer"].stop()
+        self._shared["python_pool"].close()
+        self._shared["memory"].close()
+        self._shared["log_writer"].close()
+        self._shared = None
+
+def compare_reports(report: Dict, baseline: Dict, tolerance: float = 0.2,
+                    min_latency_ms: float = 2.0, min_memory_mb: float = 20.0) -> List[str]:
+    """
+    与基线报告对比，返回退化项的说明（空列表表示没有退化）
+
+    吞吐低于基线的(1-tolerance)倍、p95延迟或内存峰值高于基线的(1+tolerance)倍时视为退化；
+    延迟与内存的增量分别小于min_latency_ms / min_memory_mb时忽略，避免微秒级操作的抖动误报
+    """
+    regressions = []
+    for name, current in report.get("scenarios", {}).items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if base["throughput"] and current["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: 吞吐 {current['throughput']}/s，基线 {base['throughput']}/s")
+        p95, base_p95 = current["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        if p95 > base_p95 * (1 + tolerance) and p95 - base_p95 >= min_latency_ms:
+            regressions.append(f"{name}: p95延迟 {p95}ms，基线 {base_p95}ms")
+        peak, base_peak = current["memory"].get("rss_peak_mb"), base.get("memory", {}).get("rss_peak_mb")
+        if peak and base_peak and peak > base_peak * (1 + tolerance) and peak - base_peak >= min_memory_mb:
+            regressions.append(f"{name}: 内存峰值 {peak}MB，基线 {base_peak}MB")
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: 失败 {current['errors']}次，基线 {base['errors']}次")
+    return regressions
+
+def format_result(name: str, result: BenchResult) -> str:
+    latency = result.latency.summary()
+    memory = f"  峰值{result.memory['rss_peak_mb']}MB" if result.memory.get("rss_peak_mb") else ""
+    errors = f"  失败{result.errors}" if result.errors else ""
+    return (f"{name:<15} {result.throughput:>10.1f} {result.unit}/s  "
+            f"p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms{memory}{errors}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI桌宠Agent离线压测（使用本地模拟的chat/completions服务）")
+    parser.add_argument("--scenarios", default=",".join(Benchmark.SCENARIOS),
+                        help=f"要运行的场景，逗号分隔（默认全部: {','.join(Benchmark.SCENARIOS)}）")
+    parser.add_argument("--iterations", type=int, default=200, help="每个场景的请求/轮次数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发数")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="模拟服务首字节前的延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="延迟的随机抖动")
+    parser.add_argument("--chunk-ms", type=float, default=2.0, help="流式响应的段间隔")
+    parser.add_argument("--chunk-chars", type=int, default=4, help="流式响应每段的字符数")
+    parser.add_argument("--reminders", type=int, default=2000, help="reminders场景添加的提醒数")
+    parser.add_argument("--output", metavar="FILE", help="报告写入的JSON文件")
+    parser.add_argument("--baseline", metavar="FILE", help="与基线报告对比，有退化时退出码为1")
+    parser.add_argument("--save-baseline", metavar="FILE", help="把本次报告保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="判定退化的相对幅度（默认0.2即20%%）")
+    parser.add_argument("--cassette", metavar="FILE", help="replay场景回放的录制文件（Key.txt中cassette录制得到）")
+    parser.add_argument("--replay-speed", type=float, default=0.0, help="回放速度，1为原始节奏，0为不等待（默认）")
+    parser.add_argument("--system-prompt", metavar="FILE", help="replay场景使用的系统提示词文件，默认System_prompt.txt")
+    parser.add_argument("--mock-server", metavar="HOST:PORT",
+                        help="只启动模拟服务（可在Key.txt中把api_url指向它离线运行桌宠）")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.mock_server:
+        host, _, port = args.mock_server.rpartition(":")
+        server = MockChatServer(host or "127.0.0.1", int(port), latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                chunk_ms=args.chunk_ms, chunk_chars=args.chunk_chars).start()
+        print(f"模拟服务已启动: {server.url}（Ctrl+C退出）")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+        return 0
+
+    system_prompt = None
+    if args.cassette:
+        try:
+            with open(args.system_prompt or "System_prompt.txt", 'r', encoding='utf-8') as f:
+                system_prompt = f.read()
+        except FileNotFoundError:
+            print("警告: 未找到系统提示词文件，回放只能按录制顺序进行", file=sys.stderr)
+    bench = Benchmark(iterations=args.iterations, concurrency=args.concurrency, latency_ms=args.latency_ms,
+                      jitter_ms=args.jitter_ms, chunk_ms=args.chunk_ms, chunk_chars=args.chunk_chars,
+                      reminders=args.reminders, cassette=args.cassette, replay_speed=args.replay_speed,
+                      system_prompt=system_prompt)
+    try:
+        report = bench.run([name.strip() for name in args.scenarios.split(",") if name.strip()],
+                           progress=lambda name, result: print(format_result(name, result), flush=True))
+    except ValueError as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return 2
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=1)
+
+    if args.baseline:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取基线失败: {str(e)}", file=sys.stderr)
+            return 2
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            print("相对基线出现退化:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("与基线相比没有退化")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import os
+import mmap
+import json
+import zlib
+import time
+import atexit
+import struct
+import hashlib
+import threading
+from array import array
+from typing import Optional, Dict, List, Tuple, Iterator, Callable
+
+MAGIC = b"MORCAS1\n"
+# 每条记录的头：请求哈希、会话流（首条消息，即系统提示词的哈希）、压缩后的负载长度
+_RECORD = struct.Struct("<16s8sI")
+# 索引文件每项：请求哈希、会话流、负载在数据文件中的偏移与长度
+_INDEX = struct.Struct("<16s8sQI")
+
+def _digest(data, size: int) -> bytes:
+    return hashlib.blake2b(json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+                           .encode("utf-8"), digest_size=size).digest()
+
+def request_key(messages: List[Dict]) -> Tuple[bytes, bytes]:
+    """
+    请求的(哈希, 会话流)：哈希只取发送时的对话历史（不含随请求临时注入的记忆），
+    与模型、温度等参数无关，路由切换模型后同一段历史仍能匹配
+    """
+    history = [[message["role"], message["content"]] for message in messages]
+    return _digest(history, 16), _digest(history[:1], 8)
+
+class CassetteEntry:
+    """一次录制的回复：chunks为(相对请求开始的毫秒数, 增量文本)，非流式请求只有一段"""
+
+    __slots__ = ("model", "input", "stream", "chunks", "timing", "usage", "recorded_at")
+
+    def __init__(self, model: str, input: str, stream: bool, chunks: List[Tuple[float, str]],
+                 timing: Optional[Dict] = None, usage: Optional[Dict] = None, recorded_at: float = 0.0):
+        self.model = model
+        self.input = input  # 请求中最后一条消息（用户输入、系统事件或命令结果反馈）
+        self.stream = stream
+        self.chunks = chunks
+        self.timing = timing or {}
+        self.usage = usage
+        self.recorded_at = recorded_at
+
+    @property
+    def text(self) -> str:
+        return "".join(text for _, text in self.chunks)
+
+    def schedule(self, speed: float) -> Iterator[Tuple[float, str]]:
+        """
+        回放节奏：产出(相对回放开始的秒数, 增量文本)
+        speed为1时按录制时的节奏，2为两倍速，0为不等待
+        """
+        for offset_ms, text in self.chunks:
+            yield (offset_ms / 1000 / speed if speed > 0 else 0.0), text
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(json.dumps({
+            "model": self.model, "input": self.input, "stream": self.stream, "chunks": self.chunks,
+            "timing": self.timing, "usage": self.usage, "at": self.recorded_at,
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CassetteEntry":
+        record = json.loads(zlib.decompress(data))
+        return cls(record["model"], record["input"], record["stream"], [tuple(c) for c in record["chunks"]],
+                   record.get("timing"), record.get("usage"), record.get("at", 0.0))
+
+class Cassette:
+    """
+    AIWife请求/回复的录制与回放
+
+    录制(record)时每次成功的请求追加一条压缩记录到数据文件，并在索引文件(.idx)中记下哈希与位置；
+    回放(replay)时只读入索引建立哈希表，数据文件以mmap映射、按需解压单条记录，
+    查找为O(1)，与录制文件大小无关。同一段历史出现多次时按录制顺序依次回放（都回放过后重复最后一次）；
+    找不到匹配（例如命令结果反馈中含有时间等每次不同的内容）且fallback为True时，
+    回放同一会话流中下一条尚未回放的记录，使整段会话按原顺序重现
+    """
+
+    def __init__(self, path: str, mode: str = "replay", speed: float = 0.0, fallback: bool = True,
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        """
+        参数:
+            path: 录制文件路径，索引为path + ".idx"
+            mode: record追加录制 / replay回放
+            speed: 回放速度，1为原始节奏，0为不等待
+            fallback: 回放时找不到匹配是否按会话流顺序回放
+            on_error: 写入录制失败时的处理函数（不影响本次请求）
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"未知的录制模式: {mode}")
+        self.path = path
+        self.index_path = path + ".idx"
+        self.mode = mode
+        self.speed = speed
+        self.fallback = fallback
+        self.on_error = on_error
+        self.rebuilt = 0   # 打开时从数据文件补齐的索引项数（索引缺失或不完整）
+        self.recorded = 0  # 本次录制的条数
+        self.hits = 0      # 按哈希命中的回放次数
+        self.fallbacks = 0  # 按会话流顺序回放的次数
+        self.misses = 0    # 没有可回放记录的次数
+        self._keys: List[bytes] = []
+        self._streams: List[bytes] = []
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        self._by_key: Dict[bytes, List[int]] = {}
+        self._by_stream: Dict[bytes, List[int]] = {}
+        self._key_pos: Dict[bytes, int] = {}
+        self._stream_pos: Dict[bytes, int] = {}
+        self._used = bytearray()
+        self._lock = threading.Lock()
+        self._file = None
+        self._index_file = None
+        self._mmap: Optional[mmap.mmap] = None
+        if mode == "record":
+            self._open_record()
+        else:
+            self._open_replay()
+        atexit.register(self.close)
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record" and self._file is not None
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    # ---- 打开 ----
+
+    def _open_record(self):
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) >= len(MAGIC)
+        self._file = open(self.path, "r+b" if exists else "w+b")
+        if exists:
+            self._check_magic(self._file.read(len(MAGIC)))
+            size = self._load_index(os.path.getsize(self.path))
+            self._file.truncate(size)  # 丢弃上次异常退出时写了一半的记录
+            self._file.seek(size)
+        else:
+            self._file.write(MAGIC)
+            self._file.flush()
+        expected = len(self) * _INDEX.size
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) >= expected:
+            self._index_file = open(self.index_path, "r+b")
+            self._index_file.truncate(expected)
+            self._index_file.seek(expected)
+        else:
+            # 索引缺失或短于数据文件：按已读入的记录重写
+            self._index_file = open(self.index_path, "w+b")
+            for index in range(len(self)):
+                self._index_file.write(_INDEX.pack(self._keys[index], self._streams[index],
+                                                   self._offsets[index], self._lengths[index]))
+            self._index_file.flush()
+
+    def _open_replay(self):
+        with open(self.path, "rb") as f:
+            self._check_magic(f.read(len(MAGIC)))
+            size = os.fstat(f.fileno()).st_size
+            self._load_index(size)
+            if size > len(MAGIC):
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._used = bytearray(len(self))
+
+    def _check_magic(self, header: bytes):
+        if header != MAGIC:
+            raise ValueError(f"{self.path}不是录制文件")
+
+    def _load_index(self, data_size: int) -> int:
+        """读入索引（缺失或不完整时扫描数据文件补齐），返回有效数据的末尾位置"""
+        end = len(MAGIC)
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        for start in range(0, len(data) - _INDEX.size + 1, _INDEX.size):
+            key, stream, offset, length = _INDEX.unpack_from(data, start)
+            if offset != end + _RECORD.size or offset + length > data_size:
+                break
+            self._add(key, stream, offset, length)
+            end = offset + length
+        rebuilt = 0
+        with open(self.path, "rb") as f:
+            f.seek(end)
+            while end + _RECORD.size <= data_size:
+                key, stream, length = _RECORD.unpack(f.read(_RECORD.size))
+                if end + _RECORD.size + length > data_size:
+                    break
+                f.seek(length, os.SEEK_CUR)
+                self._add(key, stream, end + _RECORD.size, length)
+                end += _RECORD.size + length
+                rebuilt += 1
+        self.rebuilt = rebuilt
+        return end
+
+    def _add(self, key: bytes, stream: bytes, offset: int, length: int):
+        index = len(self._offsets)
+        self._keys.append(key)
+        self._streams.append(stream)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._by_key.setdefault(key, []).append(index)
+        self._by_stream.setdefault(stream, []).append(index)
+
+    # ---- 录制 ----
+
+    def record(self, model: str, messages: List[Dict], chunks: List[Tuple[float, str]], stream: bool,
+               timing: Optional[Dict] = None, usage: Optional[Dict] = None):
+        """追加一条录制（messages为发送时的对话历史，不含本次回复）"""
+        if not self.recording:
+            return
+        key, stream_key = request_key(messages)
+        entry = CassetteEntry(model, messages[-1]["content"] if messages else "", stream,
+                              [(round(offset, 1), text) for offset, text in chunks], timing, usage, time.time())
+        payload = entry.to_bytes()
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                offset = self._file.tell() + _RECORD.size
+                self._file.write(_RECORD.pack(key, stream_key, len(payload)) + payload)
+                self._file.flush()
+                self._index_file.write(_INDEX.pack(key, stream_key, offset, len(payload)))
+                self._index_file.flush()
+            except OSError as e:
+                if self.on_error:
+                    self.on_error(e)
+                return
+            self._add(key, stream_key, offset, len(payload))
+            self.recorded += 1
+
+    # ---- 回放 ----
+
+    def lookup(self, messages: List[Dict]) -> Optional[CassetteEntry]:
+        """取出与对话历史匹配的下一条录制；没有时按会话流顺序回放（fallback），都没有返回None"""
+        key, stream_key = request_key(messages)
+        with self._lock:
+            records = self._by_key.get(key)
+            if records:
+                index = self._next(records, self._key_pos, key)
+                if index is None:
+                    index = records[-1]  # 同一请求的录制已全部回放过时重复最后一次的回复
+                self.hits += 1
+            else:
+                index = self._next(self._by_stream.get(stream_key), self._stream_pos, stream_key) \
+                    if self.fallback else None
+                if index is None:
+                    self.misses += 1
+                    return None
+                self.fallbacks += 1
+            self._used[index] = 1
+        return self._load(index)
+
+    def _next(self, records: Optional[List[int]], positions: Dict[bytes, int], key: bytes) -> Optional[int]:
+        """records中第一条尚未回放的记录（指针只前进，均摊O(1)）"""
+        if not records:
+            return None
+        pos = positions.get(key, 0)
+        while pos < len(records) and self._used[records[pos]]:
+            pos += 1
+        positions[key] = pos
+        return records[pos] if pos < len(records) else None
+
+    def _load(self, index: int) -> CassetteEntry:
+        offset, length = self._offsets[index], self._lengths[index]
+        if self._mmap is not None:
+            return CassetteEntry.from_bytes(self._mmap[offset:offset + length])
+        with self._lock:
+            position = self._file.tell()
+            self._file.seek(offset)
+            data = self._file.read(length)
+            self._file.seek(position)
+        return CassetteEntry.from_bytes(data)
+
+    def entries(self, system_prompt: Optional[str] = None) -> Iterator[CassetteEntry]:
+        """按录制顺序遍历记录；给出system_prompt时只遍历以它开头的会话流"""
+        if system_prompt is None:
+            indexes = range(len(self))
+        else:
+            indexes = self._by_stream.get(request_key([{"role": "system", "content": system_prompt}])[1], [])
+        for index in indexes:
+            yield self._load(index)
+
+    def stats(self) -> Dict:
+        return {"path": self.path, "mode": self.mode, "records": len(self), "rebuilt": self.rebuilt, "recorded": self.recorded,
+                "hits": self.hits, "fallbacks": self.fallbacks, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            for handle in (self._mmap, self._file, self._index_file):
+                if handle is not None:
+                    handle.close()
+            self._mmap = self._file = self._index_file = None
@@ -0,0 +1,307 @@
+import sys
+import time
+import json
+import asyncio
+import threading
+import concurrent.futures
+from typing import Optional, Dict, Callable
+
+from AIchat import AIWife
+from AILoop import get_event_loop_thread
+from MorMain import MorSystem, async_process_user_message
+from MorSnapshot import SessionSnapshot, initialize_session
+from MorEvents import EventBatch
+
+class DaemonClient:
+    """一个协议连接：把事件编码为一行JSON写出"""
+
+    def __init__(self, write: Callable[[str], None]):
+        self._write = write
+        self._lock = threading.Lock()
+
+    def send(self, event: Dict):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                self._write(line)
+            except Exception:
+                pass  # 连接已断开
+
+class HeadlessDaemon:
+    """
+    无界面模式：不依赖PyQt5，通过按行JSON驱动AIWife + MorSystem
+
+    请求（每行一个JSON对象，id可选，原样带回）:
+        {"type": "message", "id": 1, "text": "你好", "stream": true}
+        {"type": "reminders"} / {"type": "cancel_reminder", "reminder_id": 3}
+        {"type": "status"} / {"type": "metrics"} / {"type": "shutdown"}
+    事件:
+        ready(初始化完成) / delta(流式累计文本) / response(完整回复) / system(系统消息)
+        reminders / status / metrics（各阶段耗时p50/p95/p99与token） / error / bye
+    对话轮次按到达顺序依次执行；提醒等系统事件广播给所有连接，空闲时合并为一轮输入交给AI
+    （有未完成的请求时暂缓，期间到达的系统事件继续合并，system事件的batch字段为合并的条数）
+    """
+
+    def __init__(self, ai: AIWife, system: MorSystem,
+                 initialize: bool = True, snapshot: Optional[SessionSnapshot] = None,
+                 turn_slots: Optional[asyncio.Semaphore] = None):
+        """
+        参数:
+            ai: AI实例
+            system: MorSystem实例
+            initialize: 是否执行初始化序列（会话已从磁盘恢复时为False）
+            snapshot: 初始化快照存储，默认session_snapshot.json
+            turn_slots: 多个会话共用的并发轮次上限
+        """
+        self.ai = ai
+        self.system = system
+        self.initialize = initialize
+        self.snapshot = snapshot
+        self.turn_slots = turn_slots
+        self.allow_shutdown = True  # 是否接受shutdown请求（会话服务器中由服务器统一关闭）
+        self.loop = get_event_loop_thread()
+        self.clients = []
+        self.ready = False
+        self.restored = False  # 是否从快照恢复
+        self.last_active = time.time()
+        self.stopped = threading.Event()
+        self._ready_event = asyncio.Event()
+        self._turn_lock = asyncio.Lock()
+        self._pending = set()  # 尚未完成的请求
+        self._turns = 0  # 已进入run_turn、尚未结束的轮次（含等待初始化与排队的）
+        self._system_turn = False  # 是否有系统事件轮次未完成
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        """在共享事件循环中执行初始化序列，并开始转发系统消息"""
+        self.loop.submit(self._start())
+
+    async def _start(self):
+        try:
+            if self.initialize:
+                self.restored = await initialize_session(
+                    self.ai, self.system, snapshot=self.snapshot,
+                    on_response=lambda text: self.broadcast({"type": "response", "id": "init", "text": text}))
+            else:
+                self.restored = True
+        except Exception as e:
+            self.broadcast({"type": "error", "id": "init", "error": f"初始化错误: {str(e)}"})
+        self.ready = True
+        self._ready_event.set()
+        self.broadcast({"type": "ready", "restored": self.restored, "session": self.system.session_id})
+        self.system.events.connect(self._on_system_batch, gate=self._system_events_ready)
+
+    def stop(self, release: bool = False):
+        """
+        关闭系统并唤醒等待退出的主线程
+        release为True时只释放会话独占的资源（会话服务器换出会话时），共用资源保持运行
+        """
+        if self.stopped.is_set():
+            return
+        self.broadcast({"type": "bye"})
+        self.stopped.set()
+        if release:
+            self.system.release()
+        else:
+            self.system.shutdown()
+
+    @property
+    def busy(self) -> bool:
+        """是否有未完成的请求或尚未结束的轮次（会话服务器不会换出忙碌的会话）"""
+        return bool(self._pending) or self._turns > 0 or self._turn_lock.locked()
+
+    # ---- 连接与事件 ----
+
+    def attach(self, client: DaemonClient):
+        self.clients.append(client)
+        if self.ready:
+            client.send({"type": "ready", "restored": self.restored, "session": self.system.session_id})
+
+    def detach(self, client: DaemonClient):
+        if client in self.clients:
+            self.clients.remove(client)
+
+    def broadcast(self, event: Dict):
+        for client in list(self.clients):
+            client.send(event)
+
+    def submit_line(self, client: DaemonClient, line: str):
+        """解析一行请求并提交到事件循环（线程安全）"""
+        line = line.strip()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("请求必须是JSON对象")
+        except ValueError as e:
+            client.send({"type": "error", "error": f"无效请求: {str(e)}"})
+            return
+        future = self.loop.submit(self.handle(client, request))
+        self._pending.add(future)
+        future.add_done_callback(self._request_done)
+
+    def _request_done(self, future):
+        self._pending.discard(future)
+        self.system.events.kick()  # 请求处理完，积压的系统事件可以投递了
+
+    async def handle(self, client: DaemonClient, request: Dict):
+        request_id = request.get("id")
+        kind = request.get("type", "message")
+        try:
+            if kind == "message":
+                await self.run_turn(str(request.get("text", "")), client, request_id, bool(request.get("stream")))
+            elif kind == "reminders":
+                client.send({"type": "reminders", "id": request_id, "items": self.system.list_reminders()})
+            elif kind == "cancel_reminder":
+                cancelled = self.system.cancel_reminder(int(request["reminder_id"]))
+                client.send({"type": "cancel_reminder", "id": request_id, "cancelled": cancelled})
+            elif kind == "status":
+                client.send({"type": "status", "id": request_id, "ready": self.ready,
+                             "session": self.system.session_id, "messages": len(self.ai.messages),
+                             "reminders": len(self.system.list_reminders()),
+                             "routing": self.system.router.stats(),
+                             "log_dropped": self.system.log_writer.dropped,
+                             "log_failed": self.system.log_writer.failed,
+                             "cassette": self.ai.cassette.stats() if self.ai.cassette is not None else None})
+            elif kind == "metrics":
+                client.send({"type": "metrics", "id": request_id, **self.system.metrics.snapshot()})
+            elif kind == "shutdown":
+                if not self.allow_shutdown:
+                    raise ValueError("此连接不允许关闭服务")
+                async with self._turn_lock:  # 等此前提交的对话轮次结束
+                    await asyncio.to_thread(self.stop)
+            else:
+                client.send({"type": "error", "id": request_id, "error": f"未知请求类型: {kind}"})
+        except Exception as e:
+            client.send({"type": "error", "id": request_id, "error": f"处理请求时出错: {str(e)}"})
+
+    async def run_turn(self, text: str, client: Optional[DaemonClient] = None, request_id=None,
+                       stream: bool = False, source: str = "user") -> str:
+        """执行一轮对话并返回回复；client为None时（系统消息）结果广播给所有连接，source决定模型路由"""
+        send = client.send if client else self.broadcast
+        # 在等待初始化之前就计为忙碌，直接调用run_turn（如HTTP接口）的会话不会在等待期间被换出
+        self._turns += 1
+        try:
+            await self._ready_event.wait()
+            on_delta = None
+            if stream:
+                on_delta = lambda delta, full: send({"type": "delta", "id": request_id, "text": full})
+            queued_at = time.monotonic()
+            async with self._turn_lock:
+                self.last_active = time.time()
+                if self.turn_slots is not None:
+                    async with self.turn_slots:
+                        response = await async_process_user_message(text, self.ai, self.system, on_delta=on_delta,
+                                                                    source=source, queue_wait=time.monotonic() - queued_at)
+                else:
+                    response = await async_process_user_message(text, self.ai, self.system, on_delta=on_delta,
+                                                                source=source, queue_wait=time.monotonic() - queued_at)
+                self.last_active = time.time()
+        finally:
+            self._turns -= 1
+            if not self._turns:
+                self.system.events.kick()  # 积压的系统事件可以投递了
+        send({"type": "response", "id": request_id, "text": response})
+        return response
+
+    def _system_events_ready(self) -> bool:
+        """没有未完成的请求和轮次时才投递系统事件：用户请求优先"""
+        return not (self.busy or self._system_turn or self.stopped.is_set())
+
+    def _on_system_batch(self, batch: EventBatch):
+        """一批系统事件（提醒、CMD输出）：逐条广播，合成一轮输入交给AI"""
+        for event in batch.events:
+            self.broadcast({"type": "system", "text": event.text, "batch": batch.size})
+        self._system_turn = True
+        asyncio.ensure_future(self._run_system_batch(batch))
+
+    async def _run_system_batch(self, batch: EventBatch):
+        try:
+            await self.run_turn(batch.text, source=batch.source)
+        except Exception as e:
+            self.broadcast({"type": "error", "error": f"系统消息处理错误: {str(e)}"})
+        finally:
+            self._system_turn = False
+            self.system.events.kick()
+
+    # ---- 传输 ----
+
+    def serve_stdio(self, stdin=None, stdout=None) -> int:
+        """
+        在stdin/stdout上按行收发JSON，stdin关闭或收到shutdown后返回
+        协议占用stdout，其它模块的print输出改写到stderr
+        """
+        stdin = stdin or sys.stdin
+        stdout = stdout or sys.stdout
+        if stdout is sys.stdout:
+            sys.stdout = sys.stderr
+
+        def write(line: str):
+            stdout.write(line)
+            stdout.flush()
+
+        client = DaemonClient(write)
+        self.attach(client)
+        self.start()
+        reader = threading.Thread(target=self._read_stdio, args=(client, stdin), name="DaemonStdin", daemon=True)
+        reader.start()
+        self.stopped.wait()
+        return 0
+
+    def _read_stdio(self, client: DaemonClient, stdin):
+        for line in stdin:
+            self.submit_line(client, line)
+            if self.stopped.is_set():
+                return
+        # stdin关闭：等已提交的请求处理完再退出，便于 echo ... | python Main.py --headless 这类用法
+        concurrent.futures.wait(list(self._pending))
+        self.stop()
+
+    def serve_socket(self, host: str = "127.0.0.1", port: int = 8765) -> int:
+        """在本地TCP端口上按行收发JSON，可同时有多个连接；收到shutdown后返回"""
+        server = self.loop.run(asyncio.start_server(self._on_connection, host, port))
+        address = server.sockets[0].getsockname()
+        print(f"无界面模式监听 {address[0]}:{address[1]}", file=sys.stderr, flush=True)
+        self.start()
+        self.stopped.wait()
+        self.loop.submit(self._close_server(server)).result(5)
+        return 0
+
+    @staticmethod
+    async def _close_server(server):
+        server.close()
+        await server.wait_closed()
+
+    async def _on_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        client = DaemonClient(lambda line: loop.call_soon_threadsafe(writer.write, line.encode('utf-8')))
+        self.attach(client)
+        try:
+            while not self.stopped.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                self.submit_line(client, line.decode('utf-8', errors='replace'))
+        finally:
+            self.detach(client)
+            writer.close()
+
+def run_daemon(ai: AIWife, system: MorSystem, socket_address: Optional[str] = None) -> int:
+    """
+    无界面模式入口
+
+    参数:
+        socket_address: "HOST:PORT"，为空时使用stdin/stdout
+    """
+    daemon = HeadlessDaemon(ai, system)
+    try:
+        if socket_address:
+            host, _, port = socket_address.rpartition(":")
+            return daemon.serve_socket(host or "127.0.0.1", int(port))
+        return daemon.serve_stdio()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        daemon.stop()
@@ -0,0 +1,180 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional, Callable, List
+
+from AILoop import EventLoopThread, get_event_loop_thread
+
+# 优先级：数值大的先处理；用户输入高于一切系统事件，提醒高于命令输出与确认消息
+PRIORITY_SYSTEM = 0
+PRIORITY_REMINDER = 1
+PRIORITY_USER = 10
+
+class SystemEvent:
+    """一条系统事件；合并窗口内内容相同的事件只保留一条并计数"""
+
+    __slots__ = ("text", "kind", "priority", "created", "count")
+
+    def __init__(self, text: str, kind: str = "system", priority: int = PRIORITY_SYSTEM):
+        self.text = text
+        self.kind = kind
+        self.priority = priority
+        self.created = time.time()
+        self.count = 1
+
+class EventBatch:
+    """一次投递的系统事件，合成一轮对话"""
+
+    __slots__ = ("events", "size")
+
+    def __init__(self, events: List[SystemEvent]):
+        self.events = events
+        self.size = sum(event.count for event in events)  # 合并前的事件数
+
+    @property
+    def source(self) -> str:
+        """轮次来源（用于模型路由）：全是提醒时为timer，全是CMD输出时为tool，否则为system"""
+        kinds = {event.kind for event in self.events}
+        if kinds <= {"reminder", "reminder_set"}:
+            return "timer"
+        if kinds == {"cmd"}:
+            return "tool"
+        return "system"
+
+    @property
+    def text(self) -> str:
+        """交给AI的文本：只有一条事件时保持原样，多条时逐行列出"""
+        if self.size == 1:
+            return self.events[0].text
+        lines = [f"[System事件汇总] 以下{self.size}条系统消息合并为一轮处理："]
+        for event in self.events:
+            suffix = f"（重复{event.count}次）" if event.count > 1 else ""
+            lines.append(f"- {event.text}{suffix}")
+        return "\n".join(lines)
+
+class EventAggregator:
+    """
+    系统事件聚合器（替代定时轮询的系统消息队列）
+
+    post()在任意线程调用；最后一条事件之后window秒内没有新事件（最长不超过第一条之后max_wait秒）时，
+    把期间的全部事件合成一个EventBatch交给on_batch，一阵连续的提醒或CMD输出只触发一轮AI对话。
+    gate返回False时（例如上一轮系统事件还在排队、正在处理用户输入）暂缓投递，事件继续合并，
+    消费方就绪后调用kick()重新安排投递。定时在共享事件循环上完成，不占用额外线程
+    """
+
+    def __init__(self, window: float = 1.0, max_wait: float = 5.0, max_events: int = 50,
+                 loop_thread: Optional[EventLoopThread] = None,
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        """
+        参数:
+            window: 合并窗口(秒)，新事件到来会顺延
+            max_wait: 第一条事件最多等待的秒数
+            max_events: 累计这么多条事件时立即投递
+            loop_thread: 事件循环线程，默认使用共享事件循环
+            on_error: on_batch出错时的处理函数
+        """
+        self.window = window
+        self.max_wait = max_wait
+        self.max_events = max(1, max_events)
+        self.loop_thread = loop_thread or get_event_loop_thread()
+        self.on_batch: Optional[Callable[[EventBatch], None]] = None
+        self.gate: Optional[Callable[[], bool]] = None
+        self.on_error = on_error
+        self.received = 0   # 收到的事件数
+        self.batches = 0    # 投递的批次数
+        self.coalesced = 0  # 被合并、没有单独触发对话的事件数
+        self._events: "OrderedDict[str, SystemEvent]" = OrderedDict()
+        self._pending = 0
+        self._first_at = 0.0
+        self._last_at = 0.0
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def connect(self, on_batch: Callable[[EventBatch], None], gate: Optional[Callable[[], bool]] = None):
+        """设置消费方（on_batch在事件循环线程中调用）；此前积压的事件随后投递"""
+        self.on_batch = on_batch
+        self.gate = gate
+        self.kick()
+
+    def post(self, text: str, kind: str = "system", priority: int = PRIORITY_SYSTEM):
+        """提交一条系统事件（线程安全）"""
+        now = time.monotonic()
+        with self._lock:
+            if self._closed:
+                return
+            event = self._events.get(text)
+            if event is None:
+                self._events[text] = SystemEvent(text, kind, priority)
+            else:
+                event.count += 1
+                event.priority = max(event.priority, priority)
+            if not self._pending:
+                self._first_at = now
+            self._pending += 1
+            self._last_at = now
+            self.received += 1
+        self._call(self._arm)
+
+    def kick(self):
+        """消费方就绪时调用：有积压事件且合并窗口已过则立即投递"""
+        self._call(self._arm)
+
+    @property
+    def pending(self) -> int:
+        """尚未投递的事件数（合并前）"""
+        return self._pending
+
+    def close(self):
+        """丢弃积压事件并停止投递"""
+        with self._lock:
+            self._closed = True
+            self._events.clear()
+            self._pending = 0
+        self._call(self._cancel)
+
+    # ---- 事件循环线程 ----
+
+    def _call(self, callback, *args):
+        if self.loop_thread.in_loop_thread():
+            callback(*args)
+        else:
+            self.loop_thread.loop.call_soon_threadsafe(callback, *args)
+
+    def _cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _arm(self):
+        """按最后一条事件顺延投递时间，但不超过第一条事件的最长等待"""
+        self._cancel()
+        with self._lock:
+            if not self._pending or self._closed:
+                return
+            if self._pending >= self.max_events:
+                delay = 0.0
+            else:
+                deadline = min(self._last_at + self.window, self._first_at + self.max_wait)
+                delay = max(0.0, deadline - time.monotonic())
+        self._handle = self.loop_thread.loop.call_later(delay, self._flush)
+
+    def _flush(self):
+        self._handle = None
+        if self.on_batch is None or (self.gate is not None and not self.gate()):
+            return  # 消费方未就绪，事件继续合并，等kick()
+        with self._lock:
+            if not self._pending:
+                return
+            events = sorted(self._events.values(), key=lambda e: (-e.priority, e.created))
+            self._events.clear()
+            self._pending = 0
+        batch = EventBatch(events)
+        self.batches += 1
+        self.coalesced += batch.size - 1
+        try:
+            self.on_batch(batch)
+        except Exception as e:
+            if self.on_error:
+                self.on_error(e)
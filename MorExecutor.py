@@ -0,0 +1,176 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple
+
+class CommandResult:
+    """单个命令块的执行结果"""
+
+    __slots__ = ("index", "type", "content", "result", "success", "duration")
+
+    def __init__(self, index: int, command_type: str, content: str,
+                 result: str = "", success: bool = False, duration: float = 0.0):
+        self.index = index  # 命令块在回复中的序号
+        self.type = command_type
+        self.content = content
+        self.result = result
+        self.success = success
+        self.duration = duration  # 墙钟耗时(秒)
+
+def run_time_command(system, content: str) -> Tuple[str, bool]:
+    """解析 Time{内容,秒数[,次数]} 并设置提醒"""
+    parts = [p.strip() for p in content.split(',')]
+
+    if len(parts) == 2:
+        reminder_content, delay_seconds = parts[0], int(parts[1])
+        times = 1
+    elif len(parts) == 3:
+        reminder_content, delay_seconds = parts[0], int(parts[1])
+        times = int(parts[2])
+    else:
+        result = "时间命令格式错误: 应为 Time{内容,秒数[,次数]}"
+        system._log_entry("ERROR", result, "SYSTEM")
+        return result, False
+
+    system._set_reminder(reminder_content, delay_seconds, times)
+    return "提醒设置成功", True
+
+def is_barrier(command: Dict) -> bool:
+    """安装依赖的块必须等之前的块结束、之后的块也要等它结束"""
+    return command["type"] == "Rcte" and "pip install" in command["content"]
+
+class CommandExecutor:
+    """
+    并发执行一次回复中的命令块
+
+    Rcte块彼此独立，在有界线程池中并发执行；Cmd块共用一个shell，按出现顺序串行执行，
+    但与其它块并行；Time块只设置提醒，直接执行；pip install块作为屏障单独执行。
+    结果按命令块在回复中的原始顺序返回，并记录每块的耗时
+    """
+
+    def __init__(self, system, max_workers: int = 4):
+        """
+        参数:
+            system: MorSystem实例
+            max_workers: 同时执行的命令块上限，1表示完全按顺序执行
+        """
+        self.system = system
+        self.max_workers = max(1, max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="MorCommand")
+
+    def _run_one(self, index: int, command: Dict) -> CommandResult:
+        """执行单个命令块（在工作线程或事件循环中调用）"""
+        item = CommandResult(index, command["type"], command["content"])
+        started = time.perf_counter()
+        try:
+            if command["type"] == "Time":
+                item.result, item.success = run_time_command(self.system, command["content"])
+            else:
+                item.result, item.success = self.system.process_command(command["content"], command["type"])
+        except Exception as e:
+            item.result = f"处理{command['type']}命令出错: {str(e)}"
+            item.success = False
+            self.system._log_entry("ERROR", item.result, "SYSTEM")
+        item.duration = time.perf_counter() - started
+        return item
+
+    async def _run_in_pool(self, index: int, command: Dict) -> CommandResult:
+        if command["type"] == "Time":
+            return self._run_one(index, command)
+        future = self._pool.submit(self._run_one, index, command)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 线程无法中断：还没开始的块直接撤销，已在执行的块等它结束，取消完成时不再有命令在跑
+            if not future.cancel():
+                await asyncio.wait([asyncio.wrap_future(future)])
+            raise
+
+    def batch(self) -> "CommandBatch":
+        """创建一个随到随执行的命令批次（需在事件循环线程中调用）"""
+        return CommandBatch(self, asyncio.get_running_loop())
+
+    async def run(self, commands: List[Dict]) -> List[CommandResult]:
+        """执行命令块列表，返回按原始顺序排列的结果"""
+        batch = self.batch()
+        for command in commands:
+            batch.submit(command)
+        return await batch.results()
+
+    def close(self):
+        """关闭线程池"""
+        self._pool.shutdown(wait=False)
+
+class CommandBatch:
+    """
+    一次回复中的命令块，提交即开始执行
+
+    每个块只等待它真正依赖的块：Cmd块等待前一个Cmd块，所有块等待之前的pip install屏障，
+    屏障等待之前的全部块；max_workers为1时每个块都等待前一个块
+    """
+
+    def __init__(self, executor: CommandExecutor, loop: asyncio.AbstractEventLoop):
+        self.executor = executor
+        self.loop = loop
+        self._tasks: List[asyncio.Task] = []
+        self._cmd_tail: Optional[asyncio.Task] = None  # 最近一个Cmd块
+        self._barrier: Optional[asyncio.Task] = None  # 最近一个屏障块
+        self._cancelled = False
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, command: Dict):
+        """提交一个命令块（事件循环线程中调用），序号按提交顺序递增；批次取消后忽略"""
+        if self._cancelled:
+            return
+        index = len(self._tasks)
+        if self.executor.max_workers == 1:
+            deps = self._tasks[-1:]
+        elif is_barrier(command):
+            deps = list(self._tasks)
+        else:
+            deps = [task for task in (self._barrier, self._cmd_tail if command["type"] == "Cmd" else None) if task]
+        task = self.loop.create_task(self._run_after(deps, index, command))
+        self._tasks.append(task)
+        if is_barrier(command):
+            self._barrier = task
+        if command["type"] == "Cmd":
+            self._cmd_tail = task
+
+    def submit_threadsafe(self, command: Dict):
+        """从任意线程提交命令块，保持提交顺序"""
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self.submit(command)
+        else:
+            self.loop.call_soon_threadsafe(self.submit, command)
+
+    async def _run_after(self, deps: List[asyncio.Task], index: int, command: Dict) -> CommandResult:
+        if deps:
+            await asyncio.wait(deps)
+        return await self.executor._run_in_pool(index, command)
+
+    async def results(self) -> List[CommandResult]:
+        """等待全部已提交的命令块结束，返回按原始顺序排列的结果；等待时被取消则取消整个批次"""
+        await asyncio.sleep(0)  # 让其它线程排队中的提交先落地
+        try:
+            results = list(await asyncio.gather(*self._tasks))
+        except asyncio.CancelledError:
+            await self.cancel()
+            raise
+        for item in results:
+            self.executor.system._log_entry("TIMING", f"{item.type}块#{item.index + 1} 耗时 {item.duration * 1000:.0f}ms", "SYSTEM")
+        return results
+
+    async def cancel(self):
+        """取消批次：不再接受提交，撤销未开始的块，并等正在执行的块结束"""
+        await asyncio.sleep(0)  # 让其它线程排队中的提交先落地，随后一并取消
+        self._cancelled = True
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
@@ -0,0 +1,183 @@
+import atexit
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Optional
+
+class AsyncLogWriter:
+    """
+    后台批量日志写入器
+
+    调用方只把日志行放入有界队列；后台线程攒够batch_size行或每隔flush_interval秒写一次文件，
+    文件句柄常开。按大小或时间轮转，轮转出的旧文件可选gzip压缩。close()保证写完队列中的全部日志。
+    打开或写入文件失败时丢弃该批并计数，下一批重新打开文件，后台线程不会因此退出
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_queue: int = 10000,
+                 batch_size: int = 256,
+                 flush_interval: float = 0.5,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 rotate_interval: Optional[float] = None,
+                 backup_count: int = 5,
+                 compress: bool = False):
+        """
+        参数:
+            path: 日志文件路径
+            max_queue: 队列容量，写满后write不等待，直接丢弃并计数（丢弃的行数随后写入日志，写入失败的行数同样）
+            batch_size: 每批最多写入的行数
+            flush_interval: 最长刷新间隔(秒)
+            max_bytes: 单个文件超过该大小时轮转，0表示不按大小轮转
+            rotate_interval: 每隔多少秒轮转一次，None表示不按时间轮转
+            backup_count: 保留的旧文件个数
+            compress: 是否gzip压缩轮转出的旧文件
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.dropped = 0  # 队列满时丢弃的日志行数
+        self.failed = 0  # 打开或写入文件失败而丢失的日志行数
+        self.written = 0  # 已写入的日志行数
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._file = None
+        self._opened_at = 0.0
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="AsyncLogWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, line: str) -> bool:
+        """放入一行日志（应自带换行），返回是否成功入队；从不阻塞调用线程"""
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前入队的日志全部写入文件"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """写完队列中的日志后关闭文件并停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._opened_at = time.time()
+
+    def _should_rotate(self) -> bool:
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._opened_at >= self.rotate_interval
+
+    def _backup_name(self, index: int) -> str:
+        return f"{self.path}.{index}.gz" if self.compress else f"{self.path}.{index}"
+
+    def _rotate(self):
+        """关闭当前文件，依次后移旧文件编号，再打开新文件"""
+        self._file.close()
+        self._file = None
+        if self.backup_count > 0:
+            oldest = self._backup_name(self.backup_count)
+            if os.path.exists(oldest):
+                os.remove(oldest)
+            for index in range(self.backup_count - 1, 0, -1):
+                source = self._backup_name(index)
+                if os.path.exists(source):
+                    os.replace(source, self._backup_name(index + 1))
+            if self.compress:
+                with open(self.path, 'rb') as source, gzip.open(self._backup_name(1), 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self._backup_name(1))
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def _write_batch(self, batch):
+        """写入一批日志，文件未打开（首次或上次失败）时先打开；失败时关闭文件留待下一批重试"""
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write("".join(batch))
+            self._file.flush()
+            return True
+        except Exception:
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except Exception:
+                    pass
+                self._file = None
+            return False
+
+    def _worker(self):
+        """后台线程：攒批、写入、轮转"""
+        try:
+            self._open()
+        except Exception:
+            self._file = None  # 写入第一批时重试
+        reported_dropped = 0  # 已写入日志的队列满丢弃行数
+        reported_failed = 0  # 已写入日志的写入失败行数
+        stopping = False
+        while not stopping:
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+
+            if batch:
+                timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+                dropped, failed = self.dropped, self.failed
+                notices = []
+                if dropped > reported_dropped:
+                    notices.append(f"[{timestamp}] [WARNING] [LOG] 日志队列已满，丢弃了{dropped - reported_dropped}行日志\n")
+                if failed > reported_failed:
+                    notices.append(f"[{timestamp}] [WARNING] [LOG] 写入日志文件失败，丢失了{failed - reported_failed}行日志\n")
+                if self._write_batch(batch + notices):
+                    self.written += len(batch)
+                    reported_dropped, reported_failed = dropped, failed
+                else:
+                    self.failed += len(batch)
+                try:
+                    if self._file is not None and self._should_rotate():
+                        self._rotate()
+                except Exception:
+                    pass  # 轮转中途失败时文件已关闭，下一批重新打开原文件
+            for waiter in waiters:
+                waiter.set()
+        if self._file is not None:
+            self._file.close()
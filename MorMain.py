@@ -1,491 +1,1028 @@
-import subprocess
-import sys
-import threading
-import time
-import os
-import queue
-import re
-from datetime import datetime, timedelta
-from typing import Optional, Tuple, List, Dict, Any
-from AIchat import AIWife
-
-class MorSystem:
-    """重构后的System处理器，支持交互式CMD和实时消息反馈"""
-    
-    def __init__(self, ai_instance: AIWife, log_file: str = "SystemLog.log"):
-        self.ai = ai_instance
-        self.error_count = 0
-        self.max_errors = 999999
-        self.lock = threading.Lock()
-        self.log_file = log_file
-        self.reminder_queue = queue.Queue()
-        self.running = True
-        self.message_queue = queue.Queue()
-        self.cmd_message_queue = queue.Queue()  # 专用于CMD交互消息的队列
-        
-        # CMD控制台相关属性
-        self.cmd_process = None
-        self.cmd_thread = None
-        self.cmd_output_queue = queue.Queue()
-        self.cmd_input_queue = queue.Queue()
-        self.cmd_working_directory = os.getcwd()
-        self.cmd_history = []
-        self.cmd_active = False
-        self.cmd_encoding = 'utf-8'
-        self.last_cmd_output = ""  # 记录最后一条CMD输出
-        self.cmd_waiting_input = False  # 标记CMD是否在等待输入
-        self.last_cmd_flush_time = time.time()  # 上次发送CMD消息的时间
-        self.cmd_buffer = []  # 用于存储10秒内的CMD消息
-
-        self._init_log_file()
-        self._start_reminder_checker()
-        self._init_cmd_console()
-        self._start_cmd_monitor()  # 启动CMD监控线程
-    
-    def _init_log_file(self):
-        """初始化日志文件"""
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(f"\n\n=== System Session Started at {datetime.now()} ===\n")
-    
-    def _log_entry(self, entry_type: str, content: str, source: str = "SYSTEM"):
-        """写入日志条目"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_msg = f"[{timestamp}] [{entry_type}] [{source}] {content}\n"
-        
-        with self.lock:
-            with open(self.log_file, 'a', encoding='utf-8') as f:
-                f.write(log_msg)
-    
-    def _init_cmd_console(self):
-        """初始化持久化CMD控制台"""
-        encoding = self.cmd_encoding
-        
-        try:
-            if sys.platform == "win32":
-                # Windows下设置UTF-8编码
-                self.cmd_process = subprocess.Popen(
-                    ["cmd.exe"],
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,  # 分离stderr以便更好处理错误
-                    cwd=self.cmd_working_directory,
-                    bufsize=0,  # 无缓冲
-                    text=True,
-                    encoding=encoding,
-                    errors='replace'
-                )
-            else:
-                # Linux/Mac使用bash
-                self.cmd_process = subprocess.Popen(
-                    ["/bin/bash", "-i"],  # 交互模式
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    cwd=self.cmd_working_directory,
-                    bufsize=0,
-                    text=True,
-                    encoding=encoding,
-                    errors='replace'
-                )
-            
-            # 启动线程读取CMD输出
-            self.cmd_active = True
-            self.cmd_thread = threading.Thread(target=self._read_cmd_output)
-            self.cmd_thread.daemon = True
-            self.cmd_thread.start()
-            
-            self._log_entry("DEBUG", "CMD控制台初始化完成", "CMD")
-        except Exception as e:
-            self._log_entry("ERROR", f"初始化CMD控制台失败: {str(e)}", "CMD")
-            self.cmd_active = False
-    
-    def _start_cmd_monitor(self):
-        """启动CMD监控线程，实时处理交互需求，但每10秒整合一次输出"""
-        def monitor():
-            while self.cmd_active:
-                try:
-                    current_time = time.time()
-                    # 每10秒检查一次或等待输入时立即处理
-                    flush_interval = 10  # 10秒发送一次
-                    
-                    # 检查是否有新输出
-                    if not self.cmd_output_queue.empty():
-                        output = self.cmd_output_queue.get_nowait()
-                        self.cmd_buffer.append(output)
-                        
-                        # 检测是否需要用户输入
-                        if re.search(r'\[Y/n\]|\? \(yes/no\)|continue\?|confirm:', output, re.IGNORECASE):
-                            self.cmd_waiting_input = True
-                    
-                    # 处理缓冲区：每10秒发送一次或需要立即处理
-                    if (current_time - self.last_cmd_flush_time >= flush_interval and self.cmd_buffer) or self.cmd_waiting_input:
-                        combined_message = "\n".join(self.cmd_buffer)
-                        
-                        if self.cmd_waiting_input:
-                            self.cmd_message_queue.put(f"[CMD等待输入] {combined_message}")
-                        else:
-                            self.cmd_message_queue.put(f"[CMD输出] {combined_message}")
-                        
-                        self.cmd_buffer = []  # 清空缓冲区
-                        self.last_cmd_flush_time = current_time
-                        self.cmd_waiting_input = False  # 重置等待输入标志
-                    
-                    time.sleep(0.3)  # 降低CPU使用率
-                except Exception as e:
-                    self._log_entry("ERROR", f"CMD监控线程错误: {str(e)}", "CMD")
-                    time.sleep(1)
-        
-        threading.Thread(target=monitor, daemon=True).start()
-    
-    def _read_cmd_output(self):
-        """读取CMD控制台输出（分离stdout和stderr）"""
-        self._log_entry("DEBUG", "CMD输出读取线程启动", "CMD")
-        
-        def read_stream(stream, stream_type):
-            """读取指定流的内容"""
-            while self.cmd_active:
-                try:
-                    line = stream.readline()
-                    if line:
-                        formatted_line = f"[{stream_type}] {line.strip()}"
-                        self.cmd_output_queue.put(formatted_line)
-                except Exception as e:
-                    self._log_entry("ERROR", f"读取CMD{stream_type}错误: {str(e)}", "CMD")
-        
-        # 启动单独的线程读取stdout和stderr
-        threading.Thread(target=read_stream, args=(self.cmd_process.stdout, "STDOUT"), daemon=True).start()
-        threading.Thread(target=read_stream, args=(self.cmd_process.stderr, "STDERR"), daemon=True).start()
-    
-    def _send_cmd_command(self, command: str):
-        """向CMD控制台发送命令"""
-        if self.cmd_process and self.cmd_process.stdin:
-            try:
-                self.cmd_process.stdin.write(command + "\n")
-                self.cmd_process.stdin.flush()
-                self.cmd_history.append(command.strip())
-                self._log_entry("DEBUG", f"发送CMD命令: {command.strip()}", "CMD")
-                self.cmd_waiting_input = False  # 重置等待输入标志
-            except Exception as e:
-                self._log_entry("ERROR", f"发送CMD命令失败: {str(e)}", "CMD")
-    
-    def _execute_code(self, code: str) -> Tuple[str, bool]:
-        """执行代码并返回结果和是否成功"""
-        try:
-            with open("temp_execution.py", "w", encoding='utf-8') as f:
-                f.write(code)
-            
-            result = subprocess.run(
-                [sys.executable, "temp_execution.py"],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                errors='replace',
-                timeout=30
-            )
-            
-            os.remove("temp_execution.py")
-            
-            if result.returncode == 0:
-                return result.stdout.strip(), True
-            else:
-                return f"执行错误:\n{result.stderr}", False
-        except Exception as e:
-            return f"执行异常: {str(e)}", False
-    
-    def _install_dependencies(self, packages: list) -> Tuple[str, bool]:
-        """安装Python依赖包"""
-        try:
-            result = subprocess.run(
-                [sys.executable, "-m", "pip", "install"] + packages,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                errors='replace'
-            )
-            
-            if result.returncode == 0:
-                return "依赖安装成功", True
-            else:
-                return f"安装失败:\n{result.stderr}", False
-        except Exception as e:
-            return f"安装异常: {str(e)}", False
-    
-    def _set_reminder(self, content: str, delay_seconds: int, times: int = 1):
-        """设置时间提醒并记录日志"""
-        reminder_time = datetime.now() + timedelta(seconds=delay_seconds)
-        time_str = reminder_time.strftime("%Y-%m-%d %H:%M:%S")
-        
-        if times == 0 or times == -1:  # 无限次提醒
-            log_msg = f"设置提醒: '{content}' 在 {delay_seconds}秒后 ({time_str})，无限次提醒"
-            self.reminder_queue.put((reminder_time, content, delay_seconds, -1))
-        elif times == 1:  # 单次提醒
-            log_msg = f"设置提醒: '{content}' 在 {delay_seconds}秒后 ({time_str})"
-            self.reminder_queue.put((reminder_time, content, delay_seconds, 1))
-        else:  # 有限次提醒
-            log_msg = f"设置提醒: '{content}' 在 {delay_seconds}秒后 ({time_str})，共 {times}次"
-            self.reminder_queue.put((reminder_time, content, delay_seconds, times))
-            
-        self._log_entry("TIME", log_msg, "REMINDER")
-        self.message_queue.put(log_msg)
-    
-    def _start_reminder_checker(self):
-        """提醒检查线程，正确处理无限次提醒"""
-        def reminder_worker():
-            while self.running:
-                try:
-                    now = datetime.now()
-                    temp_queue = queue.Queue()
-                    
-                    while not self.reminder_queue.empty():
-                        item = self.reminder_queue.get()
-                        if not item:  # 空项检查
-                            continue
-                            
-                        # 解包元组
-                        reminder_time, content, interval, remaining = item
-                        
-                        if reminder_time <= now:
-                            # 触发提醒
-                            self._log_entry("REMINDER", f"触发提醒: '{content}'", "REMINDER")
-                            self.message_queue.put(f"[System提醒] {content}")
-                            
-                            # 处理无限次提醒
-                            if remaining == -1:  # 无限次提醒
-                                next_time = now + timedelta(seconds=interval)
-                                temp_queue.put((next_time, content, interval, -1))
-                            elif remaining > 1:  # 有限次且还有剩余次数
-                                next_time = now + timedelta(seconds=interval)
-                                temp_queue.put((next_time, content, interval, remaining - 1))
-                            # 剩余次数为1时不重新安排
-                        
-                        else:
-                            temp_queue.put(item)
-                    
-                    # 更新主队列
-                    while not temp_queue.empty():
-                        self.reminder_queue.put(temp_queue.get())
-                    time.sleep(0.5)
-                        
-                except Exception as e:
-                    self._log_entry("ERROR", f"提醒线程错误: {str(e)}", "SYSTEM")
-                    time.sleep(5)
-        
-        threading.Thread(target=reminder_worker, daemon=True).start()
-    
-    def execute_cmd_command(self, command: str) -> Tuple[str, bool]:
-        """在持久化CMD控制台中执行命令"""
-        try:
-            self._log_entry("COMMAND", f"执行CMD命令: {command}", "CMD")
-            
-            if not self.cmd_active or not self.cmd_process:
-                self._log_entry("WARNING", "CMD控制台未初始化，尝试重新初始化", "CMD")
-                self._init_cmd_console()
-                if not self.cmd_active:
-                    return "CMD控制台初始化失败", False
-
-            # 发送命令
-            self._send_cmd_command(command)
-            
-            # 等待命令执行完成或需要交互
-            start_time = time.time()
-            while not self.cmd_waiting_input and time.time() - start_time < 10:
-                time.sleep(0.1)
-            
-            # 如果等待输入，返回特殊标识
-            if self.cmd_waiting_input:
-                return f"[等待输入] {self.last_cmd_output}", True
-            
-            # 返回最后输出
-            return self.last_cmd_output, True
-        except Exception as e:
-            error_msg = f"CMD命令执行出错: {str(e)}"
-            self._log_entry("ERROR", error_msg, "CMD")
-            return error_msg, False
-    
-    def process_command(self, command: str, command_type: str = "Rcte") -> Tuple[Optional[str], bool]:
-        """处理System命令"""
-        if self.error_count >= self.max_errors:
-            self._log_entry("ERROR", "System错误次数过多，已暂停执行", "SYSTEM")
-            return "System错误次数过多，请检查系统状态", False
-            
-        self._log_entry("COMMAND", f"执行命令: {command}", "SYSTEM")
-        
-        # 根据命令类型处理
-        if command_type == "Cmd":
-            result, success = self.execute_cmd_command(command)
-            self._log_entry("RESULT", f"CMD结果: {result}", "SYSTEM")
-            return result, success
-        
-        # 安装依赖的指令
-        if "pip install" in command:
-            packages = []
-            for line in command.split('\n'):
-                if "pip install" in line:
-                    packages.extend(line.replace("pip install", "").strip().split())
-            
-            if packages:
-                result, success = self._install_dependencies(packages)
-                self._log_entry("RESULT", f"安装结果: {result}", "SYSTEM")
-                if not success:
-                    self.error_count += 1
-                return result, success
-            
-        # 执行普通代码
-        result, success = self._execute_code(command)
-        self._log_entry("RESULT", f"执行结果: {result}", "SYSTEM")
-        
-        if not success:
-            self.error_count += 1
-        
-        if self.error_count >= self.max_errors:
-            self._log_entry("ERROR", "System连续错误达到上限，已暂停执行", "SYSTEM")
-            return "System连续错误达到上限，已暂停执行", False
-            
-        return result, success
-        
-    def shutdown(self):
-        """关闭系统"""
-        self.running = False
-        self.cmd_active = False
-        
-        # 关闭CMD进程
-        if self.cmd_process:
-            try:
-                self.cmd_process.stdin.write("exit\n")
-                self.cmd_process.stdin.flush()
-                time.sleep(0.5)
-                self.cmd_process.terminate()
-            except Exception as e:
-                self._log_entry("ERROR", f"关闭CMD进程失败: {str(e)}", "CMD")
-            finally:
-                self.cmd_process = None
-        
-        self._log_entry("SYSTEM", "系统关闭", "SYSTEM")
-
-def extract_command_blocks(message: str) -> Tuple[str, List[Dict]]:
-    """
-    从消息中提取命令块并清理消息
-    返回: (清理后的消息, 命令块列表)
-    """
-    # 命令类型和对应的起始标记
-    command_types = {
-        "Rcte": "Rcte{",
-        "Time": "Time{",
-        "Cmd": "Cmd{"
-    }
-    
-    cleaned_message = message
-    commands = []
-    
-    # 查找所有命令块
-    for cmd_type, start_tag in command_types.items():
-        start_idx = 0
-        while True:
-            # 查找命令开始位置
-            cmd_start = cleaned_message.find(start_tag, start_idx)
-            if cmd_start == -1:
-                break
-                
-            # 查找命令结束位置
-            cmd_end = cleaned_message.find("}", cmd_start + len(start_tag))
-            if cmd_end == -1:
-                break
-                
-            # 提取命令内容
-            cmd_content = cleaned_message[cmd_start + len(start_tag):cmd_end].strip()
-            
-            # 记录命令
-            commands.append({
-                "type": cmd_type,
-                "content": cmd_content,
-                "start": cmd_start,
-                "end": cmd_end + 1  # 包含结束大括号
-            })
-            
-            # 从消息中移除命令块
-            cleaned_message = cleaned_message[:cmd_start] + cleaned_message[cmd_end + 1:]
-            
-            # 更新搜索起始位置
-            start_idx = cmd_start
-    
-    return cleaned_message, commands
-
-def process_user_message(user_input: str, ai: AIWife, system: MorSystem) -> str:
-    """处理用户消息，支持自然语言中的命令并正确处理执行结果"""
-    system._log_entry("USER", f"User input: {user_input}", "USER")
-    
-    # 优先处理CMD消息
-    cmd_processed = False
-    cmd_response = ""
-    
-    # 检查并处理10秒内的CMD消息
-    if not system.cmd_message_queue.empty():
-        cmd_msg = system.cmd_message_queue.get_nowait()
-        system._log_entry("CMD", f"处理CMD消息: {cmd_msg}", "SYSTEM")
-        
-        # 将CMD消息作为系统消息处理
-        system.message_queue.put(cmd_msg)
-        
-        # 如果需要输入，通知AI
-        if "[CMD等待输入]" in cmd_msg:
-            ai.chat(cmd_msg)  # 让AI知道需要响应
-            cmd_processed = True
-            cmd_response = cmd_msg
-    
-    # 如果有未处理的用户输入
-    if user_input and not cmd_processed:
-        ai_response = ai.chat(user_input)
-        system._log_entry("AI", f"Initial AI response: {ai_response}", "AI")
-        
-        # 提取并移除命令块
-        cleaned_response, commands = extract_command_blocks(ai_response)
-        
-        # 如果没有命令，直接返回清理后的响应
-        if not commands:
-            return cleaned_response if not cleaned_response.startswith("NULL") else ""
-        
-        # 处理所有命令并收集结果
-        command_results = []
-        for command in commands:
-            try:
-                if command["type"] == "Time":
-                    # 解析时间命令
-                    parts = [p.strip() for p in command["content"].split(',')]
-                    
-                    if len(parts) == 2:
-                        content, delay_seconds = parts[0], int(parts[1])
-                        times = 1
-                    elif len(parts) == 3:
-                        content, delay_seconds = parts[0], int(parts[1])
-                        times = int(parts[2])
-                    else:
-                        result = "时间命令格式错误: 应为 Time{内容,秒数[,次数]}"
-                        system._log_entry("ERROR", result, "SYSTEM")
-                        command_results.append(result)
-                        continue
-                    
-                    # 设置时间提醒
-                    system._set_reminder(content, delay_seconds, times)
-                    command_results.append("提醒设置成功")
-                else:
-                    # 执行命令并获取结果
-                    result, success = system.process_command(command["content"], command["type"])
-                    command_results.append(result)
-            except Exception as e:
-                error_msg = f"处理{command['type']}命令出错: {str(e)}"
-                system._log_entry("ERROR", error_msg, "SYSTEM")
-                command_results.append(error_msg)
-        
-        # 将命令执行结果反馈给AI
-        command_feedback = "\n".join(command_results)
-        feedback_prompt = f"命令执行结果:\n{command_feedback}\n\n请根据以上结果生成最终响应"
-        
-        # 将命令执行结果发送给AI
-        final_response = ai.chat(feedback_prompt)
-        system._log_entry("AI", f"Final AI response: {final_response}", "AI")
-        
-        # 返回最终响应
-        return final_response if not final_response.startswith("NULL") else ""
-    
-    # 如果只有CMD消息没有用户输入
-    return cmd_response if cmd_response else "NULL"
\ No newline at end of file
+import subprocess
+import sys
+import threading
+import time
+import os
+import queue
+import re
+import asyncio
+import uuid
+import codecs
+import shlex
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List, Dict, Any, Callable, Deque
+from AIchat import AIWife
+from AILoop import get_event_loop_thread
+from MorScheduler import ReminderScheduler, Reminder
+from MorLog import AsyncLogWriter
+from MorWorker import PythonWorkerPool
+from MorExecutor import CommandExecutor
+from MorParser import CommandParser, extract_command_blocks
+from MorMemory import MemoryStore
+from MorRetrieval import MemoryRetriever
+from MorSummarizer import SummaryWorker
+from MorEvents import EventAggregator, PRIORITY_SYSTEM, PRIORITY_REMINDER
+from MorRouter import ModelRouter, Route
+from MorMetrics import MetricsRegistry, TurnTrace, current_trace
+
+# 需要用户输入的提示，例如 [Y/n]
+CMD_INPUT_PROMPT_RE = re.compile(r'\[Y/n\]|\? \(yes/no\)|continue\?|confirm:', re.IGNORECASE)
+# 每条命令之后写入的结束标记：stdout标记带退出码，stderr标记用于确认stderr已读完
+CMD_END_RE = re.compile(r'__MOR_END_([0-9a-f]{32})__ (-?\d+)')
+CMD_ERR_RE = re.compile(r'__MOR_ERR_([0-9a-f]{32})__')
+
+class CmdRingBuffer:
+    """
+    CMD输出的有界环形缓冲区
+    
+    读线程写入，监控线程一次取走全部内容；写满时按drop_policy丢弃（oldest丢最旧的，newest丢新写入的）
+    并累计dropped计数。写入时会唤醒等待中的监控线程
+    """
+    
+    def __init__(self, capacity: int = 5000, drop_policy: str = "oldest"):
+        if drop_policy not in ("oldest", "newest"):
+            raise ValueError(f"未知的丢弃策略: {drop_policy}")
+        self.capacity = capacity
+        self.drop_policy = drop_policy
+        self.dropped = 0  # 累计丢弃的行数
+        self._items: Deque[str] = deque()
+        self._urgent = False
+        self._cond = threading.Condition()
+    
+    def put(self, item: str, urgent: bool = False) -> bool:
+        """写入一行；urgent表示需要监控线程立即处理。返回是否写入成功"""
+        with self._cond:
+            if len(self._items) >= self.capacity:
+                self.dropped += 1
+                if self.drop_policy == "newest":
+                    return False
+                self._items.popleft()
+            self._items.append(item)
+            self._urgent = self._urgent or urgent
+            self._cond.notify()
+            return True
+    
+    def drain(self) -> Tuple[List[str], bool]:
+        """取走全部内容，返回(内容, 期间是否有紧急写入)"""
+        with self._cond:
+            items = list(self._items)
+            self._items.clear()
+            urgent, self._urgent = self._urgent, False
+            return items, urgent
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待直到有内容或超时，返回是否有内容"""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            return bool(self._items)
+    
+    def wake(self):
+        """唤醒等待中的监控线程（关闭时使用）"""
+        with self._cond:
+            self._cond.notify_all()
+    
+    def __len__(self) -> int:
+        return len(self._items)
+
+class ShellPool:
+    """
+    多个MorSystem共用的CMD控制台上限
+
+    控制台在第一次执行Cmd命令时才启动；存活的控制台超过max_shells个时，回收最久未使用、
+    且没有命令在运行的控制台（记下工作目录，下次使用时在该目录重新启动）。
+    所有控制台都在忙时允许暂时超出上限
+    """
+    
+    def __init__(self, max_shells: int = 16):
+        self.max_shells = max(1, max_shells)
+        self.reclaimed = 0  # 被回收的控制台数
+        self._holders: "OrderedDict[int, MorSystem]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def acquire(self, system: "MorSystem"):
+        """登记一个新启动的控制台，必要时回收其它会话的空闲控制台"""
+        with self._lock:
+            self._holders[id(system)] = system
+            self._holders.move_to_end(id(system))
+            victims = [holder for holder in self._holders.values() if holder is not system]
+            excess = len(self._holders) - self.max_shells
+        for victim in victims:
+            if excess <= 0:
+                break
+            if victim.release_console():
+                self.reclaimed += 1
+                excess -= 1
+    
+    def touch(self, system: "MorSystem"):
+        """标记为最近使用"""
+        with self._lock:
+            if id(system) in self._holders:
+                self._holders.move_to_end(id(system))
+    
+    def release(self, system: "MorSystem"):
+        with self._lock:
+            self._holders.pop(id(system), None)
+    
+    def __len__(self) -> int:
+        return len(self._holders)
+
+class PendingCmdCommand:
+    """一条在持久化控制台中执行、等待结束标记的命令"""
+    
+    def __init__(self, token: str, command: str,
+                 on_output: Optional[Callable[[str, str], None]] = None):
+        self.token = token
+        self.command = command
+        self.on_output = on_output
+        self.stdout_lines: List[str] = []
+        self.stderr_lines: List[str] = []
+        self.exit_code: Optional[int] = None
+        self.stdout_done = False
+        self.stderr_done = False
+        self.waiting_input = False
+        self.attached = True  # 有调用方在等待结果；否则输出转入CMD消息队列
+        self.cond = threading.Condition()
+    
+    @property
+    def done(self) -> bool:
+        return self.stdout_done
+    
+    def attach(self, on_output: Optional[Callable[[str, str], None]] = None):
+        """重新挂接等待方（向仍在运行的命令发送输入时使用），只收集之后的输出"""
+        with self.cond:
+            self.on_output = on_output
+            self.stdout_lines = []
+            self.stderr_lines = []
+            self.waiting_input = False
+            self.attached = True
+    
+    def wait(self, timeout: float) -> str:
+        """
+        等待命令结束或需要输入
+        
+        返回:
+            "done"、"waiting_input" 或 "timeout"
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while not self.stdout_done and not self.waiting_input:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.attached = False
+                    return "timeout"
+                self.cond.wait(remaining)
+            if self.waiting_input and not self.stdout_done:
+                self.attached = False
+                return "waiting_input"
+            # stdout已结束，再短暂等待stderr读完
+            stderr_deadline = time.monotonic() + 0.5
+            while not self.stderr_done and time.monotonic() < stderr_deadline:
+                self.cond.wait(stderr_deadline - time.monotonic())
+            self.attached = False
+            return "done"
+    
+    def output(self) -> str:
+        """合并stdout与stderr输出"""
+        def strip_blank(lines):
+            while lines and not lines[-1].strip():
+                lines = lines[:-1]
+            return lines
+        text = "\n".join(strip_blank(self.stdout_lines))
+        stderr = "\n".join(strip_blank(self.stderr_lines))
+        if stderr:
+            text = f"{text}\n[STDERR]\n{stderr}" if text else f"[STDERR]\n{stderr}"
+        return text
+
+class MorSystem:
+    """重构后的System处理器，支持交互式CMD和实时消息反馈"""
+    
+    def __init__(self, ai_instance: AIWife, log_file: str = "SystemLog.log",
+                 log_writer: Optional[AsyncLogWriter] = None,
+                 python_pool: Optional[PythonWorkerPool] = None,
+                 command_workers: int = 4,
+                 memory: Optional[MemoryStore] = None,
+                 retriever: Optional[MemoryRetriever] = None,
+                 summarizer: Optional[SummaryWorker] = None,
+                 session_id: Optional[str] = None,
+                 reminders: Optional[ReminderScheduler] = None,
+                 shell_pool: Optional[ShellPool] = None):
+        self.ai = ai_instance
+        self.error_count = 0
+        self.max_errors = 999999
+        self.lock = threading.Lock()
+        self.log_file = log_file
+        # 日志由后台线程批量写入，按大小轮转并压缩旧文件
+        self.log_writer = log_writer or AsyncLogWriter(log_file, compress=True)
+        # Rcte代码交给预启动的Python工作进程执行
+        self.python_pool = python_pool or PythonWorkerPool()
+        self.rcte_timeout = self.python_pool.timeout  # Rcte代码默认超时秒数
+        # 一次回复中的多个命令块并发执行（Cmd块之间保持顺序）
+        self.command_executor = CommandExecutor(self, max_workers=command_workers)
+        self.stream_execute = True  # 流式接收回复时，命令块一闭合就开始执行
+        # 按轮次来源选择模型（默认只有主模型），并统计各路由的耗时与token
+        self.router = ModelRouter()
+        # 每轮对话各阶段的耗时与token（可由多个会话共用）
+        self.metrics = MetricsRegistry()
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.log_tag = ""  # 多个会话共用日志文件时写在来源后面，区分会话
+        # 对话、工具结果与提醒写入分层记忆库；记忆库、检索与摘要都由创建方传入，未传入时不记录也不检索
+        self.memory = memory
+        # 每轮对话前检索相关记忆，只注入top-k条且不超过token预算
+        self.retriever = retriever
+        self.memory_top_k = 5
+        self.memory_budget = 800
+        self.memory_exclude_recent = 40  # 检索时不重复注入最近这么多条消息的内容
+        self.memory_isolated = False  # 为True时只检索本会话的记忆
+        # 记忆层级升级在后台摘要，对话轮次不等待（会发起额外的AI请求，只在创建方需要时传入）
+        self.summarizer = summarizer
+        self.running = True
+        # 提醒、提醒确认与CMD输出等系统事件在合并窗口内合成一轮对话，由界面或无界面模式消费
+        self.events = EventAggregator(
+            on_error=lambda e: self._log_entry("ERROR", f"系统事件投递失败: {str(e)}", "SYSTEM"))
+        self.cmd_message_queue = queue.Queue(maxsize=100)  # 专用于CMD交互消息的队列
+        self.cmd_messages_dropped = 0  # CMD消息队列满时丢弃的最旧消息数
+        
+        # CMD控制台相关属性
+        self.cmd_process = None
+        self.cmd_thread = None
+        self.cmd_output_buffer = CmdRingBuffer(capacity=5000)  # 读线程写入的原始输出
+        self.cmd_input_queue = queue.Queue()
+        self.cmd_working_directory = os.getcwd()
+        self.cmd_history = deque(maxlen=1000)
+        self.cmd_active = False
+        self.cmd_encoding = 'utf-8'
+        self.last_cmd_output = ""  # 记录最后一条CMD输出
+        self.cmd_waiting_input = False  # 标记CMD是否在等待输入
+        self.last_cmd_flush_time = time.time()  # 上次发送CMD消息的时间
+        self.cmd_buffer = []  # 用于存储尚未发送的CMD输出
+        self.cmd_flush_interval = 10  # 一批输出最多等待的秒数
+        self.cmd_flush_lines = 200  # 累计到这么多行时立即发送
+        self.cmd_timeout = 30  # Cmd命令默认等待结束的秒数
+        self.cmd_pending: Deque[PendingCmdCommand] = deque()  # 已发送、尚未读到结束标记的命令（按发送顺序）
+        self.cmd_pending_lock = threading.Lock()
+        self.cmd_lock = threading.Lock()  # 串行化Cmd命令的发送与等待
+        self.cmd_init_lock = threading.Lock()  # 防止并发的命令同时启动控制台
+        self.cmd_generation = 0  # 每次启动控制台加一，旧控制台的监控线程据此退出
+        # 给出shell_pool时控制台按需启动并受其数量上限约束，否则立即启动
+        self.shell_pool = shell_pool
+        # 共用的提醒调度器由创建方负责按owner分发触发的提醒
+        self.reminders = reminders
+        self._owns_reminders = reminders is None
+
+        self._init_log_file()
+        self._start_reminder_checker()
+        if shell_pool is None:
+            self._init_cmd_console()
+    
+    def _init_log_file(self):
+        """初始化日志文件"""
+        self.log_writer.write(f"\n\n=== System Session Started at {datetime.now()} ===\n")
+    
+    def _log_entry(self, entry_type: str, content: str, source: str = "SYSTEM"):
+        """写入日志条目（只入队，不在调用线程做文件I/O）"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self.log_tag:
+            source = f"{source}@{self.log_tag}"
+        log_msg = f"[{timestamp}] [{entry_type}] [{source}] {content}\n"
+        self.log_writer.write(log_msg)
+    
+    def _init_cmd_console(self):
+        """初始化持久化CMD控制台"""
+        encoding = self.cmd_encoding
+        
+        try:
+            if sys.platform == "win32":
+                # Windows下设置UTF-8编码
+                self.cmd_process = subprocess.Popen(
+                    ["cmd.exe"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,  # 分离stderr以便更好处理错误
+                    cwd=self.cmd_working_directory,
+                    bufsize=0,  # 无缓冲
+                    text=True,
+                    encoding=encoding,
+                    errors='replace'
+                )
+            else:
+                # Linux/Mac使用bash
+                self.cmd_process = subprocess.Popen(
+                    ["/bin/bash", "-i"],  # 交互模式
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    cwd=self.cmd_working_directory,
+                    bufsize=0,
+                    text=True,
+                    encoding=encoding,
+                    errors='replace'
+                )
+            
+            with self.cmd_pending_lock:
+                self.cmd_pending.clear()  # 旧控制台中未结束的命令不会再有结束标记
+            
+            # 启动线程读取CMD输出
+            self.cmd_active = True
+            self.cmd_generation += 1
+            self.cmd_thread = threading.Thread(target=self._read_cmd_output)
+            self.cmd_thread.daemon = True
+            self.cmd_thread.start()
+            self._start_cmd_monitor()  # 启动CMD监控线程
+            
+            # 关闭命令回显与提示符（bash需关闭readline，否则输入会被回显到stderr；
+            # 不显示提示符，PROMPT_COMMAND中的钩子也一并去掉，否则每行输入都要执行一次），
+            # 启动时的欢迎信息也随这条命令一并读走。只发送不等待：控制台按顺序执行，
+            # 之后的命令自然排在它后面，构造MorSystem不必等shell加载完启动脚本
+            setup = "@echo off" if sys.platform == "win32" else "set +o emacs +o vi; PS1='' PS2=''; unset PROMPT_COMMAND"
+            pending = PendingCmdCommand(uuid.uuid4().hex, setup)
+            with self.cmd_lock:
+                with self.cmd_pending_lock:
+                    self.cmd_pending.append(pending)
+                self._send_cmd_command(setup, pending.token)
+            threading.Thread(target=self._await_cmd_setup, args=(pending,), daemon=True).start()
+            if self.shell_pool is not None:
+                self.shell_pool.acquire(self)
+        except Exception as e:
+            self._log_entry("ERROR", f"初始化CMD控制台失败: {str(e)}", "CMD")
+            self.cmd_active = False
+    
+    def _await_cmd_setup(self, pending: PendingCmdCommand):
+        """后台等待控制台初始化命令结束并记录启动输出"""
+        if pending.wait(timeout=30) != "done":
+            self._log_entry("WARNING", "CMD控制台初始化命令未在30秒内结束", "CMD")
+            return
+        output = pending.output()
+        if output:
+            self._log_entry("DEBUG", f"CMD启动输出: {output}", "CMD")
+        self._log_entry("DEBUG", "CMD控制台初始化完成", "CMD")
+    
+    def _start_cmd_monitor(self):
+        """
+        启动CMD监控线程：由事件驱动把缓冲的输出整合发送到cmd_message_queue
+        
+        没有待发送内容时一直睡眠直到有新输出；出现输入提示或命令结束时立即发送，
+        累计到cmd_flush_lines行时立即发送，否则一批输出最多等待cmd_flush_interval秒
+        """
+        generation = self.cmd_generation
+        
+        def monitor():
+            batch_started = None  # 当前这批输出中第一行到达的时间
+            while self.cmd_active and self.cmd_generation == generation:
+                try:
+                    timeout = None
+                    if batch_started is not None:
+                        timeout = max(0.0, batch_started + self.cmd_flush_interval - time.monotonic())
+                    self.cmd_output_buffer.wait(timeout)
+                    
+                    lines, urgent = self.cmd_output_buffer.drain()
+                    if lines:
+                        if batch_started is None:
+                            batch_started = time.monotonic()
+                        self.cmd_buffer.extend(lines)
+                        # 检测是否需要用户输入
+                        if any(CMD_INPUT_PROMPT_RE.search(line) for line in lines):
+                            self.cmd_waiting_input = True
+                    
+                    due = batch_started is not None and time.monotonic() - batch_started >= self.cmd_flush_interval
+                    if self.cmd_buffer and (urgent or due or self.cmd_waiting_input
+                                            or len(self.cmd_buffer) >= self.cmd_flush_lines):
+                        self._flush_cmd_buffer()
+                        batch_started = None
+                except Exception as e:
+                    self._log_entry("ERROR", f"CMD监控线程错误: {str(e)}", "CMD")
+                    time.sleep(1)
+        
+        threading.Thread(target=monitor, daemon=True).start()
+    
+    def _flush_cmd_buffer(self):
+        """把缓冲的输出按cmd_flush_lines分段放入cmd_message_queue"""
+        prefix = "[CMD等待输入]" if self.cmd_waiting_input else "[CMD输出]"
+        dropped = self.cmd_output_buffer.dropped
+        if dropped:
+            self.cmd_buffer.append(f"[已丢弃 {dropped} 行输出]")
+            self.cmd_output_buffer.dropped = 0
+        
+        for start in range(0, len(self.cmd_buffer), self.cmd_flush_lines):
+            combined_message = "\n".join(self.cmd_buffer[start:start + self.cmd_flush_lines])
+            try:
+                self.cmd_message_queue.put_nowait(f"{prefix} {combined_message}")
+            except queue.Full:
+                # 队列已满时丢弃最旧的消息，保留最新输出
+                try:
+                    self.cmd_message_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self.cmd_messages_dropped += 1
+                self.cmd_message_queue.put_nowait(f"{prefix} {combined_message}")
+        
+        self.cmd_buffer = []  # 清空缓冲区
+        self.last_cmd_flush_time = time.time()
+        self.cmd_waiting_input = False  # 重置等待输入标志
+    
+    def _read_cmd_output(self):
+        """读取CMD控制台输出（分离stdout和stderr）"""
+        self._log_entry("DEBUG", "CMD输出读取线程启动", "CMD")
+        
+        def read_stream(stream, stream_type):
+            """按块读取指定流，末尾没有换行的输入提示（如 [Y/n] ）也能立即识别"""
+            decoder = codecs.getincrementaldecoder(self.cmd_encoding)(errors='replace')
+            fd = stream.fileno()
+            partial = ""
+            while self.cmd_active:
+                try:
+                    data = os.read(fd, 65536)
+                    if not data:
+                        break  # 控制台已退出
+                    lines = (partial + decoder.decode(data)).split("\n")
+                    partial = lines.pop()
+                    for line in lines:
+                        self._dispatch_cmd_line(stream_type, line.rstrip("\r"))
+                    if partial and CMD_INPUT_PROMPT_RE.search(partial):
+                        self._dispatch_cmd_line(stream_type, partial)
+                        partial = ""
+                except Exception as e:
+                    self._log_entry("ERROR", f"读取CMD{stream_type}错误: {str(e)}", "CMD")
+        
+        # 启动单独的线程读取stdout和stderr
+        threading.Thread(target=read_stream, args=(self.cmd_process.stdout, "STDOUT"), daemon=True).start()
+        threading.Thread(target=read_stream, args=(self.cmd_process.stderr, "STDERR"), daemon=True).start()
+    
+    def _dispatch_cmd_line(self, stream_type: str, line: str):
+        """
+        把一行控制台输出交给所属的命令
+        
+        控制台按顺序执行命令，因此每个流上的输出属于最早一条尚未在该流上读到结束标记的命令；
+        没有调用方在等待的输出转入CMD消息队列
+        """
+        is_stdout = stream_type == "STDOUT"
+        with self.cmd_pending_lock:
+            owner = None
+            for pending in self.cmd_pending:
+                if not (pending.stdout_done if is_stdout else pending.stderr_done):
+                    owner = pending
+                    break
+            
+            if owner is not None:
+                marker = (CMD_END_RE if is_stdout else CMD_ERR_RE).search(line)
+                if marker and marker.group(1) == owner.token:
+                    if marker.start() > 0:
+                        # 命令输出末尾没有换行时，标记会接在最后一行之后
+                        self._deliver_cmd_line(owner, stream_type, line[:marker.start()])
+                    with owner.cond:
+                        if is_stdout:
+                            owner.exit_code = int(marker.group(2))
+                            owner.stdout_done = True
+                        else:
+                            owner.stderr_done = True
+                        attached = owner.attached
+                        owner.cond.notify_all()
+                    while self.cmd_pending and self.cmd_pending[0].stdout_done and self.cmd_pending[0].stderr_done:
+                        self.cmd_pending.popleft()
+                    if is_stdout and not attached:
+                        self.cmd_output_buffer.put(f"[EXIT] 命令结束，退出码 {owner.exit_code}", urgent=True)
+                    return
+                
+                self._deliver_cmd_line(owner, stream_type, line)
+                return
+        self.cmd_output_buffer.put(f"[{stream_type}] {line.strip()}")
+    
+    def _deliver_cmd_line(self, owner: PendingCmdCommand, stream_type: str, line: str):
+        """交给等待中的调用方；无人等待时转入CMD消息队列"""
+        with owner.cond:
+            if owner.attached:
+                (owner.stdout_lines if stream_type == "STDOUT" else owner.stderr_lines).append(line)
+                if CMD_INPUT_PROMPT_RE.search(line):
+                    owner.waiting_input = True
+                    owner.cond.notify_all()
+                if owner.on_output:
+                    owner.on_output(stream_type, line)
+                return
+        self.cmd_output_buffer.put(f"[{stream_type}] {line.strip()}")
+    
+    def _send_cmd_command(self, command: str, token: Optional[str] = None):
+        """向CMD控制台发送命令；给出token时在命令后追加带退出码的结束标记"""
+        if self.cmd_process and self.cmd_process.stdin:
+            try:
+                data = command + "\n"
+                if token and sys.platform == "win32":
+                    data += (f"echo __MOR_END_{token}__ %errorlevel%\n"
+                             f"echo __MOR_ERR_{token}__ 1>&2\n")
+                elif token:
+                    # 标记由printf格式参数拼出，命令文本本身不含完整标记
+                    data += (f"__mor_rc=$?; printf '__MOR_%s_%s__ %d\\n' END {token} $__mor_rc; "
+                             f"printf '__MOR_%s_%s__\\n' ERR {token} >&2\n")
+                self.cmd_process.stdin.write(data)
+                self.cmd_process.stdin.flush()
+                self.cmd_history.append(command.strip())
+                self._log_entry("DEBUG", f"发送CMD命令: {command.strip()}", "CMD")
+                self.cmd_waiting_input = False  # 重置等待输入标志
+            except Exception as e:
+                self._log_entry("ERROR", f"发送CMD命令失败: {str(e)}", "CMD")
+    
+    def _execute_code(self, code: str) -> Tuple[str, bool]:
+        """执行代码并返回结果和是否成功"""
+        try:
+            result = self.python_pool.run(code, timeout=self.rcte_timeout)
+            if result.error:
+                return f"执行异常: {result.error}", False
+            if result.timed_out:
+                return f"执行超时: 代码在{self.rcte_timeout}秒内未结束，已终止", False
+            if result.returncode == 0:
+                return result.stdout.strip(), True
+            else:
+                return f"执行错误:\n{result.stderr}", False
+        except Exception as e:
+            return f"执行异常: {str(e)}", False
+    
+    def _install_dependencies(self, packages: list) -> Tuple[str, bool]:
+        """安装Python依赖包"""
+        try:
+            result = subprocess.run(
+                [sys.executable, "-m", "pip", "install"] + packages,
+                capture_output=True,
+                text=True,
+                encoding='utf-8',
+                errors='replace'
+            )
+            
+            if result.returncode == 0:
+                return "依赖安装成功", True
+            else:
+                return f"安装失败:\n{result.stderr}", False
+        except Exception as e:
+            return f"安装异常: {str(e)}", False
+    
+    def _set_reminder(self, content: str, delay_seconds: int, times: int = 1) -> int:
+        """设置时间提醒并记录日志，返回提醒ID"""
+        reminder_time = datetime.now() + timedelta(seconds=delay_seconds)
+        time_str = reminder_time.strftime("%Y-%m-%d %H:%M:%S")
+        
+        if times == 0 or times == -1:  # 无限次提醒
+            log_msg = f"设置提醒: '{content}' 在 {delay_seconds}秒后 ({time_str})，无限次提醒"
+        elif times == 1:  # 单次提醒
+            log_msg = f"设置提醒: '{content}' 在 {delay_seconds}秒后 ({time_str})"
+        else:  # 有限次提醒
+            log_msg = f"设置提醒: '{content}' 在 {delay_seconds}秒后 ({time_str})，共 {times}次"
+        reminder_id = self.reminders.add(content, delay_seconds, times, owner=self.session_id)
+            
+        self._log_entry("TIME", log_msg, "REMINDER")
+        self.post_event(log_msg, "reminder_set")
+        return reminder_id
+    
+    def _fire_reminder(self, reminder: Reminder):
+        """提醒触发回调（在调度线程中执行）"""
+        self._log_entry("REMINDER", f"触发提醒: '{reminder.content}'", "REMINDER")
+        self.remember("reminder", reminder.content)
+        self.post_event(f"[System提醒] {reminder.content}", "reminder", PRIORITY_REMINDER)
+    
+    def post_event(self, text: str, kind: str = "system", priority: int = PRIORITY_SYSTEM):
+        """提交一条系统事件，与合并窗口内的其它事件一起交给AI"""
+        self.events.post(text, kind, priority)
+    
+    def remember(self, kind: str, content: str, important: bool = False):
+        """把一条记忆写入当前会话的缓存记忆（异步批量提交，没有记忆库时忽略）"""
+        if self.memory is not None:
+            self.memory.add(kind, content, session=self.session_id, important=important)
+    
+    def recall(self, text: str) -> str:
+        """检索与text相关的记忆，返回可注入提示词的文本（最近的消息不重复注入，开销与会话长度无关）"""
+        if self.retriever is None or not self.memory_top_k or not text:
+            return ""
+        in_context = [message["content"] for message in self.ai.messages[-self.memory_exclude_recent:]]
+        in_context.append(text)
+        return self.retriever.build_context(text, k=self.memory_top_k, token_budget=self.memory_budget,
+                                            exclude=in_context,
+                                            session=self.session_id if self.memory_isolated else None)
+    
+    def _start_reminder_checker(self):
+        """启动基于最小堆的提醒调度器，只在最近的提醒到期时唤醒（使用共用调度器时不需要）"""
+        if not self._owns_reminders:
+            return
+        self.reminders = ReminderScheduler(
+            self._fire_reminder,
+            on_error=lambda e: self._log_entry("ERROR", f"提醒线程错误: {str(e)}", "SYSTEM"))
+        self.reminders.start()
+    
+    def list_reminders(self) -> List[Dict]:
+        """按触发时间列出所有待触发的提醒"""
+        return self.reminders.list(owner=self.session_id)
+    
+    def cancel_reminder(self, reminder_id: int) -> bool:
+        """按ID取消提醒"""
+        cancelled = self.reminders.cancel(reminder_id, owner=self.session_id)
+        if cancelled:
+            self._log_entry("TIME", f"取消提醒: {reminder_id}", "REMINDER")
+        return cancelled
+    
+    def _run_cmd_command(self, command: str, timeout: float,
+                         on_output: Optional[Callable[[str, str], None]] = None) -> Tuple[str, bool]:
+        """发送命令并等待它的结束标记"""
+        with self.cmd_lock:
+            with self.cmd_pending_lock:
+                running = self.cmd_pending[0] if self.cmd_pending else None
+            if running is not None and running.waiting_input and not running.done:
+                # 正在运行的命令在等待输入，本次内容作为它的输入
+                pending = running
+                pending.attach(on_output)
+                self._send_cmd_command(command)
+            else:
+                pending = PendingCmdCommand(uuid.uuid4().hex, command, on_output)
+                with self.cmd_pending_lock:
+                    self.cmd_pending.append(pending)
+                self._send_cmd_command(command, pending.token)
+            
+            state = pending.wait(timeout)
+            output = pending.output()
+        
+        if state == "waiting_input":
+            return f"[等待输入] {output}", True
+        if state == "timeout":
+            return f"[超时] 命令{timeout}秒内未结束，仍在后台运行，后续输出将通过CMD消息反馈\n{output}", False
+        if pending.exit_code:
+            return f"{output}\n[退出码 {pending.exit_code}]", False
+        return output, True
+    
+    def execute_cmd_command(self, command: str, timeout: Optional[float] = None,
+                            on_output: Optional[Callable[[str, str], None]] = None) -> Tuple[str, bool]:
+        """
+        在持久化CMD控制台中执行命令，命令结束后立即返回其输出
+        
+        参数:
+            command: 要执行的命令；若上一条命令仍在运行（如等待输入），则作为它的输入发送
+            timeout: 等待结束的秒数，默认使用self.cmd_timeout；超时后命令继续在后台运行
+            on_output: 每收到一行输出时回调 on_output(流类型, 行内容)，用于长时间运行的命令
+        """
+        try:
+            self._log_entry("COMMAND", f"执行CMD命令: {command}", "CMD")
+            
+            with self.cmd_init_lock:
+                if not self.cmd_active or not self.cmd_process:
+                    if self.shell_pool is None:
+                        self._log_entry("WARNING", "CMD控制台未初始化，尝试重新初始化", "CMD")
+                    self._init_cmd_console()
+                    if not self.cmd_active:
+                        return "CMD控制台初始化失败", False
+            if self.shell_pool is not None:
+                self.shell_pool.touch(self)
+
+            output, success = self._run_cmd_command(
+                command, self.cmd_timeout if timeout is None else timeout, on_output)
+            self.last_cmd_output = output
+            return output, success
+        except Exception as e:
+            error_msg = f"CMD命令执行出错: {str(e)}"
+            self._log_entry("ERROR", error_msg, "CMD")
+            return error_msg, False
+    
+    def get_cmd_cwd(self) -> str:
+        """查询CMD控制台当前的工作目录（控制台未启动时直接返回记录的目录）"""
+        if not self.cmd_active:
+            return self.cmd_working_directory
+        output, success = self.execute_cmd_command("cd" if sys.platform == "win32" else "pwd", timeout=5)
+        return self._update_cmd_cwd(output, success)
+    
+    def _update_cmd_cwd(self, output: str, success: bool) -> str:
+        if success and output.strip():
+            self.cmd_working_directory = output.strip().splitlines()[-1]
+        return self.cmd_working_directory
+    
+    def set_cmd_cwd(self, path: str) -> bool:
+        """切换CMD控制台的工作目录"""
+        command = f'cd /d "{path}"' if sys.platform == "win32" else f"cd {shlex.quote(path)}"
+        output, success = self.execute_cmd_command(command, timeout=5)
+        if success:
+            self.cmd_working_directory = path
+        return success
+    
+    def process_command(self, command: str, command_type: str = "Rcte") -> Tuple[Optional[str], bool]:
+        """处理System命令"""
+        if self.error_count >= self.max_errors:
+            self._log_entry("ERROR", "System错误次数过多，已暂停执行", "SYSTEM")
+            return "System错误次数过多，请检查系统状态", False
+            
+        self._log_entry("COMMAND", f"执行命令: {command}", "SYSTEM")
+        
+        # 根据命令类型处理
+        if command_type == "Cmd":
+            result, success = self.execute_cmd_command(command)
+            self._log_entry("RESULT", f"CMD结果: {result}", "SYSTEM")
+            return result, success
+        
+        # 安装依赖的指令
+        if "pip install" in command:
+            packages = []
+            for line in command.split('\n'):
+                if "pip install" in line:
+                    packages.extend(line.replace("pip install", "").strip().split())
+            
+            if packages:
+                result, success = self._install_dependencies(packages)
+                self._log_entry("RESULT", f"安装结果: {result}", "SYSTEM")
+                if not success:
+                    self.error_count += 1
+                return result, success
+            
+        # 执行普通代码
+        result, success = self._execute_code(command)
+        self._log_entry("RESULT", f"执行结果: {result}", "SYSTEM")
+        
+        if not success:
+            self.error_count += 1
+        
+        if self.error_count >= self.max_errors:
+            self._log_entry("ERROR", "System连续错误达到上限，已暂停执行", "SYSTEM")
+            return "System连续错误达到上限，已暂停执行", False
+            
+        return result, success
+        
+    def release_console(self) -> bool:
+        """
+        关闭空闲的CMD控制台，记下工作目录，下次执行Cmd命令时重新启动
+        
+        返回:
+            是否已关闭（有命令在运行时不关闭）
+        """
+        if not self.cmd_init_lock.acquire(blocking=False):
+            return False  # 正在启动控制台
+        try:
+            with self.cmd_pending_lock:
+                busy = bool(self.cmd_pending)
+            if not self.cmd_active or busy or self.cmd_lock.locked():
+                return False
+            self._update_cmd_cwd(*self._run_cmd_command("cd" if sys.platform == "win32" else "pwd", timeout=5))
+            if not self.cmd_lock.acquire(blocking=False):
+                return False
+            try:
+                with self.cmd_pending_lock:
+                    if self.cmd_pending:
+                        return False  # 查询目录期间又有命令开始执行
+                self._close_cmd_console()
+            finally:
+                self.cmd_lock.release()
+        finally:
+            self.cmd_init_lock.release()
+        self._log_entry("DEBUG", f"CMD控制台已回收，工作目录: {self.cmd_working_directory}", "CMD")
+        return True
+    
+    def _close_cmd_console(self, wait: float = 0.5):
+        """结束CMD进程，读线程与监控线程随之退出"""
+        self.cmd_active = False
+        self.cmd_output_buffer.wake()
+        if self.shell_pool is not None:
+            self.shell_pool.release(self)
+        if self.cmd_process:
+            try:
+                self.cmd_process.stdin.write("exit\n")
+                self.cmd_process.stdin.flush()
+                time.sleep(wait)
+                self.cmd_process.terminate()
+            except Exception as e:
+                self._log_entry("ERROR", f"关闭CMD进程失败: {str(e)}", "CMD")
+            finally:
+                self.cmd_process = None
+    
+    def release(self):
+        """
+        释放本会话独占的资源（CMD控制台、命令线程池），不关闭与其它会话共用的资源
+        
+        使用共用调度器时提醒仍保留在调度器中，由创建方在触发时重新载入会话
+        """
+        self.running = False
+        self.events.close()
+        self.command_executor.close()
+        self._close_cmd_console(wait=0.1)
+        self._log_entry("SYSTEM", "会话已释放", "SYSTEM")
+    
+    def shutdown(self):
+        """关闭系统"""
+        self.running = False
+        self.events.close()
+        if self._owns_reminders:
+            self.reminders.stop()
+        else:
+            self.reminders.cancel_owner(self.session_id)
+        self.python_pool.close()
+        self.command_executor.close()
+        self._close_cmd_console()
+        
+        self._log_entry("SYSTEM", "系统关闭", "SYSTEM")
+        if self.summarizer is not None:
+            self.summarizer.stop()
+        if self.memory is not None:
+            self.memory.close()
+        if self.retriever is not None:
+            self.retriever.save()
+        self.log_writer.close()
+
+def visible_stream_text(text: str) -> str:
+    """
+    计算流式回复中可以展示给用户的部分
+    以NULL开头的回复整体隐藏；命令块及其之后的内容（包括尚未写完的命令标记）不展示
+    """
+    stripped = text.lstrip()
+    if stripped.startswith("NULL") or "NULL".startswith(stripped):
+        return ""
+    
+    cut = len(text)
+    for start_tag in ("Rcte{", "Time{", "Cmd{"):
+        idx = text.find(start_tag)
+        if idx != -1:
+            cut = min(cut, idx)
+        # 末尾可能是命令标记的前半段，例如 "Rc"
+        for i in range(1, len(start_tag)):
+            if text.endswith(start_tag[:i]):
+                cut = min(cut, len(text) - i)
+                break
+    return text[:cut].rstrip()
+
+def _log_request_timing(ai: AIWife, system: MorSystem):
+    """记录最近一次API请求的耗时分解"""
+    timing = getattr(ai, "last_timing", None)
+    if timing:
+        system._log_entry("TIMING", f"API请求耗时: {timing}", "AI")
+
+async def _ai_chat(ai: AIWife, message: str, stream: bool = False,
+                   on_delta: Optional[Callable[[str, str], None]] = None,
+                   context: Optional[str] = None, route: Optional[Route] = None) -> str:
+    """
+    调用AI：AsyncAIWife直接await，同步AIWife放到线程池中执行，避免阻塞事件循环
+    轮次被取消时通知同步请求停止，并等线程结束（此时本次提问已从历史中撤回）再向上传递取消，
+    下一轮开始时不会有上一轮的请求仍在改写历史
+    """
+    if asyncio.iscoroutinefunction(ai.chat):
+        return await ai.chat(message, stream=stream, on_delta=on_delta, context=context, route=route)
+    cancel = threading.Event()
+    future = asyncio.ensure_future(asyncio.to_thread(ai.chat, message, stream=stream, on_delta=on_delta,
+                                                     context=context, route=route, cancel=cancel))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.set()
+        await asyncio.wait([future])
+        raise
+
+async def _route_chat(ai: AIWife, route: Route, phase: str, message: str, **kwargs) -> str:
+    """经由指定路由调用AI（路由随本次请求传入，不改动共用的AI实例），耗时与token计入该路由和当前轮次的phase阶段"""
+    ai.last_timing = None
+    started = time.perf_counter()
+    response = await _ai_chat(ai, message, route=route, **kwargs)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    usage = getattr(ai, "last_usage", None)
+    route.record(elapsed_ms, response, ai.last_timing, usage)
+    trace = current_trace()
+    if trace is not None:
+        trace.add_request(phase, started, elapsed_ms, ai.last_timing, usage, route=route.name)
+    return response
+
+async def _routed_chat(ai: AIWife, system: MorSystem, source: str, message: str, phase: str = "llm", **kwargs) -> str:
+    """按轮次来源选择模型调用AI；快速模型的回复含命令块时撤回，改由主模型重新回答"""
+    router = system.router
+    route = router.route_for(source)
+    response = await _route_chat(ai, route, phase, message, **kwargs)
+    if router.should_escalate(route, response) and router.rollback(ai, message):
+        route.escalations += 1
+        system._log_entry("ROUTER", f"{route.name}路由的回复包含命令块，转交{router.main.name}路由重新回答", "AI")
+        response = await _route_chat(ai, router.main, phase, message, **kwargs)
+    return response
+
+async def async_process_user_message(user_input: str, ai: AIWife, system: MorSystem,
+                                     on_delta: Optional[Callable[[str, str], None]] = None,
+                                     source: str = "user", queue_wait: Optional[float] = None) -> str:
+    """
+    处理用户消息，支持自然语言中的命令并正确处理执行结果（协程版本）
+    传入on_delta时以流式方式请求AI，每段增量回调 on_delta(增量文本, 当前累计文本)
+    source为轮次来源（user/system/timer/tool），由system.router据此选择模型；命令结果反馈按tool路由
+    各阶段耗时记入system.metrics，queue_wait为这一轮开始前排队的秒数
+    """
+    metrics = system.metrics
+    trace = metrics.begin(source, system.session_id, queue_wait * 1000 if queue_wait is not None else None)
+    try:
+        with metrics.profile(trace):
+            return await _process_turn(user_input, ai, system, on_delta, source, trace)
+    finally:
+        metrics.finish(trace)
+
+async def _process_turn(user_input: str, ai: AIWife, system: MorSystem,
+                        on_delta: Optional[Callable[[str, str], None]], source: str, trace: TurnTrace) -> str:
+    stream = on_delta is not None
+    system._log_entry("USER", f"User input: {user_input}", "USER")
+    if user_input:
+        system.remember("user", user_input)
+    
+    # 优先处理CMD消息
+    cmd_processed = False
+    cmd_response = ""
+    
+    # 检查并处理10秒内的CMD消息
+    if not system.cmd_message_queue.empty():
+        cmd_msg = system.cmd_message_queue.get_nowait()
+        system._log_entry("CMD", f"处理CMD消息: {cmd_msg}", "SYSTEM")
+        system.remember("tool", cmd_msg)
+        
+        # 将CMD消息作为系统消息处理
+        system.post_event(cmd_msg, "cmd")
+        
+        # 如果需要输入，通知AI
+        if "[CMD等待输入]" in cmd_msg:
+            await _routed_chat(ai, system, "tool", cmd_msg, phase="cmd_notify")  # 让AI知道需要响应
+            cmd_processed = True
+            cmd_response = cmd_msg
+    
+    # 如果有未处理的用户输入
+    if user_input and not cmd_processed:
+        # 检索相关记忆，只随本次请求发送
+        try:
+            with trace.span("memory_recall"):
+                memory_context = await asyncio.to_thread(system.recall, user_input)
+        except Exception as e:
+            system._log_entry("ERROR", f"记忆检索失败: {str(e)}", "SYSTEM")
+            memory_context = ""
+        if memory_context:
+            system._log_entry("MEMORY", f"注入记忆:\n{memory_context}", "SYSTEM")
+        
+        # 只在调用方要求流式回复时边生成边执行（不改变非流式调用的请求方式）；
+        # 快速模型的回复可能被撤回、转交主模型，不能边生成边执行
+        if stream and system.stream_execute and system.router.route_for(source) is system.router.main:
+            # 边生成边执行：解析器每闭合一个命令块就提交执行，与后续内容的生成重叠
+            parser = CommandParser()
+            batch = system.command_executor.batch()
+            
+            def on_stream_delta(delta: str, text: str):
+                for block in parser.feed(delta):
+                    system._log_entry("DEBUG", f"流式解析到{block['type']}命令块，立即执行", "SYSTEM")
+                    batch.submit_threadsafe(block)
+                if on_delta:
+                    on_delta(delta, text)
+            
+            try:
+                ai_response = await _routed_chat(ai, system, source, user_input, stream=stream,
+                                                 on_delta=on_stream_delta, context=memory_context)
+            except asyncio.CancelledError:
+                await batch.cancel()  # 已提交的命令不能中断，等它们结束
+                raise
+        else:
+            parser = batch = None
+            ai_response = await _routed_chat(ai, system, source, user_input, stream=stream,
+                                             on_delta=on_delta, context=memory_context)
+        system._log_entry("AI", f"Initial AI response: {ai_response}", "AI")
+        system.remember("ai", ai_response)
+        _log_request_timing(ai, system)
+        
+        # 提取并移除命令块
+        if batch is not None and parser.text == ai_response:
+            with trace.span("parse_commands"):
+                cleaned_response, commands = parser.finish()
+            await asyncio.sleep(0)  # 让其它线程排队中的提交先落地
+            for block in commands[len(batch):]:
+                batch.submit(block)
+        else:
+            with trace.span("parse_commands"):
+                cleaned_response, commands = extract_command_blocks(ai_response)
+            if batch is not None and len(batch):
+                # 流式请求中途失败：等已经开始的命令结束，不再反馈
+                await batch.results()
+            batch = None
+        
+        # 如果没有命令，直接返回清理后的响应
+        if not commands:
+            return cleaned_response if not cleaned_response.startswith("NULL") else ""
+        
+        # 并发执行所有命令，结果按原始顺序排列
+        if batch is not None:
+            command_results = await batch.results()
+        else:
+            command_results = await system.command_executor.run(commands)
+        
+        for item in command_results:
+            trace.add(f"command.{item.type}", item.duration * 1000, index=item.index, success=item.success)
+        
+        # 将命令执行结果反馈给AI
+        command_feedback = "\n".join(str(item.result) for item in command_results)
+        for item in command_results:
+            system.remember("tool", f"{item.type}{{{item.content}}}\n结果: {item.result}")
+        feedback_prompt = f"命令执行结果:\n{command_feedback}\n\n请根据以上结果生成最终响应"
+        
+        # 将命令执行结果发送给AI
+        final_response = await _routed_chat(ai, system, "tool", feedback_prompt, phase="feedback",
+                                            stream=stream, on_delta=on_delta)
+        system._log_entry("AI", f"Final AI response: {final_response}", "AI")
+        system.remember("ai", final_response)
+        _log_request_timing(ai, system)
+        
+        # 返回最终响应
+        return final_response if not final_response.startswith("NULL") else ""
+    
+    # 如果只有CMD消息没有用户输入
+    return cmd_response if cmd_response else "NULL"
+
+def process_user_message(user_input: str, ai: AIWife, system: MorSystem,
+                         on_delta: Optional[Callable[[str, str], None]] = None,
+                         source: str = "user") -> str:
+    """
+    处理用户消息（同步接口），在共享事件循环上运行async_process_user_message并等待结果
+    传入on_delta时以流式方式请求AI，每段增量回调 on_delta(增量文本, 当前累计文本)
+    """
+    return get_event_loop_thread().run(async_process_user_message(user_input, ai, system, on_delta=on_delta,
+                                                                  source=source))
\ No newline at end of file
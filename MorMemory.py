@@ -0,0 +1,308 @@
+import time
+import queue
+import sqlite3
+import atexit
+import threading
+from typing import Optional, List, Dict, Callable, Iterable
+
+from AIContext import estimate_tokens
+
+# 记忆层级：缓存(短期) -> 摘要 -> 长期
+TIER_CACHE = 0
+TIER_SUMMARY = 1
+TIER_LONG = 2
+TIER_NAMES = {TIER_CACHE: "缓存记忆", TIER_SUMMARY: "摘要记忆", TIER_LONG: "长期记忆"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    tier INTEGER NOT NULL DEFAULT 0,
+    kind TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    important INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_memories_tier_created ON memories (tier, created);
+CREATE INDEX IF NOT EXISTS idx_memories_session_created ON memories (session, created);
+CREATE INDEX IF NOT EXISTS idx_memories_created ON memories (created);
+CREATE INDEX IF NOT EXISTS idx_memories_important ON memories (important) WHERE important = 1;
+"""
+
+_COLUMNS = ("id", "session", "tier", "kind", "content", "tokens", "important", "created")
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class MemoryStore:
+    """
+    分层记忆存储（SQLite，WAL模式）
+
+    写入只入队，由后台线程按批在一个事务中提交；读取按线程使用各自的连接，
+    WAL模式下读写互不阻塞。提交成功后通知监听者（检索索引、摘要任务等）
+    """
+
+    def __init__(self,
+                 path: str = "memory.db",
+                 batch_size: int = 128,
+                 flush_interval: float = 0.5,
+                 max_queue: int = 10000):
+        """
+        参数:
+            path: 数据库文件路径
+            batch_size: 每个事务最多提交的条数
+            flush_interval: 最长提交间隔(秒)
+            max_queue: 写入队列容量，写满后add不等待，直接丢弃并计数
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0  # 队列满时丢弃的条数
+        self.written = 0  # 已提交的条数
+
+        with _connect(path) as conn:
+            conn.executescript(_SCHEMA)
+        conn.close()
+
+        self._listeners: List[Callable[[List[Dict]], None]] = []
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="MemoryStore", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---- 写入 ----
+
+    def add(self, kind: str, content: str, session: str = "", tier: int = TIER_CACHE,
+            important: bool = False, created: Optional[float] = None) -> bool:
+        """
+        写入一条记忆（异步批量提交）
+
+        参数:
+            kind: 记忆来源，如user/ai/tool/reminder/summary
+            content: 记忆内容
+            session: 会话ID
+            tier: 记忆层级
+            important: 是否为重要记忆
+            created: 时间戳，默认当前时间
+
+        返回:
+            是否成功入队（从不阻塞调用线程，队列满时丢弃）
+        """
+        if self._closed or not content:
+            return False
+        row = {
+            "session": session,
+            "tier": tier,
+            "kind": kind,
+            "content": content,
+            "tokens": estimate_tokens(content),
+            "important": 1 if important else 0,
+            "created": created if created is not None else time.time(),
+        }
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前入队的记忆全部提交"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def replace(self, ids: Iterable[int], entries: List[Dict]) -> List[Dict]:
+        """
+        在一个事务中删除ids对应的记忆并写入entries（用于层级升级），全部成功或全部不生效
+
+        entries中每项至少包含kind/content/tier，可选session/important/created
+        返回写入的记忆（含id）
+        """
+        self.flush()
+        ids = list(ids)
+        now = time.time()
+        rows = [{
+            "session": entry.get("session", ""),
+            "tier": entry["tier"],
+            "kind": entry["kind"],
+            "content": entry["content"],
+            "tokens": estimate_tokens(entry["content"]),
+            "important": 1 if entry.get("important") else 0,
+            "created": entry.get("created", now),
+        } for entry in entries]
+        conn = self._reader()
+        with conn:
+            conn.executemany("DELETE FROM memories WHERE id = ?", [(i,) for i in ids])
+            self._insert_rows(conn, rows)
+        self._notify(rows, removed=ids)
+        return rows
+
+    def mark_important(self, memory_id: int, important: bool = True):
+        """标记或取消重要记忆"""
+        conn = self._reader()
+        with conn:
+            conn.execute("UPDATE memories SET important = ? WHERE id = ?", (1 if important else 0, memory_id))
+
+    def add_listener(self, callback: Callable[[List[Dict]], None]):
+        """注册提交回调 callback(新写入的记忆列表, removed=被删除的ID列表)"""
+        self._listeners.append(callback)
+
+    # ---- 读取 ----
+
+    def query(self,
+              tier: Optional[int] = None,
+              session: Optional[str] = None,
+              since: Optional[float] = None,
+              until: Optional[float] = None,
+              kind: Optional[str] = None,
+              important: Optional[bool] = None,
+              limit: Optional[int] = 100,
+              newest_first: bool = True) -> List[Dict]:
+        """
+        按层级/会话/时间范围查询记忆（均走索引）
+
+        参数:
+            tier: 记忆层级
+            session: 会话ID
+            since/until: 时间戳范围 [since, until)
+            kind: 记忆来源
+            important: 只查重要(True)或非重要(False)记忆
+            limit: 最多返回条数，None表示不限
+            newest_first: 是否按时间倒序
+        """
+        clauses, params = self._where(tier, session, since, until, kind, important)
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM memories{clauses} ORDER BY created {'DESC' if newest_first else 'ASC'}, id {'DESC' if newest_first else 'ASC'}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [dict(zip(_COLUMNS, row)) for row in self._reader().execute(sql, params)]
+
+    def stats(self, tier: Optional[int] = None, session: Optional[str] = None) -> Dict[str, int]:
+        """统计条数与token总数"""
+        clauses, params = self._where(tier, session, None, None, None, None)
+        count, tokens = self._reader().execute(
+            f"SELECT COUNT(*), COALESCE(SUM(tokens), 0) FROM memories{clauses}", params).fetchone()
+        return {"count": count, "tokens": tokens}
+
+    def session_stats(self, tier: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+        """按会话分组统计条数与token总数"""
+        clauses, params = self._where(tier, None, None, None, None, None)
+        rows = self._reader().execute(
+            f"SELECT session, COUNT(*), COALESCE(SUM(tokens), 0) FROM memories{clauses} GROUP BY session", params)
+        return {session: {"count": count, "tokens": tokens} for session, count, tokens in rows}
+
+    def get(self, ids: Iterable[int]) -> List[Dict]:
+        """按ID批量读取，按传入顺序返回（不存在的ID跳过）"""
+        ids = list(ids)
+        if not ids:
+            return []
+        rows = {}
+        conn = self._reader()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            sql = f"SELECT {', '.join(_COLUMNS)} FROM memories WHERE id IN ({', '.join('?' * len(chunk))})"
+            for row in conn.execute(sql, chunk):
+                rows[row[0]] = dict(zip(_COLUMNS, row))
+        return [rows[i] for i in ids if i in rows]
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """提交队列中的记忆并关闭所有连接"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+        with self._readers_lock:
+            for conn in self._readers:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._readers.clear()
+
+    @staticmethod
+    def _where(tier, session, since, until, kind, important):
+        clauses, params = [], []
+        for column, op, value in (("tier", "=", tier), ("session", "=", session),
+                                  ("created", ">=", since), ("created", "<", until),
+                                  ("kind", "=", kind)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        if important is not None:
+            clauses.append("important = ?")
+            params.append(1 if important else 0)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _reader(self) -> sqlite3.Connection:
+        """当前线程的连接（首次使用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _connect(self.path)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    # ---- 后台提交 ----
+
+    @staticmethod
+    def _insert_rows(conn: sqlite3.Connection, rows: List[Dict]):
+        for row in rows:
+            cursor = conn.execute(
+                "INSERT INTO memories (session, tier, kind, content, tokens, important, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row["session"], row["tier"], row["kind"], row["content"],
+                 row["tokens"], row["important"], row["created"]))
+            row["id"] = cursor.lastrowid
+
+    def _notify(self, rows: List[Dict], removed: Optional[List[int]] = None):
+        for callback in list(self._listeners):
+            try:
+                callback(rows, removed=removed or [])
+            except Exception:
+                pass
+
+    def _worker(self):
+        """后台线程：攒批并在单个事务中提交"""
+        conn = _connect(self.path)
+        stopping = False
+        while not stopping:
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+
+            if batch:
+                try:
+                    with conn:
+                        self._insert_rows(conn, batch)
+                    self.written += len(batch)
+                    self._notify(batch)
+                except Exception:
+                    self.dropped += len(batch)
+            for waiter in waiters:
+                waiter.set()
+        conn.close()
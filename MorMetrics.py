@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Deque, Callable
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("mor_turn_trace", default=None)
+
+def current_trace() -> Optional["TurnTrace"]:
+    """当前协程所在轮次的TurnTrace（不在轮次中时为None）"""
+    return _current_trace.get()
+
+class Histogram:
+    """
+    一个阶段的耗时分布：保留最近window个样本计算p50/p95/p99，
+    count/sum/max为全部样本的累计
+    """
+
+    __slots__ = ("samples", "count", "total", "max")
+
+    def __init__(self, window: int = 2048):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def summary(self) -> Dict:
+        ordered = sorted(self.samples)
+
+        def pick(q):
+            return round(ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))], 2) if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50": pick(50),
+            "p95": pick(95),
+            "p99": pick(99),
+            "max": round(self.max, 2),
+        }
+
+class TurnTrace:
+    """
+    一轮对话的结构化耗时记录
+
+    spans为(阶段名, 相对轮次开始的起点ms, 耗时ms, 附加信息)；
+    阶段名如queue_wait、memory_recall、llm、llm.build、llm.ttfb、llm.http、llm.parse、
+    parse_commands、command.Cmd、feedback等，同名阶段在汇总时进入同一个直方图
+    """
+
+    def __init__(self, turn_id: int, source: str, session: str = ""):
+        self.turn_id = turn_id
+        self.source = source
+        self.session = session
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans: List[tuple] = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.duration_ms = 0.0
+        self.profile: Optional[str] = None  # cProfile输出文件
+        self.token: Optional[contextvars.Token] = None
+
+    def add(self, name: str, duration_ms: float, start_ms: Optional[float] = None, **attrs):
+        if start_ms is None:
+            start_ms = (time.perf_counter() - self._start) * 1000 - duration_ms
+        self.spans.append((name, round(start_ms, 2), round(duration_ms, 2), attrs))
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """记录with块的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000, self.offset(started), **attrs)
+
+    def offset(self, perf_time: float) -> float:
+        """time.perf_counter()时刻相对轮次开始的毫秒数"""
+        return (perf_time - self._start) * 1000
+
+    def add_request(self, phase: str, started: float, elapsed_ms: float, timing: Optional[Dict],
+                    usage: Optional[Dict], **attrs):
+        """
+        记录一次AI请求（started为发起时的perf_counter）：总耗时与请求构造、TTFB、HTTP总耗时、首字、
+        解析（流式时为各段解析耗时之和）的分解，以及usage中的token数
+        """
+        start = self.offset(started)
+        self.add(phase, elapsed_ms, start, **attrs)
+        timing = timing or {}
+        build = timing.get("build_ms") or 0.0
+        for key, suffix, begin in (("build_ms", "build", start), ("ttfb_ms", "ttfb", start + build),
+                                   ("total_ms", "http", start + build), ("first_token_ms", "first_token", start + build),
+                                   ("parse_ms", "parse", None)):
+            if timing.get(key) is not None:
+                self.add(f"{phase}.{suffix}", timing[key], begin, **attrs)
+        if usage:
+            self.prompt_tokens += int(usage.get("prompt_tokens") or 0)
+            self.completion_tokens += int(usage.get("completion_tokens") or 0)
+
+    def to_dict(self) -> Dict:
+        return {
+            "turn": self.turn_id,
+            "source": self.source,
+            "session": self.session,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 2),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "spans": [{"name": name, "start_ms": start, "duration_ms": duration, **attrs}
+                      for name, start, duration, attrs in self.spans],
+            "profile": self.profile,
+        }
+
+class MetricsRegistry:
+    """
+    对话轮次指标：每个阶段一个耗时直方图，累计token，保留最近若干轮的完整记录
+
+    snapshot()返回JSON可序列化的快照（无界面模式的metrics请求、服务模式的/metrics）；
+    设置snapshot_path时轮次结束后在后台线程写入该文件，最多每snapshot_interval秒一次，
+    期间结束的轮次并入下一次写出。设置profile_dir时每轮用cProfile采样，
+    结果写入该目录（同一时刻只采样一轮，事件循环上并发的其它协程也会计入）
+    """
+
+    def __init__(self, window: int = 2048, keep_traces: int = 50,
+                 snapshot_path: Optional[str] = None, profile_dir: Optional[str] = None,
+                 snapshot_interval: float = 1.0, on_error: Optional[Callable[[Exception], None]] = None):
+        """
+        参数:
+            window: 每个阶段参与分位数计算的最近样本数
+            keep_traces: 保留完整记录的最近轮数
+            snapshot_path: 快照文件路径
+            profile_dir: cProfile采样输出目录
+            snapshot_interval: 两次写出快照的最短间隔(秒)
+            on_error: 写出快照或采样文件失败时的处理函数
+        """
+        self.window = window
+        self.snapshot_path = snapshot_path
+        self.profile_dir = profile_dir
+        self.snapshot_interval = snapshot_interval
+        self.on_error = on_error
+        self.phases: Dict[str, Histogram] = {}
+        self.turns = 0
+        self.turns_by_source: Dict[str, int] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.recent: Deque[Dict] = deque(maxlen=keep_traces)
+        self._ids = 0
+        self._lock = threading.Lock()
+        self._profiling = False
+        self._write_lock = threading.Lock()
+        self._write_timer: Optional[threading.Timer] = None
+        self._last_write = 0.0
+
+    def begin(self, source: str, session: str = "", queue_wait_ms: Optional[float] = None) -> TurnTrace:
+        """开始记录一轮，并设为当前协程的轮次"""
+        with self._lock:
+            self._ids += 1
+            trace = TurnTrace(self._ids, source, session)
+        if queue_wait_ms is not None:
+            trace.add("queue_wait", queue_wait_ms, -queue_wait_ms)
+        trace.token = _current_trace.set(trace)
+        return trace
+
+    def finish(self, trace: TurnTrace):
+        """结束一轮：各阶段计入直方图"""
+        trace.duration_ms = (time.perf_counter() - trace._start) * 1000
+        try:
+            _current_trace.reset(trace.token)
+        except ValueError:
+            pass  # 在其它上下文中结束
+        with self._lock:
+            self.turns += 1
+            self.turns_by_source[trace.source] = self.turns_by_source.get(trace.source, 0) + 1
+            self.prompt_tokens += trace.prompt_tokens
+            self.completion_tokens += trace.completion_tokens
+            self._histogram("turn").add(trace.duration_ms)
+            for name, _, duration, _ in trace.spans:
+                self._histogram(name).add(duration)
+            self.recent.append(trace.to_dict())
+        if self.snapshot_path:
+            self._schedule_write()
+
+    def _schedule_write(self):
+        """安排一次快照写出（不在调用线程做文件I/O）；已有待写出的快照时不重复安排"""
+        with self._lock:
+            if self._write_timer is not None:
+                return
+            delay = max(0.0, self._last_write + self.snapshot_interval - time.monotonic())
+            # 非守护线程：进程退出前最后一次快照仍会写出
+            self._write_timer = threading.Timer(delay, self._write_snapshot)
+            self._write_timer.start()
+
+    def _write_snapshot(self):
+        with self._lock:
+            self._write_timer = None
+            self._last_write = time.monotonic()
+        try:
+            with self._write_lock:
+                self.write(self.snapshot_path)
+        except OSError as e:
+            self._error(e)
+
+    def _error(self, error: Exception):
+        if self.on_error:
+            self.on_error(error)
+
+    def _histogram(self, name: str) -> Histogram:
+        histogram = self.phases.get(name)
+        if histogram is None:
+            histogram = self.phases[name] = Histogram(self.window)
+        return histogram
+
+    @contextmanager
+    def profile(self, trace: TurnTrace):
+        """profile_dir已设置且没有其它轮次在采样时，用cProfile采样这一轮"""
+        with self._lock:
+            enabled = bool(self.profile_dir) and not self._profiling
+            self._profiling = self._profiling or enabled
+        if not enabled:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profiling = False
+            try:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                path = os.path.join(self.profile_dir, f"turn-{trace.turn_id}-{trace.source}.prof")
+                pstats.Stats(profiler).dump_stats(path)
+                trace.profile = path
+            except OSError as e:
+                self._error(e)
+
+    def snapshot(self, recent: int = 10) -> Dict:
+        with self._lock:
+            return {
+                "time": time.time(),
+                "turns": self.turns,
+                "turns_by_source": dict(self.turns_by_source),
+                "tokens": {"prompt": self.prompt_tokens, "completion": self.completion_tokens},
+                "phases_ms": {name: histogram.summary() for name, histogram in sorted(self.phases.items())},
+                "recent": list(self.recent)[-recent:] if recent else [],
+            }
+
+    def write(self, path: str):
+        """原子地写出JSON快照"""
+        data = self.snapshot()
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(path + ".tmp", path)
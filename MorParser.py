@@ -0,0 +1,208 @@
+import re
+from typing import Optional, List, Dict, Tuple
+
+# 命令类型和对应的起始标记
+COMMAND_TAGS = {
+    "Rcte": "Rcte{",
+    "Time": "Time{",
+    "Cmd": "Cmd{",
+}
+_TAG_RE = re.compile("|".join(re.escape(tag) for tag in COMMAND_TAGS.values()))
+_TAG_TYPES = {tag: command_type for command_type, tag in COMMAND_TAGS.items()}
+_MAX_TAG = max(len(tag) for tag in COMMAND_TAGS.values())
+
+# 各类命令块内需要关注的字符：Rcte按Python词法处理字符串、转义与注释；
+# Cmd只识别双引号且不处理反斜杠（cmd.exe中单引号与反斜杠都是普通字符）；Time只数大括号
+_SPECIAL_RE = {
+    "Rcte": re.compile(r"[{}'\"#\\\n]"),
+    "Cmd": re.compile(r'[{}"\n]'),
+    "Time": re.compile(r"[{}]"),
+}
+_QUOTES = {
+    "Rcte": "'\"",
+    "Cmd": '"',
+    "Time": "",
+}
+
+class CommandParser:
+    """
+    单遍、增量的命令块解析器
+
+    按文本顺序识别 Rcte{...} / Time{...} / Cmd{...}，块内嵌套的大括号、字符串字面量
+    （含三引号与转义）和Python注释中的括号都不会提前结束命令块。
+    可以一次传入整条回复，也可以边接收流式增量边feed，每个命令块在右括号到达时立即返回。
+    每段扫描过的文本随即移入普通文本段或当前命令块的内容，缓冲区只保留尚不能判断的几个字符，
+    整条回复的解析开销与长度成正比，与分成多少段无关
+    """
+
+    def __init__(self):
+        self.blocks: List[Dict] = []  # 已闭合的命令块（按出现顺序）
+        self._chunks: List[str] = []  # 已接收的全部文本段
+        self._buf = ""  # 尚未扫描完的文本
+        self._offset = 0  # _buf[0]在完整文本中的位置
+        self._pos = 0  # 扫描位置（_buf内）
+        self._text_start = 0  # 当前普通文本段在_buf内的起点
+        self._segments: List[str] = []  # 命令块之外的文本段
+        # 当前未闭合命令块的状态
+        self._type: Optional[str] = None
+        self._start = 0  # 起始标记在完整文本中的位置
+        self._content: List[str] = []  # 已移出缓冲区的块内容
+        self._content_start = 0  # 块内容在_buf内的起点
+        self._depth = 0
+        self._quote = ""  # 当前字符串的引号（三引号时为三个字符），空表示不在字符串中
+        self._comment = False
+
+    @property
+    def text(self) -> str:
+        """已接收的完整文本"""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """追加一段文本，返回其间新闭合的命令块"""
+        self._chunks.append(chunk)
+        self._buf += chunk
+        closed = self._scan(final=False)
+        self._compact()
+        return closed
+
+    def finish(self) -> Tuple[str, List[Dict]]:
+        """
+        输入结束，返回(去掉命令块后的文本, 全部命令块)
+        未闭合的命令块按普通文本保留，不会被执行
+        """
+        self._scan(final=True)
+        if self._type is None:
+            tail = self._buf[self._text_start:]
+        else:
+            tail = COMMAND_TAGS[self._type] + "".join(self._content) + self._buf[self._content_start:]
+        return "".join(self._segments) + tail, self.blocks
+
+    @property
+    def in_block(self) -> bool:
+        """当前是否处于未闭合的命令块中"""
+        return self._type is not None
+
+    def _compact(self):
+        """把扫描位置之前的文本移出缓冲区"""
+        keep = self._pos
+        if keep <= 0:
+            return
+        if self._type is None:
+            self._segments.append(self._buf[self._text_start:keep])
+        else:
+            self._content.append(self._buf[self._content_start:keep])
+        self._buf = self._buf[keep:]
+        self._offset += keep
+        self._pos = self._text_start = self._content_start = 0
+
+    def _scan(self, final: bool) -> List[Dict]:
+        closed = []
+        text = self._buf
+        while True:
+            if self._type is None:
+                match = _TAG_RE.search(text, self._pos)
+                if match is None:
+                    # 末尾可能是被切断的起始标记，留到下次再看
+                    self._pos = max(self._pos, len(text) - _MAX_TAG + 1)
+                    return closed
+                self._segments.append(text[self._text_start:match.start()])
+                self._type = _TAG_TYPES[match.group()]
+                self._start = self._offset + match.start()
+                self._pos = self._content_start = match.end()
+                self._content = []
+                self._depth = 1
+                self._quote = ""
+                self._comment = False
+                continue
+
+            block = self._scan_block(text, final)
+            if block is None:
+                return closed
+            self._text_start = self._pos
+            self.blocks.append(block)
+            closed.append(block)
+            self._type = None
+
+    def _scan_block(self, text: str, final: bool) -> Optional[Dict]:
+        """在命令块内扫描，闭合时返回命令块，否则记录扫描位置并返回None"""
+        special = _SPECIAL_RE[self._type]
+        quotes = _QUOTES[self._type]
+        pos = self._pos
+        end = len(text)
+        while True:
+            if self._comment:
+                newline = text.find("\n", pos)
+                if newline == -1:
+                    self._pos = end
+                    return None
+                self._comment = False
+                pos = newline + 1
+                continue
+
+            match = special.search(text, pos)
+            if match is None:
+                self._pos = end
+                return None
+            i = match.start()
+            char = text[i]
+
+            if self._quote:
+                if char == "\\":
+                    if i + 1 >= end and not final:
+                        self._pos = i  # 转义符在末尾，等下一段
+                        return None
+                    pos = i + 2
+                elif char == "\n" and len(self._quote) == 1:
+                    self._quote = ""  # 单引号字符串不跨行，容错处理未闭合的引号
+                    pos = i + 1
+                elif text.startswith(self._quote, i):
+                    pos = i + len(self._quote)
+                    self._quote = ""
+                elif char == self._quote[0] and len(self._quote) == 3 and end - i < 3 and not final:
+                    self._pos = i  # 可能是被切断的三引号
+                    return None
+                else:
+                    pos = i + 1
+                continue
+
+            if char in quotes:
+                if self._type == "Rcte":
+                    if end - i < 3 and not final:
+                        self._pos = i  # 还不能判断是否为三引号
+                        return None
+                    if text.startswith(char * 3, i):
+                        self._quote = char * 3
+                        pos = i + 3
+                        continue
+                self._quote = char
+                pos = i + 1
+            elif char == "#":
+                self._comment = True
+                pos = i + 1
+            elif char == "{":
+                self._depth += 1
+                pos = i + 1
+            elif char == "}":
+                self._depth -= 1
+                pos = i + 1
+                if self._depth == 0:
+                    self._pos = pos
+                    return {
+                        "type": self._type,
+                        "content": ("".join(self._content) + text[self._content_start:i]).strip(),
+                        "start": self._start,
+                        "end": self._offset + pos,  # 包含结束大括号
+                    }
+            else:
+                pos = i + 1
+
+def extract_command_blocks(message: str) -> Tuple[str, List[Dict]]:
+    """
+    从消息中提取命令块并清理消息
+    返回: (清理后的消息, 按出现顺序排列的命令块列表)
+    """
+    parser = CommandParser()
+    parser.feed(message)
+    return parser.finish()
@@ -0,0 +1,371 @@
+import os
+import re
+import zlib
+import sqlite3
+import threading
+from array import array
+from datetime import datetime
+from typing import Optional, List, Dict, Iterable, Set
+
+try:
+    import numpy as np
+except ImportError:  # 未安装numpy时只使用全文检索
+    np = None
+
+from AIContext import estimate_tokens
+from MorMemory import MemoryStore, TIER_NAMES
+
+VECTOR_AVAILABLE = np is not None
+
+_CJK_RUN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+_WORD_RE = re.compile(r'[a-z0-9_]{2,}')
+
+def tokenize(text: str) -> List[str]:
+    """切分为检索用的词项：英文/数字按词，CJK按单字和相邻两字"""
+    text = text.lower()
+    tokens = _WORD_RE.findall(text)
+    for run in _CJK_RUN_RE.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+class HashingEmbedder:
+    """
+    本地哈希TF-IDF向量化器，无需网络和GPU
+
+    词项经crc32哈希到buckets个特征上，得到稀疏向量（特征下标, 权重）；文档频率按特征增量统计，
+    写入的向量使用写入时的IDF，并做L2归一化
+    """
+
+    def __init__(self, buckets: int = 1 << 20):
+        self.buckets = buckets
+        self.doc_count = 0
+        self.df = np.zeros(buckets, dtype=np.int32)
+
+    def embed(self, text: str, update_df: bool = False) -> tuple:
+        """
+        文本转为归一化的稀疏向量
+
+        参数:
+            update_df: 为True时计入文档频率（写入索引时使用）
+
+        返回:
+            (特征下标int32数组, 权重float32数组)
+        """
+        counts: Dict[int, int] = {}
+        for token in tokenize(text):
+            feature = zlib.crc32(token.encode("utf-8")) % self.buckets
+            counts[feature] = counts.get(feature, 0) + 1
+        features = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        if not counts:
+            return features, tf
+        if update_df:
+            self.doc_count += 1
+            self.df[features] += 1
+        idf = np.log((1.0 + self.doc_count) / (1.0 + self.df[features])) + 1.0
+        weights = ((1.0 + np.log(tf)) * idf).astype(np.float32)
+        weights /= np.linalg.norm(weights)
+        return features, weights
+
+class SparseVectorIndex:
+    """
+    按特征组织的倒排向量矩阵（稀疏矩阵的列存储），按余弦相似度取top-k
+
+    每个特征一条只追加的(行号, 权重)列表，增量写入为O(非零特征数)；
+    查询只访问查询向量的非零特征所在的列，并跳过出现在大量文档中的高频特征，
+    百万级条目下仍是毫秒级。删除只做标记
+    """
+
+    MAX_POSTINGS = 200000  # 单次查询最多累加的倒排项数
+
+    def __init__(self):
+        self.rows: Dict[int, array] = {}  # 特征 -> 行号列表
+        self.weights: Dict[int, array] = {}  # 特征 -> 权重列表
+        self.ids = array("q")  # 行号 -> 记忆ID
+        self.alive = bytearray()  # 行号 -> 是否有效
+        self.removed = 0
+        self._row_of: Dict[int, int] = {}  # 记忆ID -> 行号
+
+    def __len__(self) -> int:
+        return len(self.ids) - self.removed
+
+    def __contains__(self, memory_id: int) -> bool:
+        return memory_id in self._row_of
+
+    def add(self, memory_id: int, features: "np.ndarray", weights: "np.ndarray"):
+        row = len(self.ids)
+        self.ids.append(memory_id)
+        self.alive.append(1)
+        self._row_of[memory_id] = row
+        for feature, weight in zip(features.tolist(), weights.tolist()):
+            rows = self.rows.get(feature)
+            if rows is None:
+                rows = self.rows[feature] = array("i")
+                self.weights[feature] = array("f")
+            rows.append(row)
+            self.weights[feature].append(weight)
+
+    def remove(self, memory_id: int):
+        row = self._row_of.pop(memory_id, None)
+        if row is not None:
+            self.alive[row] = 0
+            self.removed += 1
+
+    def search(self, features: "np.ndarray", weights: "np.ndarray", k: int) -> List[tuple]:
+        """返回[(记忆ID, 相似度)]，按相似度降序"""
+        present = [(len(self.rows[f]), f, w) for f, w in zip(features.tolist(), weights.tolist()) if f in self.rows]
+        if not present or k <= 0:
+            return []
+        # 先累加低频（区分度高）的特征，高频特征超出预算后跳过
+        present.sort()
+        row_parts, score_parts, total = [], [], 0
+        for length, feature, weight in present:
+            if row_parts and total + length > self.MAX_POSTINGS:
+                break
+            row_parts.append(np.array(self.rows[feature], dtype=np.int32))
+            score_parts.append(np.array(self.weights[feature], dtype=np.float32) * weight)
+            total += length
+        rows = np.concatenate(row_parts)
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+        if self.removed:
+            alive = np.frombuffer(bytes(self.alive), dtype=np.uint8)[unique_rows].astype(bool)
+            unique_rows, scores = unique_rows[alive], scores[alive]
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[int(unique_rows[i])], float(scores[i])) for i in top if scores[i] > 0]
+
+    def save(self, path: str, embedder: HashingEmbedder):
+        """把倒排列表拼接为连续数组保存"""
+        features = sorted(self.rows)
+        lengths = np.array([len(self.rows[f]) for f in features], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        rows = np.concatenate([np.array(self.rows[f], dtype=np.int32) for f in features]) if features else np.zeros(0, np.int32)
+        weights = np.concatenate([np.array(self.weights[f], dtype=np.float32) for f in features]) if features else np.zeros(0, np.float32)
+        np.savez(path, features=np.array(features, dtype=np.int32), offsets=offsets, rows=rows, weights=weights,
+                 ids=np.array(self.ids, dtype=np.int64), alive=np.frombuffer(bytes(self.alive), dtype=np.uint8),
+                 df=embedder.df, doc_count=np.array([embedder.doc_count]))
+
+    def load(self, path: str, embedder: HashingEmbedder) -> bool:
+        try:
+            data = np.load(path)
+            if len(data["df"]) != embedder.buckets:
+                return False
+            offsets, rows, weights = data["offsets"], data["rows"], data["weights"]
+            self.rows, self.weights = {}, {}
+            for i, feature in enumerate(data["features"].tolist()):
+                self.rows[feature] = array("i", rows[offsets[i]:offsets[i + 1]].tobytes())
+                self.weights[feature] = array("f", weights[offsets[i]:offsets[i + 1]].tobytes())
+            self.ids = array("q", data["ids"].astype(np.int64).tobytes())
+            self.alive = bytearray(data["alive"].tobytes())
+            self.removed = self.alive.count(0)
+            self._row_of = {memory_id: row for row, memory_id in enumerate(self.ids) if self.alive[row]}
+            embedder.df = data["df"].astype(np.int32)
+            embedder.doc_count = int(data["doc_count"][0])
+            return True
+        except Exception:
+            return False
+
+class MemoryRetriever:
+    """
+    记忆检索：FTS5全文索引 + 本地稀疏向量索引，两路结果按倒数排名融合
+
+    全文索引由触发器在写入同一事务中维护；向量索引在MemoryStore提交后通过监听回调增量更新，
+    启动时从快照加载并补齐快照之后的记忆。未安装numpy时只使用全文检索
+    """
+
+    RRF_K = 60  # 倒数排名融合的平滑常数
+    MIN_SIMILARITY = 0.05  # 低于该余弦相似度的向量结果视为不相关
+    MAX_EXCLUDE_FETCH = 20  # 为exclude多取的候选数上限，检索开销不随上下文长度增长
+
+    def __init__(self, store: MemoryStore, index_path: Optional[str] = None, buckets: int = 1 << 20):
+        """
+        参数:
+            store: 记忆库
+            index_path: 向量索引快照路径，默认与数据库同目录
+            buckets: 哈希特征数
+        """
+        self.store = store
+        self.index_path = index_path or os.path.splitext(store.path)[0] + ".index.npz"
+        self.fts_available = self._init_fts()
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        if VECTOR_AVAILABLE:
+            self.embedder = HashingEmbedder(buckets=buckets)
+            self.index = SparseVectorIndex()
+            self._pending: List[tuple] = []  # 索引建好之前收到的变更
+            store.add_listener(self._on_commit)
+            threading.Thread(target=self._build, name="MemoryIndexBuild", daemon=True).start()
+        else:
+            self.embedder = self.index = None
+            self.ready.set()
+
+    def _init_fts(self) -> bool:
+        """创建外部内容FTS5表与同步触发器；SQLite不支持FTS5时返回False"""
+        conn = self.store._reader()
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'memories_fts'").fetchone() is not None
+            with conn:
+                if not exists:
+                    try:
+                        conn.execute("CREATE VIRTUAL TABLE memories_fts USING fts5("
+                                     "content, content='memories', content_rowid='id', tokenize='trigram')")
+                    except sqlite3.OperationalError:
+                        # SQLite 3.34之前没有trigram分词器
+                        conn.execute("CREATE VIRTUAL TABLE memories_fts USING fts5("
+                                     "content, content='memories', content_rowid='id')")
+                conn.executescript("""
+                    CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+                        INSERT INTO memories_fts (rowid, content) VALUES (new.id, new.content);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+                        INSERT INTO memories_fts (memories_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                    END;
+                """)
+                if not exists:
+                    conn.execute("INSERT INTO memories_fts (memories_fts) VALUES ('rebuild')")
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    # ---- 向量索引维护 ----
+
+    def _on_commit(self, rows: List[Dict], removed: Optional[List[int]] = None):
+        with self.lock:
+            if not self.ready.is_set():
+                self._pending.append((rows, removed or []))
+                return
+            self._apply(rows, removed or [])
+
+    def _apply(self, rows: List[Dict], removed: List[int]):
+        for memory_id in removed:
+            self.index.remove(memory_id)
+        for row in rows:
+            if row["id"] not in self.index:
+                self.index.add(row["id"], *self.embedder.embed(row["content"], update_df=True))
+
+    def _build(self):
+        """加载快照并补齐：删除库中已不存在的记忆，加入快照之后写入的记忆"""
+        conn = sqlite3.connect(self.store.path)
+        try:
+            loaded = os.path.exists(self.index_path) and self.index.load(self.index_path, self.embedder)
+            last_id = max(self.index.ids) if loaded and len(self.index.ids) else 0
+            if loaded:
+                live = {row[0] for row in conn.execute("SELECT id FROM memories WHERE id <= ?", (last_id,))}
+                for memory_id in [i for i in self.index._row_of if i not in live]:
+                    self.index.remove(memory_id)
+            for memory_id, content in conn.execute(
+                    "SELECT id, content FROM memories WHERE id > ? ORDER BY id", (last_id,)):
+                self.index.add(memory_id, *self.embedder.embed(content, update_df=True))
+        finally:
+            conn.close()
+        with self.lock:
+            for rows, removed in self._pending:
+                self._apply(rows, removed)
+            self._pending.clear()
+            self.ready.set()
+
+    def save(self):
+        """保存向量索引快照，下次启动时免去全量重建"""
+        if self.index is None or not self.ready.is_set():
+            return
+        with self.lock:
+            self.index.save(self.index_path, self.embedder)
+
+    # ---- 检索 ----
+
+    @staticmethod
+    def _fts_query(text: str) -> str:
+        """把查询文本转成FTS5的OR查询（trigram分词需要至少3个字符的词项）"""
+        terms = []
+        lowered = text.lower()
+        terms.extend(word for word in re.findall(r'[a-z0-9_]{3,}', lowered))
+        for run in _CJK_RUN_RE.findall(lowered):
+            if len(run) < 3:
+                continue
+            terms.extend(run[i:i + 3] for i in range(len(run) - 2))
+        unique = list(dict.fromkeys(terms))[:32]
+        return " OR ".join('"' + term.replace('"', '""') + '"' for term in unique)
+
+    def search_fts(self, text: str, k: int, session: Optional[str] = None) -> List[int]:
+        if not self.fts_available:
+            return []
+        query = self._fts_query(text)
+        if not query:
+            return []
+        try:
+            if session is None:
+                rows = self.store._reader().execute(
+                    "SELECT rowid FROM memories_fts WHERE memories_fts MATCH ? ORDER BY rank LIMIT ?", (query, k))
+            else:
+                rows = self.store._reader().execute(
+                    "SELECT memories_fts.rowid FROM memories_fts JOIN memories ON memories.id = memories_fts.rowid "
+                    "WHERE memories_fts MATCH ? AND memories.session = ? ORDER BY rank LIMIT ?", (query, session, k))
+            return [row[0] for row in rows]
+        except sqlite3.OperationalError:
+            return []
+
+    def search_vector(self, text: str, k: int) -> List[int]:
+        if self.index is None or not self.ready.is_set():
+            return []
+        with self.lock:
+            features, weights = self.embedder.embed(text)
+            return [memory_id for memory_id, score in self.index.search(features, weights, k)
+                    if score >= self.MIN_SIMILARITY]
+
+    def search(self, text: str, k: int = 5, exclude: Optional[Set[str]] = None,
+               session: Optional[str] = None) -> List[Dict]:
+        """
+        混合检索，返回按相关度排序的记忆
+
+        参数:
+            text: 查询文本
+            k: 返回条数
+            exclude: 需要排除的记忆内容（如已在上下文中的消息）
+            session: 只返回该会话的记忆（向量索引不区分会话，多取一些候选再过滤）
+        """
+        candidates = k * 4 + min(len(exclude or ()), self.MAX_EXCLUDE_FETCH)
+        vector_candidates = candidates if session is None else candidates * 4
+        scores: Dict[int, float] = {}
+        for ranking in (self.search_fts(text, candidates, session), self.search_vector(text, vector_candidates)):
+            for rank, memory_id in enumerate(ranking):
+                scores[memory_id] = scores.get(memory_id, 0.0) + 1.0 / (self.RRF_K + rank + 1)
+        ordered = sorted(scores, key=scores.get, reverse=True)
+        results = []
+        for memory in self.store.get(ordered):
+            if exclude and memory["content"] in exclude:
+                continue
+            if session is not None and memory["session"] != session:
+                continue
+            results.append(memory)
+            if len(results) >= k:
+                break
+        return results
+
+    def build_context(self, text: str, k: int = 5, token_budget: int = 800,
+                      exclude: Optional[Iterable[str]] = None, session: Optional[str] = None) -> str:
+        """
+        检索与text相关的记忆并格式化为可注入提示词的文本，总长度不超过token_budget（session见search）
+
+        返回:
+            记忆文本，没有相关记忆时返回空字符串
+        """
+        memories = self.search(text, k, exclude=set(exclude or ()), session=session)
+        lines = []
+        used = estimate_tokens("[相关记忆]")
+        for memory in memories:
+            stamp = datetime.fromtimestamp(memory["created"]).strftime("%Y-%m-%d %H:%M")
+            line = f"- ({stamp} {TIER_NAMES.get(memory['tier'], memory['tier'])}/{memory['kind']}) {memory['content']}"
+            tokens = estimate_tokens(line)
+            if used + tokens > token_budget:
+                continue
+            lines.append(line)
+            used += tokens
+        if not lines:
+            return ""
+        return "[相关记忆]\n" + "\n".join(lines)
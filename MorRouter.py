@@ -0,0 +1,106 @@
+from typing import Optional, Dict
+
+from AIContext import estimate_tokens
+from MorParser import extract_command_blocks
+
+MAIN_ROUTE = "main"
+# 轮次来源：用户输入、其它系统事件、提醒（生物钟等定时消息）、命令执行结果反馈
+SOURCES = ("user", "system", "timer", "tool")
+
+class Route:
+    """
+    一条模型路由：模型与可选的独立端点，未配置的项沿用AIWife自身的设置
+    同时记录经由该路由的请求数、耗时与token用量（在事件循环线程中更新）
+    """
+
+    def __init__(self, name: str, model: str = "", api_url: str = "", api_key: str = ""):
+        self.name = name
+        self.model = model
+        self.api_url = api_url
+        self.api_key = api_key
+        self.requests = 0
+        self.errors = 0
+        self.escalations = 0       # 回复含命令块、转交主模型的次数
+        self.total_ms = 0.0
+        self.first_token_ms = 0.0  # 流式请求的首字耗时累计
+        self.streamed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated_tokens = 0  # 服务端未返回usage时按回复文本估算的token数
+
+    def record(self, elapsed_ms: float, response: str, timing: Optional[Dict], usage: Optional[Dict]):
+        self.requests += 1
+        self.total_ms += elapsed_ms
+        if response.startswith("API请求失败") or response.startswith("错误："):
+            self.errors += 1
+            return
+        if timing and timing.get("first_token_ms") is not None:
+            self.first_token_ms += timing["first_token_ms"]
+            self.streamed += 1
+        if usage:
+            self.prompt_tokens += int(usage.get("prompt_tokens") or 0)
+            self.completion_tokens += int(usage.get("completion_tokens") or 0)
+        else:
+            self.estimated_tokens += estimate_tokens(response)
+
+    def stats(self) -> Dict:
+        return {
+            "model": self.model or "(default)",
+            "requests": self.requests,
+            "errors": self.errors,
+            "escalations": self.escalations,
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+            "avg_first_token_ms": round(self.first_token_ms / self.streamed, 1) if self.streamed else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_tokens": self.estimated_tokens,
+        }
+
+class ModelRouter:
+    """
+    按轮次来源选择模型
+
+    提醒、系统事件与命令结果反馈这类回复多为"NULL"的轮次交给小而快的模型，用户对话交给主模型；
+    快速模型的回复中出现命令块时撤回这次回复，改由主模型重新回答（命令只由主模型发出）
+    """
+
+    def __init__(self, routes: Optional[Dict[str, Route]] = None, rules: Optional[Dict[str, str]] = None,
+                 escalate: bool = True):
+        """
+        参数:
+            routes: 路由名 -> Route，缺少main时自动补上（使用AIWife自身的模型与端点）
+            rules: 轮次来源 -> 路由名，未列出的来源使用main
+            escalate: 快速模型的回复含命令块时是否转交主模型
+        """
+        self.routes: Dict[str, Route] = dict(routes or {})
+        self.routes.setdefault(MAIN_ROUTE, Route(MAIN_ROUTE))
+        self.rules = {source: name for source, name in (rules or {}).items() if name in self.routes}
+        self.escalate = escalate
+
+    @property
+    def main(self) -> Route:
+        return self.routes[MAIN_ROUTE]
+
+    def route_for(self, source: str) -> Route:
+        return self.routes[self.rules.get(source, MAIN_ROUTE)]
+
+    def should_escalate(self, route: Route, response: str) -> bool:
+        """快速路由的回复是否需要转交主模型"""
+        if not self.escalate or route is self.main or not response:
+            return False
+        return bool(extract_command_blocks(response)[1])
+
+    @staticmethod
+    def rollback(ai, message: str) -> bool:
+        """从历史中撤回最近一问一答，成功返回True"""
+        if (len(ai.messages) >= 2 and ai.messages[-1]["role"] == "assistant"
+                and ai.messages[-2]["role"] == "user" and ai.messages[-2]["content"] == message):
+            del ai.messages[-2:]
+            return True
+        return False
+
+    def stats(self) -> Dict:
+        return {
+            "rules": {source: self.rules.get(source, MAIN_ROUTE) for source in SOURCES},
+            "routes": {name: route.stats() for name, route in self.routes.items()},
+        }
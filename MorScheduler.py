@@ -0,0 +1,183 @@
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Callable
+
+class Reminder:
+    """单个提醒，remaining为-1表示无限次；owner标识所属会话（多个会话共用一个调度器时）"""
+
+    __slots__ = ("id", "content", "interval", "remaining", "due", "cancelled", "owner")
+
+    def __init__(self, reminder_id: int, content: str, interval: float, remaining: int, due: float,
+                 owner: Optional[str] = None):
+        self.id = reminder_id
+        self.owner = owner
+        self.content = content
+        self.interval = interval
+        self.remaining = remaining
+        self.due = due  # time.monotonic()时间轴上的触发时间
+        self.cancelled = False
+
+    def to_dict(self) -> Dict:
+        """导出为字典，due_at换算为本地时间"""
+        due_at = datetime.now() + timedelta(seconds=self.due - time.monotonic())
+        return {
+            "id": self.id,
+            "content": self.content,
+            "interval": self.interval,
+            "remaining": self.remaining,
+            "due_at": due_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+class ReminderScheduler:
+    """
+    基于最小堆的提醒调度器
+
+    工作线程只睡到最近一个提醒的触发时间（或有更早的提醒加入时被唤醒），空闲时不占CPU；
+    添加为O(log n)，取消只做标记并在堆中已取消项过半时整体重建
+    """
+
+    MIN_INTERVAL = 0.5  # 重复提醒的最小间隔(秒)，防止间隔为0时空转
+
+    def __init__(self, on_fire: Callable[[Reminder], None],
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        """
+        参数:
+            on_fire: 提醒触发时在调度线程中回调
+            on_error: 回调出错时的处理函数
+        """
+        self.on_fire = on_fire
+        self.on_error = on_error
+        self._heap: List[tuple] = []  # (触发时间, 序号, 提醒)
+        self._reminders: Dict[int, Reminder] = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._cancelled_in_heap = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """启动调度线程"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._worker, name="ReminderScheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止调度线程"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def add(self, content: str, delay_seconds: float, times: int = 1, owner: Optional[str] = None) -> int:
+        """
+        添加提醒
+
+        参数:
+            content: 提醒内容
+            delay_seconds: 首次触发前的秒数，同时也是重复间隔
+            times: 触发次数，0或-1表示无限次
+            owner: 所属会话，触发时随提醒一并交给on_fire
+
+        返回:
+            提醒ID
+        """
+        remaining = -1 if times in (0, -1) else times
+        with self._cond:
+            reminder = Reminder(next(self._ids), content, delay_seconds, remaining,
+                                time.monotonic() + delay_seconds, owner)
+            self._reminders[reminder.id] = reminder
+            self._push(reminder)
+            return reminder.id
+
+    def _push(self, reminder: Reminder):
+        """入堆；成为最早的提醒时唤醒调度线程（调用方持有锁）"""
+        heapq.heappush(self._heap, (reminder.due, next(self._seq), reminder))
+        if self._heap[0][2] is reminder:
+            self._cond.notify()
+
+    def cancel(self, reminder_id: int, owner: Optional[str] = None) -> bool:
+        """按ID取消提醒，返回是否存在该提醒；给出owner时只取消属于它的提醒"""
+        with self._cond:
+            reminder = self._reminders.get(reminder_id)
+            if reminder is None or (owner is not None and reminder.owner != owner):
+                return False
+            self._cancel(reminder)
+            return True
+
+    def cancel_owner(self, owner: str) -> int:
+        """取消属于owner的全部提醒，返回取消的个数"""
+        with self._cond:
+            reminders = [r for r in self._reminders.values() if r.owner == owner]
+            for reminder in reminders:
+                self._cancel(reminder)
+            return len(reminders)
+
+    def _cancel(self, reminder: Reminder):
+        """标记取消；堆中已取消项过半时整体重建（调用方持有锁）"""
+        self._reminders.pop(reminder.id, None)
+        reminder.cancelled = True
+        self._cancelled_in_heap += 1
+        if self._cancelled_in_heap > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_in_heap = 0
+
+    def list(self, owner: Optional[str] = None) -> List[Dict]:
+        """按触发时间列出所有未取消的提醒；给出owner时只列出属于它的提醒"""
+        with self._cond:
+            reminders = sorted((r for r in self._reminders.values() if owner is None or r.owner == owner),
+                               key=lambda r: r.due)
+            return [reminder.to_dict() for reminder in reminders]
+
+    def __len__(self) -> int:
+        return len(self._reminders)
+
+    def _pop_due(self) -> Optional[Reminder]:
+        """等待并取出下一个到期的提醒；停止时返回None"""
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, reminder = self._heap[0]
+                if reminder.cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled_in_heap -= 1
+                    continue
+                timeout = due - time.monotonic()
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+                heapq.heappop(self._heap)
+                # 重复提醒按原节奏排下一次，错过的周期不补发
+                if reminder.remaining == -1 or reminder.remaining > 1:
+                    if reminder.remaining > 1:
+                        reminder.remaining -= 1
+                    now = time.monotonic()
+                    interval = max(reminder.interval, self.MIN_INTERVAL)
+                    reminder.due = due + interval
+                    if reminder.due <= now:
+                        reminder.due = now + interval
+                    self._push(reminder)
+                else:
+                    self._reminders.pop(reminder.id, None)
+                return reminder
+            return None
+
+    def _worker(self):
+        """调度线程主体，回调在锁外执行"""
+        while True:
+            reminder = self._pop_due()
+            if reminder is None:
+                return
+            try:
+                self.on_fire(reminder)
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(e)
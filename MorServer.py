@@ -0,0 +1,415 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, List, Callable, Tuple
+
+from AIchat import AIWife
+from AILoop import get_event_loop_thread
+from MorMain import MorSystem
+from MorLog import AsyncLogWriter
+from MorScheduler import ReminderScheduler, Reminder
+from MorSnapshot import SessionSnapshot
+from MorDaemon import HeadlessDaemon, DaemonClient
+
+# HTTP/WebSocket服务依赖aiohttp（可选）
+try:
+    from aiohttp import web, WSMsgType
+    SERVER_AVAILABLE = True
+except ImportError:
+    SERVER_AVAILABLE = False
+
+_SESSION_ID_RE = re.compile(r'^[0-9A-Za-z_-]{1,64}$')
+
+class SessionManager:
+    """
+    在一个进程中托管多个相互隔离的会话（每个会话一个AIWife + MorSystem + HeadlessDaemon）
+
+    连接池、Rcte工作进程池、记忆库与日志由factory创建的会话共用；提醒由一个共用调度器按会话分发，
+    CMD控制台按需启动并受ShellPool数量上限约束。空闲超过idle_timeout或内存中会话数超过max_active时，
+    最久未使用的会话被换出到state_dir（对话历史与工作目录），再次访问或其提醒触发时自动载入。
+    所有方法都在共享事件循环中调用
+    """
+
+    REMINDER_FILE = "reminders.json"
+
+    def __init__(self,
+                 factory: Callable[[str, ReminderScheduler], Tuple[AIWife, MorSystem]],
+                 state_dir: str = "sessions",
+                 max_active: int = 64,
+                 idle_timeout: float = 600.0,
+                 max_turns: int = 16,
+                 sweep_interval: float = 30.0,
+                 on_close: Optional[Callable[[], None]] = None,
+                 log_writer: Optional[AsyncLogWriter] = None):
+        """
+        参数:
+            factory: factory(会话ID, 共用提醒调度器) -> (ai, system)，创建一个使用共用资源的会话
+            state_dir: 换出会话的保存目录
+            max_active: 同时留在内存中的会话上限
+            idle_timeout: 空闲多少秒后换出
+            max_turns: 所有会话同时进行的对话轮次上限
+            sweep_interval: 检查空闲会话的间隔(秒)
+            on_close: 关闭时调用，用于关闭共用资源
+            log_writer: 各会话共用的日志写入器，提醒分发、换出与保存会话出错时写入其中
+        """
+        self.factory = factory
+        self.state_dir = state_dir
+        self.max_active = max(1, max_active)
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.on_close = on_close
+        self.loop = get_event_loop_thread()
+        self.sessions: "OrderedDict[str, HeadlessDaemon]" = OrderedDict()  # 按最近使用排序
+        self.turn_slots = asyncio.Semaphore(max(1, max_turns))
+        self.snapshot = SessionSnapshot()  # 新会话共用的初始化快照
+        self.evicted = 0
+        self.rehydrated = 0
+        self.router = None  # 各会话共用的模型路由（由创建方设置），其计数随/stats返回
+        self.metrics = None  # 各会话共用的轮次指标（由创建方设置），由/metrics返回
+        self.cassette = None  # 各会话共用的请求录制（由创建方设置），其计数随/stats返回
+        self.log_writer = log_writer  # 丢弃与写入失败的行数随/stats返回
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        os.makedirs(state_dir, exist_ok=True)
+        self.reminders = ReminderScheduler(self._on_reminder, on_error=lambda e: self._log_error(f"提醒分发错误: {str(e)}"))
+        self.reminders.start()
+        self._load_reminders()
+
+    def _log_error(self, content: str):
+        """写入共用日志（格式同MorSystem._log_entry，未设置日志写入器时忽略）"""
+        if self.log_writer is not None:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.log_writer.write(f"[{timestamp}] [ERROR] [SERVER] {content}\n")
+
+    # ---- 会话 ----
+
+    def _state_path(self, session_id: str) -> str:
+        return os.path.join(self.state_dir, session_id + ".json")
+
+    def stored_sessions(self) -> List[str]:
+        """已换出到磁盘、当前不在内存中的会话ID"""
+        return [name[:-5] for name in os.listdir(self.state_dir)
+                if name.endswith(".json") and name != self.REMINDER_FILE and name[:-5] not in self.sessions]
+
+    async def get(self, session_id: str, create: bool = False) -> Optional[HeadlessDaemon]:
+        """
+        取得会话：在内存中直接返回，已换出的从磁盘载入，create为True时创建新会话
+
+        返回:
+            会话，不存在且不创建时返回None
+        """
+        if not _SESSION_ID_RE.match(session_id):
+            raise ValueError(f"无效的会话ID: {session_id}")
+        daemon = self.sessions.get(session_id)
+        if daemon is not None:
+            self.sessions.move_to_end(session_id)
+            return daemon
+        loading = self._loading.get(session_id)
+        if loading is not None:  # 同一会话的并发请求等待同一次载入
+            return await asyncio.shield(loading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[session_id] = future
+        try:
+            daemon = await self._load(session_id, create)
+            if daemon is not None:
+                self.sessions[session_id] = daemon
+                daemon.start()
+            future.set_result(daemon)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._loading[session_id]
+        await self._enforce_capacity()
+        return daemon
+
+    async def _load(self, session_id: str, create: bool) -> Optional[HeadlessDaemon]:
+        store = SessionSnapshot(self._state_path(session_id))
+        data = await asyncio.to_thread(store.load, session_id)
+        if data is None and not create:
+            return None
+        ai, system = await asyncio.to_thread(self.factory, session_id, self.reminders)
+        if data is None:
+            daemon = HeadlessDaemon(ai, system, snapshot=self.snapshot, turn_slots=self.turn_slots)
+        else:
+            await asyncio.to_thread(SessionSnapshot.restore, data, ai, system)
+            self.rehydrated += 1
+            daemon = HeadlessDaemon(ai, system, initialize=False, turn_slots=self.turn_slots)
+        daemon.allow_shutdown = False
+        return daemon
+
+    async def evict(self, session_id: str) -> bool:
+        """把会话换出到磁盘并释放它独占的资源（提醒留在共用调度器中）"""
+        daemon = self.sessions.get(session_id)
+        if daemon is None or daemon.busy or not daemon.ready:
+            return False
+        del self.sessions[session_id]
+        store = SessionSnapshot(self._state_path(session_id))
+        try:
+            await asyncio.to_thread(store.save, session_id, daemon.ai, daemon.system, False)
+        finally:
+            await asyncio.to_thread(daemon.stop, True)
+        self.evicted += 1
+        return True
+
+    async def delete(self, session_id: str) -> bool:
+        """删除会话及其保存的状态和提醒"""
+        daemon = self.sessions.pop(session_id, None)
+        if daemon is not None:
+            await asyncio.to_thread(daemon.stop, True)
+        path = self._state_path(session_id)
+        existed = daemon is not None or os.path.exists(path)
+        if os.path.exists(path):
+            os.remove(path)
+        self.reminders.cancel_owner(session_id)
+        return existed
+
+    async def _enforce_capacity(self):
+        """内存中的会话超过上限时，从最久未使用的开始换出（跳过正在执行或有连接的会话）"""
+        for session_id in list(self.sessions):
+            if len(self.sessions) <= self.max_active:
+                return
+            if not self.sessions[session_id].clients:
+                await self.evict(session_id)
+
+    async def _sweep(self):
+        """定期换出空闲会话"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            deadline = time.time() - self.idle_timeout
+            for session_id, daemon in list(self.sessions.items()):
+                if daemon.last_active < deadline and not daemon.clients:
+                    try:
+                        await self.evict(session_id)
+                    except Exception as e:
+                        self._log_error(f"换出会话{session_id}失败: {str(e)}")
+
+    def start(self):
+        self._sweeper = self.loop.submit(self._start_sweeper()).result()
+
+    async def _start_sweeper(self) -> asyncio.Task:
+        return asyncio.ensure_future(self._sweep())
+
+    # ---- 提醒 ----
+
+    def _on_reminder(self, reminder: Reminder):
+        """共用调度器线程中回调：把提醒交给所属会话，会话已换出时先载入"""
+        self.loop.submit(self._deliver_reminder(reminder))
+
+    async def _deliver_reminder(self, reminder: Reminder):
+        try:
+            daemon = await self.get(reminder.owner)
+        except ValueError:
+            daemon = None
+        except Exception as e:
+            self._log_error(f"载入会话{reminder.owner}以分发提醒失败: {str(e)}")
+            return
+        if daemon is None:
+            self.reminders.cancel_owner(reminder.owner)  # 会话已删除
+            return
+        daemon.last_active = time.time()
+        daemon.system._fire_reminder(reminder)
+
+    def _load_reminders(self):
+        """重新装载上次关闭时保存的提醒"""
+        path = os.path.join(self.state_dir, self.REMINDER_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for item in saved:
+            self.reminders.add(item["content"], item["interval"], item["remaining"], owner=item["owner"])
+
+    def _save_reminders(self):
+        path = os.path.join(self.state_dir, self.REMINDER_FILE)
+        saved = []
+        for session_id in set(self.stored_sessions()) | set(self.sessions):
+            saved.extend({"owner": session_id, "content": r["content"], "interval": r["interval"],
+                          "remaining": r["remaining"]} for r in self.reminders.list(owner=session_id))
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(saved, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    # ---- 状态与关闭 ----
+
+    def stats(self) -> Dict:
+        shell_pool = next((d.system.shell_pool for d in self.sessions.values()), None)
+        return {
+            "active": len(self.sessions),
+            "stored": len(self.stored_sessions()),
+            "busy": sum(1 for daemon in self.sessions.values() if daemon.busy),
+            "shells": len(shell_pool) if shell_pool is not None else 0,
+            "reminders": len(self.reminders),
+            "evicted": self.evicted,
+            "rehydrated": self.rehydrated,
+            "routing": self.router.stats() if self.router is not None else None,
+            "cassette": self.cassette.stats() if self.cassette is not None else None,
+            "log_dropped": self.log_writer.dropped if self.log_writer is not None else 0,
+            "log_failed": self.log_writer.failed if self.log_writer is not None else 0,
+        }
+
+    async def close(self):
+        """换出全部会话，保存提醒并关闭共用资源"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        for session_id, daemon in list(self.sessions.items()):
+            store = SessionSnapshot(self._state_path(session_id))
+            try:
+                await asyncio.to_thread(store.save, session_id, daemon.ai, daemon.system, False)
+            except Exception as e:
+                self._log_error(f"保存会话{session_id}失败: {str(e)}")
+            await asyncio.to_thread(daemon.stop, True)
+        self.sessions.clear()
+        await asyncio.to_thread(self._save_reminders)
+        self.reminders.stop()
+        if self.on_close:
+            await asyncio.to_thread(self.on_close)
+
+# ---- HTTP/WebSocket接口 ----
+
+def _json_error(status: int, message: str):
+    return web.json_response({"error": message}, status=status)
+
+def create_app(manager: SessionManager, stop: threading.Event) -> "web.Application":
+    """
+    GET    /sessions                  列出会话
+    POST   /sessions                  创建会话，{"session": 可选ID}
+    GET    /sessions/{id}             会话状态
+    DELETE /sessions/{id}             删除会话
+    POST   /sessions/{id}/messages    {"text": ...}，返回{"response": ...}
+    GET    /sessions/{id}/ws          WebSocket，每帧一个JSON请求/事件，协议与无界面模式相同
+    GET    /stats                     服务状态
+    GET    /metrics                   各阶段耗时p50/p95/p99与token（?recent=N附带最近N轮的详细记录）
+    POST   /shutdown                  关闭服务
+    """
+    routes = web.RouteTableDef()
+
+    async def session_or_404(request, create=False):
+        try:
+            daemon = await manager.get(request.match_info["session_id"], create=create)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=json.dumps({"error": str(e)}, ensure_ascii=False),
+                                     content_type="application/json")
+        if daemon is None:
+            raise web.HTTPNotFound(text=json.dumps({"error": "会话不存在"}, ensure_ascii=False),
+                                   content_type="application/json")
+        return daemon
+
+    @routes.get("/sessions")
+    async def list_sessions(request):
+        return web.json_response({"active": list(manager.sessions), "stored": manager.stored_sessions()})
+
+    @routes.post("/sessions")
+    async def create_session(request):
+        body = await request.json() if request.can_read_body else {}
+        session_id = body.get("session") or os.urandom(6).hex()
+        try:
+            daemon = await manager.get(session_id, create=True)
+        except ValueError as e:
+            return _json_error(400, str(e))
+        return web.json_response({"session": session_id, "ready": daemon.ready})
+
+    @routes.get("/sessions/{session_id}")
+    async def session_status(request):
+        daemon = await session_or_404(request)
+        return web.json_response({"session": daemon.system.session_id, "ready": daemon.ready,
+                                  "busy": daemon.busy, "messages": len(daemon.ai.messages),
+                                  "reminders": daemon.system.list_reminders(),
+                                  "cmd_cwd": daemon.system.cmd_working_directory})
+
+    @routes.delete("/sessions/{session_id}")
+    async def delete_session(request):
+        if not await manager.delete(request.match_info["session_id"]):
+            return _json_error(404, "会话不存在")
+        return web.json_response({"deleted": True})
+
+    @routes.post("/sessions/{session_id}/messages")
+    async def post_message(request):
+        daemon = await session_or_404(request)
+        body = await request.json()
+        if not isinstance(body, dict) or not body.get("text"):
+            return _json_error(400, "缺少text")
+        response = await daemon.run_turn(str(body["text"]))
+        return web.json_response({"response": response})
+
+    @routes.get("/sessions/{session_id}/ws")
+    async def websocket(request):
+        daemon = await session_or_404(request)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        outgoing: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        client = DaemonClient(lambda line: loop.call_soon_threadsafe(outgoing.put_nowait, line))
+
+        async def writer():
+            while True:
+                line = await outgoing.get()
+                await ws.send_str(line.rstrip("\n"))
+
+        sender = asyncio.ensure_future(writer())
+        daemon.attach(client)
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.TEXT:
+                    daemon.last_active = time.time()
+                    daemon.submit_line(client, message.data)
+                elif message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            daemon.detach(client)
+            sender.cancel()
+        return ws
+
+    @routes.get("/metrics")
+    async def metrics(request):
+        if manager.metrics is None:
+            return _json_error(404, "未启用指标")
+        try:
+            recent = int(request.query.get("recent", "10"))
+        except ValueError:
+            return _json_error(400, "recent必须是整数")
+        return web.json_response(manager.metrics.snapshot(recent=recent))
+
+    @routes.get("/stats")
+    async def stats(request):
+        return web.json_response(manager.stats())
+
+    @routes.post("/shutdown")
+    async def shutdown(request):
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.1, stop.set)
+        return web.json_response({"stopping": True})
+
+    app = web.Application()
+    app.add_routes(routes)
+    return app
+
+def run_server(manager: SessionManager, address: str = "127.0.0.1:8080") -> int:
+    """启动HTTP/WebSocket服务，收到/shutdown或Ctrl+C后换出全部会话并返回"""
+    if not SERVER_AVAILABLE:
+        print("会话服务需要aiohttp，请先安装: pip install aiohttp", file=sys.stderr)
+        return 1
+    host, _, port = address.rpartition(":")
+    loop = get_event_loop_thread()
+    stop = threading.Event()
+    runner = web.AppRunner(create_app(manager, stop))
+    loop.run(runner.setup())
+    loop.run(web.TCPSite(runner, host or "127.0.0.1", int(port)).start())
+    manager.start()
+    print(f"会话服务监听 http://{host or '127.0.0.1'}:{port}", file=sys.stderr, flush=True)
+    try:
+        while not stop.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+    loop.run(runner.cleanup())
+    loop.run(manager.close())
+    return 0
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Optional, Dict, Callable
+
+from AIchat import AIWife
+from MorMain import MorSystem, async_process_user_message
+
+SNAPSHOT_VERSION = 1
+
+def _read_text(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def snapshot_key(system_prompt: str, init_text: str, model: str) -> str:
+    """快照键：系统提示词、初始化序列与模型名的哈希，任一变化都需要重新初始化"""
+    digest = hashlib.sha256()
+    for part in (system_prompt, init_text, model):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class SessionSnapshot:
+    """
+    初始化完成后的会话快照（对话历史、提醒、CMD工作目录），保存为JSON
+
+    提醒按间隔与剩余次数保存，恢复时从恢复时刻重新开始计时
+    """
+
+    def __init__(self, path: str = "session_snapshot.json"):
+        self.path = path
+
+    def load(self, key: str) -> Optional[Dict]:
+        """读取快照，键不一致或文件损坏时返回None"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != SNAPSHOT_VERSION or data.get("key") != key:
+            return None
+        return data
+
+    def save(self, key: str, ai: AIWife, system: MorSystem, reminders: bool = True):
+        """
+        保存当前状态（先写临时文件再替换，避免中途退出留下半个文件）
+        reminders为False时不保存提醒（提醒仍在共用调度器中运行，例如会话被换出到磁盘时）
+        """
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "key": key,
+            "created": time.time(),
+            "messages": list(ai.messages),
+            "reminders": [{"content": r["content"], "interval": r["interval"], "remaining": r["remaining"]}
+                          for r in system.list_reminders()] if reminders else [],
+            "cmd_cwd": system.get_cmd_cwd(),
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def restore(data: Dict, ai: AIWife, system: MorSystem):
+        """把快照恢复到ai与system上（提醒直接加入调度器，不作为"设置提醒"事件再交给AI）"""
+        ai.messages = [dict(message) for message in data["messages"]]
+        for reminder in data["reminders"]:
+            system.reminders.add(reminder["content"], reminder["interval"], reminder["remaining"],
+                                 owner=system.session_id)
+        if data["reminders"]:
+            system._log_entry("TIME", f"从快照恢复{len(data['reminders'])}个提醒", "REMINDER")
+        if data.get("cmd_cwd") and data["cmd_cwd"] != system.cmd_working_directory:
+            system.set_cmd_cwd(data["cmd_cwd"])
+
+async def initialize_session(ai: AIWife,
+                             system: MorSystem,
+                             init_file: str = "Init.txt",
+                             prompt_file: str = "System_prompt.txt",
+                             snapshot: Optional[SessionSnapshot] = None,
+                             on_response: Optional[Callable[[str], None]] = None,
+                             interval: float = 0.5) -> bool:
+    """
+    执行初始化序列；系统提示词、Init.txt与模型都没变时直接从快照恢复
+
+    参数:
+        ai: AI实例（系统提示词应已设置）
+        system: MorSystem实例
+        init_file: 初始化序列文件
+        prompt_file: 系统提示词文件（只用于计算快照键）
+        snapshot: 快照存储，默认session_snapshot.json
+        on_response: 重放初始化序列时每条非空回复的回调
+        interval: 重放时两条初始化消息之间的间隔(秒)
+
+    返回:
+        是否从快照恢复
+    """
+    snapshot = snapshot or SessionSnapshot()
+    init_text = _read_text(init_file)
+    key = snapshot_key(_read_text(prompt_file), init_text, ai.model)
+
+    data = snapshot.load(key)
+    if data is not None:
+        await asyncio.to_thread(snapshot.restore, data, ai, system)
+        system._log_entry("SYSTEM", f"已从快照恢复初始化状态 ({len(data['messages'])}条消息, {len(data['reminders'])}个提醒)", "SYSTEM")
+        return True
+
+    failed = False
+    for line in init_text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            response = await async_process_user_message(line, ai, system)
+            failed = failed or response.startswith("API请求失败")
+            if response and on_response:
+                on_response(response)
+            await asyncio.sleep(interval)
+    if failed:
+        system._log_entry("WARNING", "初始化过程中有请求失败，不保存快照", "SYSTEM")
+        return False
+    try:
+        await asyncio.to_thread(snapshot.save, key, ai, system)
+        system._log_entry("SYSTEM", "初始化状态已保存为快照", "SYSTEM")
+    except Exception as e:
+        system._log_entry("ERROR", f"保存初始化快照失败: {str(e)}", "SYSTEM")
+    return False
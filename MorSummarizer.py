@@ -0,0 +1,227 @@
+import time
+import queue
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict
+
+from AIchat import AIWife, HttpTransport
+from MorMemory import MemoryStore, TIER_CACHE, TIER_SUMMARY, TIER_LONG, TIER_NAMES
+
+SUMMARY_SYSTEM_PROMPT = "你是记忆整理助手，只输出摘要正文，不输出任何解释、标题或工具调用。"
+
+class SummaryJob:
+    """一次层级升级任务：把source_tier中的entries压缩为一条target_tier记忆（session为None表示不分会话）"""
+
+    __slots__ = ("source_tier", "target_tier", "entries", "session", "enqueued_at")
+
+    def __init__(self, source_tier: int, target_tier: int, entries: List[Dict], session: Optional[str] = None):
+        self.source_tier = source_tier
+        self.target_tier = target_tier
+        self.entries = entries
+        self.session = session
+        self.enqueued_at = time.time()
+
+class SummaryWorker:
+    """
+    后台记忆摘要
+
+    记忆库每次提交后检查各层级：缓存记忆满token_threshold或count_threshold条时，把最旧的一批压缩为
+    一条摘要记忆；摘要记忆满count_threshold条时把最旧的一批精炼为长期记忆；长期记忆超过long_threshold条时
+    只把最旧的一批合并为一条，其余长期记忆保持原样。每批最多count_threshold条、token_threshold个token。
+    摘要请求使用独立的AIWife实例和独立的小连接池，并发数受max_concurrency限制，
+    对话轮次从不等待它；结果通过MemoryStore.replace原子提交，重要记忆不参与升级。
+    per_session为True时各会话分别统计和升级，不同会话的记忆不会被合并到同一条摘要中
+    """
+
+    def __init__(self,
+                 store: MemoryStore,
+                 source_ai: AIWife,
+                 model: Optional[str] = None,
+                 max_concurrency: int = 1,
+                 token_threshold: int = 16000,
+                 count_threshold: int = 50,
+                 long_threshold: int = 200,
+                 retry_delay: float = 60.0,
+                 per_session: bool = False):
+        """
+        参数:
+            store: 记忆库
+            source_ai: 主AI实例，摘要请求沿用它的api_key/api_url
+            model: 摘要使用的模型，默认与主AI相同
+            max_concurrency: 同时进行的摘要请求上限
+            token_threshold: 缓存记忆的token阈值
+            count_threshold: 缓存与摘要记忆的条数阈值，也是每批的条数上限
+            long_threshold: 长期记忆的条数上限，超过时合并最旧的一批
+            retry_delay: 摘要失败后重试前等待的秒数
+            per_session: 是否按会话分别升级
+        """
+        self.store = store
+        self.source_ai = source_ai
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.token_threshold = token_threshold
+        self.count_threshold = count_threshold
+        self.long_threshold = max(long_threshold, count_threshold + 1)  # 合并一批后必须回到上限以下
+        self.retry_delay = retry_delay
+        self.per_session = per_session
+        self.transport = HttpTransport(pool_size=self.max_concurrency)
+
+        self.completed = 0
+        self.failed = 0
+        self.last_duration = 0.0
+        self._jobs: queue.Queue = queue.Queue()
+        self._busy = set()  # 有排队或进行中任务的(层级, 会话)
+        self._in_flight: List[SummaryJob] = []
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="MemorySummary")
+        self._slots = threading.Semaphore(self.max_concurrency)
+        store.add_listener(self._on_commit)
+        self._thread = threading.Thread(target=self._dispatch, name="MemorySummaryDispatch", daemon=True)
+        self._thread.start()
+        self._wake.set()  # 启动时检查一次已有的记忆
+
+    def _on_commit(self, rows: List[Dict], removed: Optional[List[int]] = None):
+        self._wake.set()
+
+    # ---- 任务生成 ----
+
+    def _plan(self):
+        """检查各层级大小，为超出阈值且没有进行中任务的层级生成任务"""
+        if time.time() < self._retry_at:
+            return
+        for source, target in ((TIER_CACHE, TIER_SUMMARY), (TIER_SUMMARY, TIER_LONG), (TIER_LONG, TIER_LONG)):
+            if self.per_session:
+                groups = self.store.session_stats(tier=source)
+            else:
+                groups = {None: self.store.stats(tier=source)}
+            for session, stats in groups.items():
+                with self._lock:
+                    if (source, session) in self._busy:
+                        continue
+                over_tokens = source == TIER_CACHE and stats["tokens"] >= self.token_threshold
+                if source == TIER_LONG:
+                    if stats["count"] <= self.long_threshold:
+                        continue
+                elif stats["count"] < self.count_threshold and not over_tokens:
+                    continue
+                # 每个层级都只处理最旧的一批
+                candidates = self.store.query(tier=source, session=session, important=False,
+                                              limit=self.count_threshold, newest_first=False)
+                entries, tokens = [], 0
+                for entry in candidates:
+                    if entries and tokens + entry["tokens"] > self.token_threshold:
+                        break
+                    entries.append(entry)
+                    tokens += entry["tokens"]
+                if not entries:
+                    continue
+                with self._lock:
+                    self._busy.add((source, session))
+                self._jobs.put(SummaryJob(source, target, entries, session))
+
+    def _dispatch(self):
+        """调度线程：被提交事件唤醒后检查层级，按并发上限把任务交给线程池"""
+        while self._running:
+            self._wake.wait(timeout=max(1.0, self._retry_at - time.time()) if self._retry_at else None)
+            self._wake.clear()
+            if not self._running:
+                return
+            try:
+                self._plan()
+            except Exception:
+                pass
+            while self._running:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                self._slots.acquire()
+                with self._lock:
+                    self._in_flight.append(job)
+                self._pool.submit(self._run_job, job)
+
+    # ---- 执行 ----
+
+    def build_prompt(self, job: SummaryJob) -> str:
+        """由待升级的记忆构造摘要请求"""
+        lines = []
+        for entry in job.entries:
+            stamp = datetime.fromtimestamp(entry["created"]).strftime("%Y-%m-%d %H:%M")
+            lines.append(f"[{stamp}] {entry['kind']}: {entry['content']}")
+        if job.source_tier == TIER_LONG:
+            instruction = (f"请把以下{len(job.entries)}条最早的长期记忆合并为一段，去掉重复内容，"
+                           f"保留对主人和自己最重要的事实、偏好、约定与经历")
+        else:
+            instruction = (f"请把以下{len(job.entries)}条{TIER_NAMES[job.source_tier]}压缩为一段简洁的摘要，"
+                           f"保留人物、事实、时间、约定和未完成的事项，不要添加原文没有的内容")
+        return instruction + "：\n" + "\n".join(lines)
+
+    def _summarize(self, prompt: str) -> Optional[str]:
+        """用独立的AIWife实例请求摘要，失败返回None"""
+        ai = AIWife(api_key=self.source_ai.api_key,
+                    system_prompt=SUMMARY_SYSTEM_PROMPT,
+                    temperature=0.3,
+                    max_tokens=self.source_ai.max_tokens,
+                    model=self.model or self.source_ai.model,
+                    api_url=self.source_ai.api_url,
+                    transport=self.transport)
+        ai.cassette = self.source_ai.cassette  # 摘要请求的系统提示词不同，录制中自成一个会话流
+        result = ai.get_response(prompt)
+        if not result or result.startswith("API请求失败") or result.startswith("错误："):
+            return None
+        return result.strip()
+
+    def _run_job(self, job: SummaryJob):
+        started = time.time()
+        try:
+            summary = self._summarize(self.build_prompt(job))
+            if summary is None:
+                raise RuntimeError("摘要请求失败")
+            sessions = {entry["session"] for entry in job.entries}
+            self.store.replace([entry["id"] for entry in job.entries], [{
+                "kind": "summary",
+                "content": summary,
+                "tier": job.target_tier,
+                "session": sessions.pop() if len(sessions) == 1 else "",
+                "created": job.entries[-1]["created"],
+            }])
+            self.completed += 1
+            self._retry_at = 0.0
+        except Exception:
+            self.failed += 1
+            self._retry_at = time.time() + self.retry_delay
+        finally:
+            self.last_duration = time.time() - started
+            with self._lock:
+                self._in_flight.remove(job)
+                self._busy.discard((job.source_tier, job.session))
+            self._slots.release()
+            self._wake.set()  # 升级后上一层可能也满了
+
+    # ---- 状态 ----
+
+    def metrics(self) -> Dict:
+        """队列深度、进行中任务数与滞后时间（最早一个未完成任务已等待的秒数）"""
+        with self._lock:
+            in_flight = list(self._in_flight)
+        waiting = list(self._jobs.queue)
+        oldest = min((job.enqueued_at for job in waiting + in_flight), default=None)
+        return {
+            "queue_depth": len(waiting),
+            "in_flight": len(in_flight),
+            "lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "completed": self.completed,
+            "failed": self.failed,
+            "last_duration": round(self.last_duration, 3),
+        }
+
+    def stop(self):
+        """停止调度，不等待进行中的摘要请求"""
+        self._running = False
+        self._wake.set()
+        self._pool.shutdown(wait=False)
+        self.transport.close()
@@ -0,0 +1,295 @@
+import time
+import queue
+import atexit
+import sqlite3
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Optional, List
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcript (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    role TEXT NOT NULL,
+    html TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transcript_session_id ON transcript (session, id);
+"""
+
+class TranscriptEntry:
+    """一条聊天记录；key用于界面缓存排版结果，内容变化时随之变化"""
+
+    __slots__ = ("id", "role", "html", "created", "key")
+
+    def __init__(self, entry_id: Optional[int], role: str, html: str, created: float, key=None):
+        self.id = entry_id
+        self.role = role
+        self.html = html
+        self.created = created
+        self.key = key if key is not None else entry_id
+
+class TranscriptStore:
+    """
+    聊天记录的完整存储（SQLite，WAL模式），界面只保留最近的一部分，其余按需分页读取
+
+    与MemoryStore相同，写入只入队，由后台线程按批在一个事务中提交，界面线程不等待磁盘；
+    ID在入队时分配（一个数据库文件只由一个实例写入），尚未提交的记录在分页读取时一并返回
+    """
+
+    def __init__(self, path: str = "transcript.db", session: str = "",
+                 batch_size: int = 64, flush_interval: float = 0.2):
+        """
+        参数:
+            path: 数据库文件路径
+            session: 会话ID，只读写该会话的记录
+            batch_size: 每个事务最多提交的条数
+            flush_interval: 最长提交间隔(秒)
+        """
+        self.path = path
+        self.session = session
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.failed = 0  # 提交失败而丢失的条数
+        self.conn = sqlite3.connect(path)  # 只用于读取，写入在后台线程的连接上进行
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self._ids = itertools.count(self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM transcript").fetchone()[0])
+        self._unwritten: "OrderedDict[int, TranscriptEntry]" = OrderedDict()  # 已入队、尚未提交的记录
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="TranscriptStore", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, role: str, html: str) -> TranscriptEntry:
+        """保存一条记录（异步批量提交），立即返回带ID的记录；关闭后的记录不再保存"""
+        with self._lock:
+            entry = TranscriptEntry(next(self._ids), role, html, time.time())
+            if self._closed:
+                self.failed += 1
+                return entry
+            self._unwritten[entry.id] = entry
+        self._queue.put(entry)
+        return entry
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前入队的记录全部提交"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def older(self, before_id: Optional[int], limit: int) -> List[TranscriptEntry]:
+        """before_id之前的limit条（按时间正序），before_id为None时取最新的limit条"""
+        unwritten = [entry for entry in self._pending() if before_id is None or entry.id < before_id]
+        if before_id is None:
+            rows = self.conn.execute("SELECT id, role, html, created FROM transcript WHERE session = ? "
+                                     "ORDER BY id DESC LIMIT ?", (self.session, limit))
+        else:
+            rows = self.conn.execute("SELECT id, role, html, created FROM transcript WHERE session = ? AND id < ? "
+                                     "ORDER BY id DESC LIMIT ?", (self.session, before_id, limit))
+        entries = self._merge(rows.fetchall(), unwritten)
+        return entries[-limit:] if limit > 0 else []
+
+    def newer(self, after_id: int, limit: int) -> List[TranscriptEntry]:
+        """after_id之后的limit条（按时间正序）"""
+        unwritten = [entry for entry in self._pending() if entry.id > after_id]
+        rows = self.conn.execute("SELECT id, role, html, created FROM transcript WHERE session = ? AND id > ? "
+                                 "ORDER BY id LIMIT ?", (self.session, after_id, limit))
+        return self._merge(rows.fetchall(), unwritten)[:limit]
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """提交队列中的记录并关闭连接"""
+        if self._closed:
+            return
+        with self._lock:
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self.conn.close()
+
+    # ---- 内部 ----
+
+    def _pending(self) -> List[TranscriptEntry]:
+        # 先取未提交的记录再查询数据库：期间提交的记录两边都可能出现（按ID去重），不会两边都缺
+        with self._lock:
+            return list(self._unwritten.values())
+
+    @staticmethod
+    def _merge(rows, unwritten: List[TranscriptEntry]) -> List[TranscriptEntry]:
+        entries = {row[0]: TranscriptEntry(*row) for row in rows}
+        for entry in unwritten:
+            entries.setdefault(entry.id, entry)
+        return [entries[entry_id] for entry_id in sorted(entries)]
+
+    def _write(self, conn: sqlite3.Connection, batch: List[TranscriptEntry]):
+        """在一个事务中提交一批记录；失败时丢弃并计数"""
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO transcript (id, session, role, html, created) VALUES (?, ?, ?, ?, ?)",
+                    [(entry.id, self.session, entry.role, entry.html, entry.created) for entry in batch])
+        except Exception:
+            self.failed += len(batch)
+        with self._lock:
+            for entry in batch:
+                self._unwritten.pop(entry.id, None)
+
+    def _worker(self):
+        """后台线程：攒批并在单个事务中提交"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        stopping = False
+        while not stopping:
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+
+            if batch:
+                self._write(conn, batch)
+            for waiter in waiters:
+                waiter.set()
+        conn.close()
+
+class TranscriptWindow:
+    """
+    聊天界面中实际显示的记录窗口，最多max_items条
+
+    追加新消息时若超出上限就丢弃最旧的几条，追加的开销与会话长度无关；
+    向上翻到顶部时从存储中分页读入更早的记录（同时丢弃末尾超出的部分），翻回底部时再逐页读回。
+    流式回复用一条不入库的临时记录显示，始终位于末尾。
+    每次增删都先通知observer（begin_insert/end_insert/begin_remove/end_remove/changed），
+    便于界面模型只更新变化的行
+    """
+
+    def __init__(self, store: TranscriptStore, max_items: int = 500, page_size: int = 100, observer=None):
+        self.store = store
+        self.max_items = max(2, max_items)
+        self.page_size = max(1, min(page_size, self.max_items - 1))
+        self.observer = observer
+        self.entries: List[TranscriptEntry] = []
+        self.partial: Optional[TranscriptEntry] = None
+        self.at_latest = True  # 窗口末尾是否就是最新的记录
+        self._partial_versions = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, row: int) -> TranscriptEntry:
+        return self.entries[row]
+
+    @property
+    def has_older(self) -> bool:
+        """存储中是否还有比窗口更早的记录"""
+        first = self._first_id()
+        return first is not None and bool(self.store.older(first, 1))
+
+    # ---- 追加 ----
+
+    def append(self, role: str, html: str) -> TranscriptEntry:
+        """保存一条消息；浏览最新记录时同时显示（位于流式回复之前）"""
+        entry = self.store.append(role, html)
+        if self.at_latest:
+            row = len(self.entries) - (1 if self.partial else 0)
+            self._insert(row, [entry])
+            self._trim_front()
+        return entry
+
+    def set_partial(self, html: str):
+        """显示或刷新流式回复"""
+        if not self.at_latest:
+            return
+        key = ("partial", next(self._partial_versions))
+        if self.partial is None:
+            self.partial = TranscriptEntry(None, "partial", html, time.time(), key)
+            self._insert(len(self.entries), [self.partial])
+            self._trim_front()
+        else:
+            self.partial.html = html
+            self.partial.key = key
+            self._notify("changed", len(self.entries) - 1)
+
+    def clear_partial(self):
+        """移除流式回复"""
+        if self.partial is None:
+            return
+        self._remove(len(self.entries) - 1, len(self.entries) - 1)
+        self.partial = None
+
+    # ---- 分页 ----
+
+    def load_older(self) -> int:
+        """读入更早的一页，返回读入的条数"""
+        entries = self.store.older(self._first_id(), self.page_size)
+        if not entries:
+            return 0
+        self._insert(0, entries)
+        excess = len(self.entries) - self.max_items
+        if excess > 0:
+            if self.partial is not None:
+                self.partial = None
+            self._remove(len(self.entries) - excess, len(self.entries) - 1)
+            self.at_latest = False
+        return len(entries)
+
+    def load_newer(self) -> int:
+        """浏览历史时读回较新的一页，返回读入的条数；读到最新记录后恢复自动追加"""
+        if self.at_latest:
+            return 0
+        last = self._last_id()
+        entries = self.store.newer(last, self.page_size + 1) if last is not None else []
+        self.at_latest = len(entries) <= self.page_size
+        entries = entries[:self.page_size]
+        if entries:
+            self._insert(len(self.entries), entries)
+            self._trim_front()
+        return len(entries)
+
+    # ---- 内部 ----
+
+    def _first_id(self) -> Optional[int]:
+        for entry in self.entries:
+            if entry.id is not None:
+                return entry.id
+        return None
+
+    def _last_id(self) -> Optional[int]:
+        for entry in reversed(self.entries):
+            if entry.id is not None:
+                return entry.id
+        return None
+
+    def _trim_front(self):
+        excess = len(self.entries) - self.max_items
+        if excess > 0:
+            self._remove(0, excess - 1)
+
+    def _insert(self, row: int, entries: List[TranscriptEntry]):
+        self._notify("begin_insert", row, row + len(entries) - 1)
+        self.entries[row:row] = entries
+        self._notify("end_insert")
+
+    def _remove(self, first: int, last: int):
+        self._notify("begin_remove", first, last)
+        del self.entries[first:last + 1]
+        self._notify("end_remove")
+
+    def _notify(self, event: str, *args):
+        if self.observer is not None:
+            getattr(self.observer, event)(*args)
@@ -0,0 +1,187 @@
+import time
+import asyncio
+import threading
+import concurrent.futures
+from collections import deque
+from typing import Optional, Dict, Callable, Awaitable, Any, Deque, Hashable
+
+from AILoop import EventLoopThread, get_event_loop_thread
+
+class Turn:
+    """
+    一轮待执行的对话；supersede_key相同的新轮次入队时，仍在排队的旧轮次被取消
+    priority大的轮次排在同一会话中priority较小的排队轮次之前（例如用户输入先于系统事件）
+    """
+
+    __slots__ = ("key", "text", "source", "supersede_key", "priority", "future", "task", "enqueued_at", "started_at")
+
+    def __init__(self, key: Hashable, text: str, source: str = "user", supersede_key: Optional[Hashable] = None,
+                 priority: int = 0):
+        self.key = key
+        self.text = text
+        self.source = source
+        self.supersede_key = supersede_key
+        self.priority = priority
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.task: Optional[asyncio.Task] = None
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+
+class TurnScheduler:
+    """
+    对话轮次调度器
+
+    每个会话(key)一条有序队列，同一会话的轮次按优先级、同优先级按入队顺序逐个执行，不会同时修改同一份对话历史；
+    固定数量的工作协程在共享事件循环中轮流处理各会话的队列。每个会话的排队数有上限，
+    满时submit拒绝新轮次，由调用方决定提示用户或暂缓生产
+    """
+
+    def __init__(self,
+                 handler: Callable[[Turn], Awaitable[Any]],
+                 workers: int = 3,
+                 max_pending: int = 16,
+                 loop_thread: Optional[EventLoopThread] = None):
+        """
+        参数:
+            handler: 执行一轮对话的协程函数 handler(turn)，返回值作为轮次结果
+            workers: 工作协程数（不同会话的轮次最多同时执行这么多）
+            max_pending: 每个会话排队中（不含正在执行）的轮次上限
+            loop_thread: 事件循环线程，默认使用共享事件循环
+        """
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.loop_thread = loop_thread or get_event_loop_thread()
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self._queues: Dict[Hashable, Deque[Turn]] = {}
+        self._running: Dict[Hashable, Turn] = {}
+        self._scheduled = set()  # 已在就绪队列中或正在执行的会话
+        self._lock = threading.Lock()
+        self._closed = False
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks = self.loop_thread.run(self._start())
+
+    async def _start(self):
+        self._ready = asyncio.Queue()
+        return [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    # ---- 提交与取消（任意线程） ----
+
+    def submit(self, key: Hashable, text: str, source: str = "user",
+               supersede_key: Optional[Hashable] = None, priority: int = 0) -> Optional[concurrent.futures.Future]:
+        """
+        提交一轮对话，priority较大时插到排队中优先级较低的轮次之前（不打断正在执行的轮次）
+
+        返回:
+            轮次结果的Future（被取代或取消时为cancelled状态）；队列已满或已关闭时返回None
+        """
+        turn = Turn(key, text, source, supersede_key, priority)
+        with self._lock:
+            if self._closed:
+                return None
+            pending = self._queues.setdefault(key, deque())
+            if supersede_key is not None:
+                for old in [t for t in pending if t.supersede_key == supersede_key]:
+                    pending.remove(old)
+                    old.future.cancel()
+                    self.cancelled += 1
+            if len(pending) >= self.max_pending:
+                self.rejected += 1
+                return None
+            index = len(pending)
+            while index > 0 and pending[index - 1].priority < priority:
+                index -= 1
+            pending.insert(index, turn)
+            schedule = key not in self._scheduled
+            self._scheduled.add(key)
+        if schedule:
+            self.loop_thread.loop.call_soon_threadsafe(self._ready.put_nowait, key)
+        return turn.future
+
+    def is_full(self, key: Hashable) -> bool:
+        """该会话的排队是否已满"""
+        with self._lock:
+            return len(self._queues.get(key, ())) >= self.max_pending
+
+    def pending(self, key: Hashable) -> int:
+        """该会话排队中的轮次数"""
+        with self._lock:
+            return len(self._queues.get(key, ()))
+
+    def cancel(self, key: Hashable, running: bool = True) -> int:
+        """
+        取消该会话排队中的轮次，running为True时同时取消正在执行的轮次
+
+        返回:
+            取消的轮次数
+        """
+        with self._lock:
+            turns = list(self._queues.get(key, ()))
+            self._queues.get(key, deque()).clear()
+            current = self._running.get(key) if running else None
+        for turn in turns:
+            turn.future.cancel()
+        self.cancelled += len(turns)
+        if current is None:
+            return len(turns)
+        if current.task is not None:
+            self.loop_thread.loop.call_soon_threadsafe(current.task.cancel)
+        else:
+            current.future.cancel()  # 已出队但尚未开始
+        return len(turns) + 1
+
+    def close(self):
+        """取消所有轮次并停止工作协程"""
+        with self._lock:
+            self._closed = True
+            keys = list(self._queues)
+        for key in keys:
+            self.cancel(key)
+        for task in self._tasks:
+            self.loop_thread.loop.call_soon_threadsafe(task.cancel)
+
+    # ---- 执行（事件循环线程） ----
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            with self._lock:
+                pending = self._queues.get(key)
+                turn = pending.popleft() if pending else None
+                if turn is None:
+                    self._scheduled.discard(key)
+                    continue
+                self._running[key] = turn
+            await self._run(turn)
+            with self._lock:
+                del self._running[key]
+                if self._queues.get(key):
+                    self._ready.put_nowait(key)  # 同一会话的下一轮排到其它会话之后
+                else:
+                    self._scheduled.discard(key)
+                    self._queues.pop(key, None)
+
+    async def _run(self, turn: Turn):
+        if not turn.future.set_running_or_notify_cancel():
+            return  # 出队前已被取消
+        turn.started_at = time.monotonic()
+        turn.task = asyncio.ensure_future(self.handler(turn))
+        try:
+            result = await turn.task
+        except asyncio.CancelledError:
+            if self._closed or asyncio.current_task().cancelling():
+                # 工作协程本身被取消（关闭）：关闭时轮次也会被取消，不能因此吞掉工作协程的取消；
+                # 处理函数自己抛出的CancelledError只算这一轮被取消，工作协程继续处理后续轮次
+                turn.task.cancel()
+                if not turn.future.done():
+                    turn.future.set_exception(concurrent.futures.CancelledError())
+                raise
+            self.cancelled += 1
+            turn.future.set_exception(concurrent.futures.CancelledError())
+        except Exception as e:
+            turn.future.set_exception(e)
+        else:
+            self.completed += 1
+            turn.future.set_result(result)
@@ -0,0 +1,437 @@
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import signal
+import tempfile
+import threading
+import subprocess
+from typing import Optional, List, Dict, Iterable
+
+WORKER_SCRIPT = os.path.abspath(__file__)
+FORK_AVAILABLE = hasattr(os, "fork")
+
+_HEADER = struct.Struct(">I")  # 消息长度前缀
+
+def _write_message(fd: int, message: Dict):
+    """向管道写入一条带长度前缀的JSON消息"""
+    data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    data = _HEADER.pack(len(data)) + data
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+def _read_exact(fd: int, size: int) -> Optional[bytes]:
+    chunks = []
+    while size:
+        chunk = os.read(fd, size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def _read_message(fd: int) -> Optional[Dict]:
+    """读取一条消息，管道关闭时返回None"""
+    header = _read_exact(fd, _HEADER.size)
+    if header is None:
+        return None
+    data = _read_exact(fd, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+class ExecutionResult:
+    """一次Rcte代码执行的结果"""
+
+    __slots__ = ("stdout", "stderr", "returncode", "timed_out", "duration", "error")
+
+    def __init__(self, stdout: str = "", stderr: str = "", returncode: int = 0,
+                 timed_out: bool = False, duration: float = 0.0, error: str = ""):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.duration = duration
+        self.error = error  # 工作进程本身出错（崩溃、启动失败）时的说明
+
+    @property
+    def success(self) -> bool:
+        return not self.error and not self.timed_out and self.returncode == 0
+
+# ---------------------------------------------------------------------------
+# 工作进程端
+# ---------------------------------------------------------------------------
+
+def _run_job(job: Dict) -> int:
+    """在当前进程中以__main__身份执行代码，返回退出码（fd 1/2已重定向）"""
+    import atexit
+    import builtins
+    import linecache
+    import traceback
+    import types
+
+    sys.stdout = open(1, "w", encoding="utf-8", errors="backslashreplace", closefd=False)
+    sys.stderr = open(2, "w", encoding="utf-8", errors="backslashreplace", closefd=False)
+    code = job["code"]
+    filename = "<Rcte>"
+    # 让traceback能显示出错的源码行
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+    exit_code = 0
+    try:
+        os.chdir(job["cwd"])
+        sys.path[0] = job["cwd"]
+        # 与原先写入临时文件再执行时一致：__file__与argv[0]指向工作目录下的脚本路径
+        script = os.path.join(job["cwd"], "temp_execution.py")
+        sys.argv = [script]
+        # 代码在新的__main__模块中执行并替换sys.modules中的工作进程模块，
+        # pickle、multiprocessing按__main__查找代码中定义的类和函数时才能找到
+        main = types.ModuleType("__main__")
+        main.__file__ = script
+        main.__builtins__ = builtins
+        sys.modules["__main__"] = main
+        exec(compile(code, filename, "exec"), main.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    try:
+        atexit._run_exitfuncs()
+    except Exception:
+        pass
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    return exit_code
+
+def _redirect_output():
+    """把fd 1/2重定向到临时文件，返回(stdout文件, stderr文件)"""
+    out_file = tempfile.TemporaryFile()
+    err_file = tempfile.TemporaryFile()
+    os.dup2(out_file.fileno(), 1)
+    os.dup2(err_file.fileno(), 2)
+    return out_file, err_file
+
+def _collect_output(out_file, err_file) -> tuple:
+    out_file.seek(0)
+    err_file.seek(0)
+    stdout = out_file.read().decode("utf-8", errors="replace")
+    stderr = err_file.read().decode("utf-8", errors="replace")
+    out_file.close()
+    err_file.close()
+    return stdout, stderr
+
+def _exit_code_from_status(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def _fork_job(job: Dict, proto_in: int, proto_out: int) -> Dict:
+    """fork出子进程执行一个任务：子进程是预热后父进程的副本，任务之间互不影响"""
+    out_file, err_file = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+    started = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            os.setsid()  # 独立进程组，超时时连同其子进程一起结束
+            os.close(proto_in)
+            os.close(proto_out)
+            os.dup2(out_file.fileno(), 1)
+            os.dup2(err_file.fileno(), 2)
+            if job.get("memory_limit"):
+                import resource
+                limit = int(job["memory_limit"])
+                resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+            exit_code = _run_job(job)
+        finally:
+            os._exit(exit_code)
+
+    # 子进程由独立线程阻塞等待，结束时立即返回，不靠轮询
+    exited = {}
+    reaper = threading.Thread(target=lambda: exited.setdefault("status", os.waitpid(pid, 0)[1]),
+                              name="RcteReaper", daemon=True)
+    reaper.start()
+    reaper.join(max(0.0, started + job["timeout"] - time.monotonic()))
+    timed_out = reaper.is_alive()
+    if timed_out:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+        reaper.join()
+    status = exited["status"]
+
+    stdout, stderr = _collect_output(out_file, err_file)
+    return {
+        "stdout": stdout,
+        "stderr": stderr,
+        "returncode": _exit_code_from_status(status),
+        "timed_out": timed_out,
+        "duration": time.monotonic() - started,
+    }
+
+def _serve(mode: str, preload: List[str]):
+    """工作进程主循环：从stdin读取任务，向stdout写回结果"""
+    # 协议管道挪到私有fd上，避免预加载模块或任务代码的输出混入协议
+    proto_in = os.dup(0)
+    proto_out = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    for name in preload:
+        try:
+            __import__(name)
+        except Exception:
+            pass
+    _write_message(proto_out, {"ready": True, "pid": os.getpid()})
+
+    while True:
+        job = _read_message(proto_in)
+        if job is None:
+            return
+        if mode == "fork":
+            _write_message(proto_out, _fork_job(job, proto_in, proto_out))
+            continue
+        # oneshot：在本进程内执行一个任务后退出，超时由主进程结束本进程
+        started = time.monotonic()
+        out_file, err_file = _redirect_output()
+        exit_code = _run_job(job)
+        stdout, stderr = _collect_output(out_file, err_file)
+        _write_message(proto_out, {
+            "stdout": stdout,
+            "stderr": stderr,
+            "returncode": exit_code,
+            "timed_out": False,
+            "duration": time.monotonic() - started,
+        })
+        return
+
+# ---------------------------------------------------------------------------
+# 主进程端
+# ---------------------------------------------------------------------------
+
+class _Worker:
+    """一个预启动的Python工作进程"""
+
+    def __init__(self, mode: str, preload: Iterable[str], startup_timeout: float):
+        self.mode = mode
+        self.jobs = 0
+        self.broken = False
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, mode, ",".join(preload)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=os.getcwd(),
+        )
+        self._responses: queue.Queue = queue.Queue()
+        threading.Thread(target=self._reader, name="PythonWorkerReader", daemon=True).start()
+        try:
+            ready = self._responses.get(timeout=startup_timeout)
+        except queue.Empty:
+            ready = None
+        if not ready:
+            self.close()
+            raise RuntimeError("Python工作进程启动失败")
+
+    def _reader(self):
+        fd = self.process.stdout.fileno()
+        while True:
+            try:
+                message = _read_message(fd)
+            except Exception:
+                message = None
+            self._responses.put(message)
+            if message is None:
+                return
+
+    def run(self, job: Dict, grace: float) -> ExecutionResult:
+        """发送任务并等待结果；fork模式下超时由工作进程处理，这里只做兜底"""
+        self.jobs += 1
+        try:
+            _write_message(self.process.stdin.fileno(), job)
+        except OSError as e:
+            self.broken = True
+            return ExecutionResult(returncode=-1, error=f"工作进程不可用: {e}")
+        try:
+            response = self._responses.get(timeout=job["timeout"] + grace)
+        except queue.Empty:
+            self.broken = True
+            self.close()
+            return ExecutionResult(returncode=-1, timed_out=True, duration=job["timeout"])
+        if response is None:
+            self.broken = True
+            code = self.process.poll()
+            return ExecutionResult(returncode=-1, error=f"工作进程意外退出 (退出码 {code})")
+        return ExecutionResult(
+            stdout=response["stdout"],
+            stderr=response["stderr"],
+            returncode=response["returncode"],
+            timed_out=response["timed_out"],
+            duration=response["duration"],
+        )
+
+    def close(self):
+        """结束工作进程"""
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+
+class PythonWorkerPool:
+    """
+    预启动的Python工作进程池，用于执行Rcte代码块
+
+    支持fork的平台上，每个工作进程预先导入preload中的模块后常驻，每个任务fork一个子进程执行：
+    任务拿到的是干净的预热环境，彼此之间以及与工作进程之间不共享状态；子进程自成进程组，
+    超时时整组结束，设置memory_limit_mb时通过RLIMIT_AS限制地址空间。工作进程处理max_jobs个任务后或崩溃时替换为新进程。
+    不支持fork的平台（Windows）上，每个工作进程只执行一个任务，执行后立即在后台预启动替补，
+    同样省去了解释器启动时间；此时内存限制不生效。
+    """
+
+    def __init__(self,
+                 size: int = 2,
+                 timeout: float = 30.0,
+                 memory_limit_mb: Optional[int] = None,
+                 max_jobs: int = 100,
+                 preload: Iterable[str] = (),
+                 startup_timeout: float = 15.0):
+        """
+        参数:
+            size: 工作进程数，也是同时执行的任务上限
+            timeout: 默认的单任务超时(秒)
+            memory_limit_mb: 单任务地址空间上限(MB)，默认不限制；限制的是虚拟地址空间而非实际占用，
+                numpy等库与线程栈会预留大量地址空间，需留足余量
+            max_jobs: 工作进程处理多少个任务后替换
+            preload: 工作进程启动时预先导入的模块名
+            startup_timeout: 等待工作进程就绪的最长秒数
+        """
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_jobs = max(1, max_jobs) if FORK_AVAILABLE else 1
+        self.mode = "fork" if FORK_AVAILABLE else "oneshot"
+        self.preload = [name.strip() for name in preload if name.strip()]
+        self.startup_timeout = startup_timeout
+        self.recycled = 0  # 因达到任务数、崩溃或超时而替换的工作进程数
+
+        self._idle: queue.Queue = queue.Queue()
+        self._slots = threading.Semaphore(self.size)
+        self._lock = threading.Lock()
+        self._spawning = 0
+        self._closed = False
+        for _ in range(self.size):
+            self._spawn_async()
+
+    def _spawn_async(self):
+        """在后台启动一个工作进程，就绪后放入空闲队列"""
+        with self._lock:
+            if self._closed:
+                return
+            self._spawning += 1
+
+        def spawn():
+            worker = None
+            try:
+                worker = _Worker(self.mode, self.preload, self.startup_timeout)
+            except Exception:
+                pass
+            with self._lock:
+                self._spawning -= 1
+                closed = self._closed
+            if worker is not None:
+                if closed:
+                    worker.close()
+                else:
+                    self._idle.put(worker)
+
+        threading.Thread(target=spawn, name="PythonWorkerSpawn", daemon=True).start()
+
+    def _acquire(self) -> _Worker:
+        """取一个空闲工作进程；没有正在启动的进程时同步启动一个"""
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                spawning = self._spawning
+            if not spawning:
+                return _Worker(self.mode, self.preload, self.startup_timeout)
+            try:
+                return self._idle.get(timeout=0.05)
+            except queue.Empty:
+                continue
+
+    def _release(self, worker: _Worker):
+        """任务结束后归还工作进程，需要替换时关闭并在后台补充"""
+        if worker.broken or worker.jobs >= self.max_jobs or worker.process.poll() is not None or self._closed:
+            worker.close()
+            self.recycled += 1
+            self._spawn_async()
+        else:
+            self._idle.put(worker)
+
+    def run(self, code: str, timeout: Optional[float] = None, cwd: Optional[str] = None) -> ExecutionResult:
+        """
+        执行一段Python代码
+
+        参数:
+            code: 源代码
+            timeout: 超时秒数，默认使用池的timeout
+            cwd: 工作目录，默认为当前目录
+
+        返回:
+            ExecutionResult
+        """
+        if self._closed:
+            return ExecutionResult(returncode=-1, error="工作进程池已关闭")
+        job = {
+            "code": code,
+            "cwd": cwd or os.getcwd(),
+            "timeout": timeout or self.timeout,
+            "memory_limit": (self.memory_limit_mb or 0) * 1024 * 1024,
+        }
+        with self._slots:
+            try:
+                worker = self._acquire()
+            except Exception as e:
+                return ExecutionResult(returncode=-1, error=str(e))
+            try:
+                # oneshot模式由主进程计时，到时直接结束工作进程
+                grace = 5.0 if self.mode == "fork" else 0.0
+                return worker.run(job, grace)
+            finally:
+                self._release(worker)
+
+    def close(self):
+        """关闭所有工作进程"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+if __name__ == "__main__":
+    _serve(sys.argv[1], [name for name in sys.argv[2].split(",") if name] if len(sys.argv) > 2 else [])
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from MorCassette import Cassette, request_key
+
+
+def history(*contents):
+    messages = [{"role": "system", "content": "prompt"}]
+    for i, content in enumerate(contents):
+        messages.append({"role": "user" if i % 2 == 0 else "assistant", "content": content})
+    return messages
+
+
+class CassetteTest(unittest.TestCase):
+    """录制后回放，按历史哈希命中，找不到时按会话流顺序回放"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "session.cas")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def _record(self, *exchanges):
+        cassette = Cassette(self.path, mode="record")
+        for messages, reply in exchanges:
+            cassette.record("model", messages, [(10.0, reply[:2]), (25.0, reply[2:])], True,
+                            {"total_ms": 30.0}, {"prompt_tokens": 3, "completion_tokens": 2})
+        cassette.close()
+
+    def test_record_then_replay_round_trip(self):
+        first, second = history("你好"), history("你好", "主人好", "几点了")
+        self._record((first, "主人好"), (second, "现在三点"))
+        cassette = Cassette(self.path, mode="replay")
+        self.assertEqual(len(cassette), 2)
+        entry = cassette.lookup(second)
+        self.assertEqual(entry.text, "现在三点")
+        self.assertEqual(entry.chunks, [(10.0, "现在"), (25.0, "三点")])
+        self.assertEqual(entry.usage, {"prompt_tokens": 3, "completion_tokens": 2})
+        self.assertEqual(entry.input, "几点了")
+        self.assertEqual(cassette.lookup(first).text, "主人好")
+        self.assertEqual(cassette.stats()["hits"], 2)
+        cassette.close()
+
+    def test_model_does_not_affect_key(self):
+        self.assertEqual(request_key(history("a")), request_key([dict(m) for m in history("a")]))
+        self.assertNotEqual(request_key(history("a"))[0], request_key(history("b"))[0])
+        self.assertEqual(request_key(history("a"))[1], request_key(history("b"))[1])
+
+    def test_repeated_history_replays_in_order_then_repeats_last(self):
+        messages = history("再说一次")
+        self._record((messages, "第一次"), (messages, "第二次"))
+        cassette = Cassette(self.path, mode="replay")
+        self.assertEqual([cassette.lookup(messages).text for _ in range(3)], ["第一次", "第二次", "第二次"])
+        cassette.close()
+
+    def test_fallback_to_stream_order(self):
+        self._record((history("a"), "reply a"), (history("a", "reply a", "b"), "reply b"))
+        cassette = Cassette(self.path, mode="replay")
+        self.assertEqual(cassette.lookup(history("changed")).text, "reply a")
+        self.assertEqual(cassette.lookup(history("changed", "x", "y")).text, "reply b")
+        self.assertIsNone(cassette.lookup(history("nothing left")))
+        self.assertEqual((cassette.fallbacks, cassette.misses), (2, 1))
+        cassette.close()
+        strict = Cassette(self.path, mode="replay", fallback=False)
+        self.assertIsNone(strict.lookup(history("changed")))
+        strict.close()
+
+    def test_record_appends_to_existing_file(self):
+        self._record((history("a"), "reply a"))
+        self._record((history("b"), "reply b"))
+        cassette = Cassette(self.path, mode="replay")
+        self.assertEqual([entry.text for entry in cassette.entries()], ["reply a", "reply b"])
+        self.assertEqual([entry.text for entry in cassette.entries("prompt")], ["reply a", "reply b"])
+        self.assertEqual(list(cassette.entries("other prompt")), [])
+        cassette.close()
+
+    def test_missing_index_is_rebuilt(self):
+        self._record((history("a"), "reply a"), (history("b"), "reply b"))
+        os.remove(self.path + ".idx")
+        cassette = Cassette(self.path, mode="replay")
+        self.assertEqual(cassette.rebuilt, 2)
+        self.assertEqual(cassette.lookup(history("b")).text, "reply b")
+        cassette.close()
+
+    def test_truncated_tail_is_dropped_on_record(self):
+        self._record((history("a"), "reply a"))
+        with open(self.path, "ab") as f:
+            f.write(b"\x00" * 10)  # 写了一半的记录
+        self._record((history("b"), "reply b"))
+        cassette = Cassette(self.path, mode="replay")
+        self.assertEqual([entry.text for entry in cassette.entries()], ["reply a", "reply b"])
+        cassette.close()
+
+    def test_replay_schedule_speed(self):
+        self._record((history("a"), "reply a"))
+        cassette = Cassette(self.path, mode="replay")
+        entry = cassette.lookup(history("a"))
+        self.assertEqual([at for at, _ in entry.schedule(1)], [0.01, 0.025])
+        self.assertEqual([at for at, _ in entry.schedule(2)], [0.005, 0.0125])
+        self.assertEqual([at for at, _ in entry.schedule(0)], [0.0, 0.0])
+        cassette.close()
+
+    def test_write_failure_goes_to_on_error(self):
+        errors = []
+        cassette = Cassette(self.path, mode="record", on_error=errors.append)
+        cassette._file.close()
+        cassette._file = open(self.path, "rb")  # 只读句柄，写入失败
+        cassette.record("model", history("a"), [(1.0, "x")], True)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(cassette.recorded, 0)
+        cassette.close()
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Cassette(self.path, mode="rewind")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import threading
+import unittest
+
+from MorMain import CmdRingBuffer
+
+
+class CmdRingBufferTest(unittest.TestCase):
+    """写满后按丢弃策略回绕，drain一次取走全部内容"""
+
+    def test_oldest_policy_keeps_latest_lines(self):
+        buffer = CmdRingBuffer(capacity=3)
+        for i in range(5):
+            self.assertTrue(buffer.put(f"line {i}"))
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.dropped, 2)
+        items, urgent = buffer.drain()
+        self.assertEqual(items, ["line 2", "line 3", "line 4"])
+        self.assertFalse(urgent)
+        self.assertEqual(len(buffer), 0)
+
+    def test_newest_policy_rejects_new_lines(self):
+        buffer = CmdRingBuffer(capacity=2, drop_policy="newest")
+        self.assertTrue(buffer.put("a"))
+        self.assertTrue(buffer.put("b"))
+        self.assertFalse(buffer.put("c"))
+        self.assertEqual(buffer.dropped, 1)
+        self.assertEqual(buffer.drain()[0], ["a", "b"])
+
+    def test_wraparound_after_drain(self):
+        buffer = CmdRingBuffer(capacity=2)
+        for round_ in range(3):
+            for i in range(3):
+                buffer.put(f"{round_}-{i}")
+            self.assertEqual(buffer.drain()[0], [f"{round_}-1", f"{round_}-2"])
+        self.assertEqual(buffer.dropped, 3)
+
+    def test_urgent_flag_is_reset_by_drain(self):
+        buffer = CmdRingBuffer()
+        buffer.put("prompt", urgent=True)
+        buffer.put("more")
+        self.assertEqual(buffer.drain(), (["prompt", "more"], True))
+        buffer.put("later")
+        self.assertEqual(buffer.drain(), (["later"], False))
+
+    def test_wait_wakes_on_put(self):
+        buffer = CmdRingBuffer()
+        self.assertFalse(buffer.wait(0.01))
+        threading.Timer(0.05, buffer.put, args=("x",)).start()
+        self.assertTrue(buffer.wait(2))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            CmdRingBuffer(drop_policy="random")
+
+
+if __name__ == "__main__":
+    unittest.main()
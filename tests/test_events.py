@@ -0,0 +1,82 @@
+import threading
+import unittest
+
+from AILoop import EventLoopThread
+from MorEvents import EventAggregator, PRIORITY_REMINDER
+
+
+class EventAggregatorTest(unittest.TestCase):
+    """合并窗口内的系统事件合成一批投递，gate关闭时暂缓"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.loop_thread = EventLoopThread("TestEvents")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop_thread.stop()
+
+    def setUp(self):
+        self.batches = []
+        self.delivered = threading.Event()
+        self.errors = []
+        self.events = EventAggregator(window=0.05, max_wait=1.0, loop_thread=self.loop_thread,
+                                      on_error=self.errors.append)
+
+    def tearDown(self):
+        self.events.close()
+
+    def _on_batch(self, batch):
+        self.batches.append(batch)
+        self.delivered.set()
+
+    def test_burst_is_coalesced_into_one_batch(self):
+        self.events.connect(self._on_batch)
+        for _ in range(3):
+            self.events.post("CMD输出", "cmd")
+        self.events.post("[System提醒] 喝水", "reminder", PRIORITY_REMINDER)
+        self.assertTrue(self.delivered.wait(2))
+        self.assertEqual(len(self.batches), 1)
+        batch = self.batches[0]
+        self.assertEqual(batch.size, 4)
+        self.assertEqual([event.text for event in batch.events], ["[System提醒] 喝水", "CMD输出"])
+        self.assertEqual(batch.events[1].count, 3)
+        self.assertEqual(batch.source, "system")
+        self.assertIn("（重复3次）", batch.text)
+        self.assertEqual(self.events.coalesced, 3)
+
+    def test_single_event_keeps_text_and_source(self):
+        self.events.connect(self._on_batch)
+        self.events.post("[System提醒] 喝水", "reminder", PRIORITY_REMINDER)
+        self.assertTrue(self.delivered.wait(2))
+        self.assertEqual(self.batches[0].text, "[System提醒] 喝水")
+        self.assertEqual(self.batches[0].source, "timer")
+
+    def test_gate_defers_delivery_until_kick(self):
+        ready = threading.Event()
+        self.events.connect(self._on_batch, gate=ready.is_set)
+        self.events.post("event")
+        self.assertFalse(self.delivered.wait(0.2))
+        self.assertEqual(self.events.pending, 1)
+        ready.set()
+        self.events.kick()
+        self.assertTrue(self.delivered.wait(2))
+
+    def test_delivery_error_goes_to_on_error(self):
+        def fail(batch):
+            self.delivered.set()
+            raise RuntimeError("boom")
+
+        self.events.connect(fail)
+        self.events.post("event")
+        self.assertTrue(self.delivered.wait(2))
+        self.loop_thread.run(_noop())
+        self.assertEqual([str(e) for e in self.errors], ["boom"])
+
+
+async def _noop():
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from MorExecutor import CommandExecutor
+
+
+class _FakeSystem:
+    """记录每个命令块的开始与结束时间；内容形如"名字:秒数"，执行时睡眠对应秒数"""
+
+    def __init__(self):
+        self.spans = {}
+        self.reminders = []
+        self.lock = threading.Lock()
+
+    def process_command(self, content, command_type):
+        name, _, seconds = content.partition(":")
+        if name == "fail":
+            raise RuntimeError("boom")
+        started = time.perf_counter()
+        time.sleep(float(seconds or 0))
+        with self.lock:
+            self.spans[name] = (started, time.perf_counter())
+        return f"{command_type} {name} done", True
+
+    def _set_reminder(self, content, delay, times):
+        self.reminders.append((content, delay, times))
+
+    def _log_entry(self, *args):
+        pass
+
+
+class CommandExecutorTest(unittest.TestCase):
+    """Rcte块并发、Cmd块按顺序串行、pip install块作为屏障，结果按原始顺序返回"""
+
+    def setUp(self):
+        self.system = _FakeSystem()
+
+    def run_commands(self, commands, workers=4):
+        executor = CommandExecutor(self.system, max_workers=workers)
+        try:
+            return asyncio.run(executor.run([{"type": t, "content": c} for t, c in commands]))
+        finally:
+            executor.close()
+
+    def overlap(self, a, b):
+        (a_start, a_end), (b_start, b_end) = self.system.spans[a], self.system.spans[b]
+        return a_start < b_end and b_start < a_end
+
+    def before(self, a, b):
+        return self.system.spans[a][1] <= self.system.spans[b][0]
+
+    def test_independent_rcte_blocks_run_concurrently(self):
+        started = time.perf_counter()
+        results = self.run_commands([("Rcte", "a:0.2"), ("Rcte", "b:0.2"), ("Rcte", "c:0.2")])
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertTrue(self.overlap("a", "b") and self.overlap("b", "c"))
+        self.assertEqual([item.content for item in results], ["a:0.2", "b:0.2", "c:0.2"])
+        self.assertEqual([item.index for item in results], [0, 1, 2])
+
+    def test_cmd_blocks_keep_order_but_overlap_other_blocks(self):
+        self.run_commands([("Cmd", "c1:0.15"), ("Rcte", "r:0.15"), ("Cmd", "c2:0.05")])
+        self.assertTrue(self.before("c1", "c2"))
+        self.assertTrue(self.overlap("c1", "r"))
+
+    def test_pip_install_is_a_barrier(self):
+        self.run_commands([("Rcte", "a:0.1"), ("Cmd", "c:0.1"),
+                           ("Rcte", "pip install x:0.05"), ("Rcte", "b:0.05")])
+        self.assertTrue(self.before("a", "pip install x"))
+        self.assertTrue(self.before("c", "pip install x"))
+        self.assertTrue(self.before("pip install x", "b"))
+
+    def test_single_worker_runs_in_order(self):
+        self.run_commands([("Rcte", "a:0.05"), ("Rcte", "b:0.05"), ("Cmd", "c:0")], workers=1)
+        self.assertTrue(self.before("a", "b"))
+        self.assertTrue(self.before("b", "c"))
+
+    def test_time_and_failing_blocks(self):
+        results = self.run_commands([("Time", "喝水,60,2"), ("Rcte", "fail"), ("Time", "格式不对")])
+        self.assertEqual(self.system.reminders, [("喝水", 60, 2)])
+        self.assertEqual([item.success for item in results], [True, False, False])
+        self.assertIn("boom", results[1].result)
+
+    def test_cancel_waits_for_running_blocks(self):
+        executor = CommandExecutor(self.system, max_workers=1)
+
+        async def scenario():
+            batch = executor.batch()
+            for content in ("a:0.2", "b:0.2"):
+                batch.submit({"type": "Rcte", "content": content})
+            await asyncio.sleep(0.05)
+            await batch.cancel()
+            batch.submit({"type": "Rcte", "content": "c:0"})
+            return time.perf_counter()
+
+        try:
+            cancelled_at = asyncio.run(scenario())
+        finally:
+            executor.close()
+        self.assertLessEqual(self.system.spans["a"][1], cancelled_at)  # 已开始的块结束后才返回
+        self.assertNotIn("b", self.system.spans)
+        self.assertNotIn("c", self.system.spans)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from MorLog import AsyncLogWriter
+
+
+class AsyncLogWriterTest(unittest.TestCase):
+    """按大小轮转并压缩旧文件，队列满与写入失败分别计数并写入日志，打不开文件时后台线程不退出"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, "test.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _read(self, path=None):
+        with open(path or self.path, encoding="utf-8") as f:
+            return f.read()
+
+    def test_rotates_by_size_and_keeps_backup_count(self):
+        writer = AsyncLogWriter(self.path, max_bytes=100, backup_count=2, compress=True)
+        for i in range(6):
+            writer.write(f"line {i} " + "x" * 60 + "\n")
+            self.assertTrue(writer.flush(timeout=5))
+        writer.close()
+        self.assertTrue(os.path.exists(self.path + ".1.gz"))
+        self.assertTrue(os.path.exists(self.path + ".2.gz"))
+        self.assertFalse(os.path.exists(self.path + ".3.gz"))
+        with gzip.open(self.path + ".1.gz", "rt", encoding="utf-8") as f:
+            self.assertIn("line 4", f.read())
+        self.assertEqual(writer.written, 6)
+
+    def test_full_queue_drops_without_blocking_and_reports(self):
+        writer = AsyncLogWriter(self.path, max_queue=2, batch_size=1)
+        gate = threading.Event()
+        entered = threading.Event()
+        original = writer._write_batch
+
+        def stalled(batch):
+            entered.set()
+            gate.wait(5)
+            return original(batch)
+
+        writer._write_batch = stalled
+        writer.write("first\n")
+        self.assertTrue(entered.wait(5))
+        results = [writer.write(f"more {i}\n") for i in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(writer.dropped, 2)
+        gate.set()
+        writer.close()
+        content = self._read()
+        self.assertIn("日志队列已满，丢弃了2行日志", content)
+        self.assertNotIn("写入日志文件失败", content)
+
+    def test_unopenable_file_is_retried_on_the_next_batch(self):
+        path = os.path.join(self.workdir, "missing", "test.log")
+        writer = AsyncLogWriter(path)
+        writer.write("lost\n")
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(writer.failed, 1)
+        os.mkdir(os.path.dirname(path))
+        writer.write("kept\n")
+        self.assertTrue(writer.flush(timeout=5))
+        writer.close()
+        content = self._read(path)
+        self.assertIn("kept", content)
+        self.assertNotIn("lost", content)
+        self.assertIn("写入日志文件失败，丢失了1行日志", content)
+        self.assertEqual(writer.dropped, 0)
+
+    def test_close_flushes_pending_lines(self):
+        writer = AsyncLogWriter(self.path, flush_interval=10)
+        for i in range(100):
+            writer.write(f"{i}\n")
+        writer.close()
+        self.assertEqual(self._read().count("\n"), 100)
+        self.assertFalse(writer.write("after close\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from MorMemory import MemoryStore, TIER_CACHE, TIER_SUMMARY
+
+
+class MemoryStoreTest(unittest.TestCase):
+    """批量异步提交、按层级/会话查询、replace原子替换，写入队列满时add不阻塞"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, "memory.db")
+        self.store = MemoryStore(self.path, flush_interval=0.05)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_add_query_and_stats(self):
+        for i in range(5):
+            self.assertTrue(self.store.add("user", f"message {i}", session="a", created=1000 + i))
+        self.store.add("ai", "other session", session="b", created=2000)
+        self.store.add("tool", "important", session="a", important=True, created=3000)
+        self.assertFalse(self.store.add("user", ""))
+        self.assertTrue(self.store.flush(timeout=5))
+
+        newest = self.store.query(session="a", limit=2)
+        self.assertEqual([m["content"] for m in newest], ["important", "message 4"])
+        oldest = self.store.query(session="a", important=False, limit=None, newest_first=False)
+        self.assertEqual([m["content"] for m in oldest], [f"message {i}" for i in range(5)])
+        self.assertEqual([m["content"] for m in self.store.query(since=1001, until=1003)], ["message 2", "message 1"])
+        self.assertEqual(self.store.stats(tier=TIER_CACHE)["count"], 7)
+        self.assertEqual({s: v["count"] for s, v in self.store.session_stats().items()}, {"a": 6, "b": 1})
+
+    def test_replace_is_atomic_and_notifies(self):
+        events = []
+        self.store.add_listener(lambda rows, removed=None: events.append(([r["content"] for r in rows], removed)))
+        for i in range(3):
+            self.store.add("user", f"old {i}", session="a")
+        self.store.flush(timeout=5)
+        ids = [m["id"] for m in self.store.query(tier=TIER_CACHE)]
+        written = self.store.replace(ids, [{"kind": "summary", "content": "summary", "tier": TIER_SUMMARY, "session": "a"}])
+        self.assertEqual(self.store.stats(tier=TIER_CACHE)["count"], 0)
+        self.assertEqual([m["id"] for m in self.store.query(tier=TIER_SUMMARY)], [written[0]["id"]])
+        self.assertEqual(events[-1], (["summary"], ids))
+        self.assertEqual(self.store.get([written[0]["id"], 999999]), self.store.query(tier=TIER_SUMMARY))
+
+    def test_full_queue_drops_without_blocking(self):
+        store = MemoryStore(os.path.join(self.workdir, "full.db"), max_queue=1)
+        gate = threading.Event()
+        entered = threading.Event()
+        original = store._insert_rows
+
+        def stalled(conn, rows):
+            entered.set()
+            gate.wait(5)
+            original(conn, rows)
+
+        store._insert_rows = stalled
+        store.add("user", "first")
+        self.assertTrue(entered.wait(5))
+        started = time.monotonic()
+        results = [store.add("user", f"more {i}") for i in range(3)]
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertEqual(results, [True, False, False])
+        self.assertEqual(store.dropped, 2)
+        gate.set()
+        store.close()
+        reopened = MemoryStore(store.path)
+        self.assertEqual([m["content"] for m in reopened.query(newest_first=False)], ["first", "more 0"])
+        reopened.close()
+
+    def test_close_commits_pending_rows(self):
+        store = MemoryStore(os.path.join(self.workdir, "close.db"), flush_interval=10)
+        for i in range(10):
+            store.add("user", str(i))
+        store.close()
+        self.assertFalse(store.add("user", "after close"))
+        reopened = MemoryStore(store.path)
+        self.assertEqual(reopened.stats()["count"], 10)
+        reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
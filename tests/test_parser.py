@@ -0,0 +1,76 @@
+import random
+import unittest
+
+from MorParser import CommandParser, extract_command_blocks
+
+
+def feed_in_chunks(text, sizes):
+    """按sizes循环切分text逐段feed，返回(每段新闭合的命令块, finish的结果)"""
+    parser = CommandParser()
+    closed = []
+    pos = 0
+    index = 0
+    while pos < len(text):
+        size = sizes[index % len(sizes)]
+        closed.append(parser.feed(text[pos:pos + size]))
+        pos += size
+        index += 1
+    return closed, parser.finish(), parser
+
+
+class CommandParserTest(unittest.TestCase):
+    """命令块识别，以及流式输入中被切断的命令块"""
+
+    def test_extracts_blocks_in_order(self):
+        text = "好的Rcte{print(1)}然后Cmd{dir}最后Time{60,1,喝水}"
+        cleaned, blocks = extract_command_blocks(text)
+        self.assertEqual(cleaned, "好的然后最后")
+        self.assertEqual([(b["type"], b["content"]) for b in blocks],
+                         [("Rcte", "print(1)"), ("Cmd", "dir"), ("Time", "60,1,喝水")])
+
+    def test_braces_in_strings_and_comments(self):
+        code = "d = {'a': '}'}  # }\ns = \"\"\"\n}\n\"\"\"\nprint(d)"
+        cleaned, blocks = extract_command_blocks(f"Rcte{{{code}}}done")
+        self.assertEqual(blocks[0]["content"], code)
+        self.assertEqual(cleaned, "done")
+
+    def test_block_split_across_chunks(self):
+        text = "前文Rcte{x = {'k': \"}\"}\nprint('''}''')}后文Cmd{echo \"}\"}"
+        expected = extract_command_blocks(text)
+        for size in range(1, 8):
+            closed, result, parser = feed_in_chunks(text, [size])
+            self.assertEqual(result, expected, size)
+            self.assertEqual(parser.text, text)
+            self.assertEqual([b for chunk in closed for b in chunk], expected[1])
+
+    def test_split_start_tag(self):
+        parser = CommandParser()
+        self.assertEqual(parser.feed("abc Rc"), [])
+        self.assertEqual(parser.feed("te{print(1)"), [])
+        self.assertTrue(parser.in_block)
+        blocks = parser.feed("} tail")
+        self.assertEqual([b["content"] for b in blocks], ["print(1)"])
+        self.assertEqual(parser.finish()[0], "abc  tail")
+
+    def test_block_closes_as_soon_as_brace_arrives(self):
+        parser = CommandParser()
+        self.assertEqual(parser.feed("Cmd{dir"), [])
+        self.assertEqual(len(parser.feed("}")), 1)
+
+    def test_unclosed_block_stays_as_text(self):
+        cleaned, blocks = extract_command_blocks("text Rcte{print(1)")
+        self.assertEqual(blocks, [])
+        self.assertEqual(cleaned, "text Rcte{print(1)")
+
+    def test_random_splits_match_whole_text(self):
+        pieces = ["hi ", "Rcte{", "x='}'", "\n", "# }\n", "'''}'''", "}", "Cmd{", "echo \"}\"",
+                  "Time{", "{1}", "Rc", "te{", "\\", "\"", "{", "中文"]
+        rng = random.Random(7)
+        for _ in range(300):
+            text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 20)))
+            sizes = [rng.randint(1, 5) for _ in range(4)]
+            self.assertEqual(feed_in_chunks(text, sizes)[1], extract_command_blocks(text), text)
+
+
+if __name__ == "__main__":
+    unittest.main()
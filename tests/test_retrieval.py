@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from MorMemory import MemoryStore, TIER_SUMMARY
+from MorRetrieval import MemoryRetriever, VECTOR_AVAILABLE, tokenize
+
+
+class MemoryRetrieverTest(unittest.TestCase):
+    """全文与向量检索融合排序，支持排除已在上下文中的内容、按会话过滤，注入文本受token预算限制"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.store = MemoryStore(os.path.join(self.workdir, "memory.db"), flush_interval=0.05)
+        self.retriever = MemoryRetriever(self.store)
+        self.assertTrue(self.retriever.ready.wait(10))
+        for session, content in (("a", "主人喜欢喝乌龙茶，不加糖"),
+                                 ("a", "明天下午三点要去医院复查"),
+                                 ("b", "主人的猫叫小橘，喜欢吃鱼"),
+                                 ("a", "python project uses sqlite for memory storage")):
+            self.store.add("user", content, session=session)
+        self.store.flush(timeout=5)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def contents(self, memories):
+        return [m["content"] for m in memories]
+
+    def test_tokenize_mixes_words_and_cjk_bigrams(self):
+        self.assertEqual(tokenize("Hi SQLite 喝茶 x"), ["hi", "sqlite", "喝", "茶", "喝茶"])
+
+    def test_finds_related_memory_first(self):
+        self.assertEqual(self.contents(self.retriever.search("喜欢喝什么茶", k=1)), ["主人喜欢喝乌龙茶，不加糖"])
+        self.assertEqual(self.contents(self.retriever.search("sqlite memory", k=1)),
+                         ["python project uses sqlite for memory storage"])
+
+    def test_exclude_and_session_filter(self):
+        found = self.retriever.search("主人喜欢", k=5, exclude={"主人喜欢喝乌龙茶，不加糖"})
+        self.assertNotIn("主人喜欢喝乌龙茶，不加糖", self.contents(found))
+        self.assertIn("主人的猫叫小橘，喜欢吃鱼", self.contents(found))
+        self.assertNotIn("主人的猫叫小橘，喜欢吃鱼", self.contents(self.retriever.search("主人喜欢", k=5, session="a")))
+
+    def test_context_respects_token_budget(self):
+        context = self.retriever.build_context("主人喜欢", k=5, token_budget=1000)
+        self.assertTrue(context.startswith("[相关记忆]\n"))
+        self.assertGreaterEqual(context.count("\n- ("), 2)
+        self.assertEqual(self.retriever.build_context("主人喜欢", k=5, token_budget=5), "")
+        self.assertEqual(self.retriever.build_context("完全无关的查询zzz", k=5), "")
+
+    @unittest.skipUnless(VECTOR_AVAILABLE, "需要numpy")
+    def test_replaced_memories_leave_the_index(self):
+        old = self.store.query(session="b")
+        self.store.replace([m["id"] for m in old],
+                           [{"kind": "summary", "content": "主人养了一只猫", "tier": TIER_SUMMARY, "session": "b"}])
+        self.assertNotIn(old[0]["id"], self.retriever.index)
+        self.assertEqual(self.contents(self.retriever.search("猫", k=5)), ["主人养了一只猫"])
+
+    @unittest.skipUnless(VECTOR_AVAILABLE, "需要numpy")
+    def test_snapshot_is_loaded_and_caught_up(self):
+        self.retriever.save()
+        self.store.add("user", "snapshot之后写入的记忆：周末去爬山", session="a")
+        self.store.flush(timeout=5)
+        reloaded = MemoryRetriever(self.store)
+        self.assertTrue(reloaded.ready.wait(10))
+        self.assertEqual(len(reloaded.index), 5)
+        self.assertEqual(self.contents(reloaded.search("周末爬山", k=1)), ["snapshot之后写入的记忆：周末去爬山"])
+
+
+if __name__ == "__main__":
+    unittest.main()
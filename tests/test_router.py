@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+
+from MorMain import _routed_chat
+from MorRouter import ModelRouter, Route
+
+
+class _FakeAI:
+    """按路由返回预设回复，并像AIWife一样把一问一答写入历史"""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.messages = [{"role": "system", "content": "prompt"}]
+        self.calls = []
+        self.last_timing = None
+        self.last_usage = None
+
+    def chat(self, message, stream=False, on_delta=None, context=None, route=None, cancel=None):
+        self.calls.append(route.name)
+        reply = self.replies[route.name]
+        self.messages.append({"role": "user", "content": message})
+        self.messages.append({"role": "assistant", "content": reply})
+        return reply
+
+
+class _FakeSystem:
+    def __init__(self, router):
+        self.router = router
+        self.logs = []
+
+    def _log_entry(self, kind, content, source):
+        self.logs.append((kind, content))
+
+
+class ModelRouterTest(unittest.TestCase):
+    """按来源选择路由，快速模型的回复含命令块时撤回并转交主模型"""
+
+    def setUp(self):
+        self.router = ModelRouter({"fast": Route("fast", model="small")},
+                                  {"timer": "fast", "tool": "fast", "system": "missing"})
+
+    def test_route_for_source(self):
+        self.assertIs(self.router.route_for("timer"), self.router.routes["fast"])
+        self.assertIs(self.router.route_for("user"), self.router.main)
+        self.assertIs(self.router.route_for("system"), self.router.main)  # 规则指向不存在的路由时忽略
+
+    def test_should_escalate_only_fast_replies_with_commands(self):
+        fast = self.router.routes["fast"]
+        self.assertTrue(self.router.should_escalate(fast, "好的Cmd{dir}"))
+        self.assertFalse(self.router.should_escalate(fast, "NULL"))
+        self.assertFalse(self.router.should_escalate(self.router.main, "好的Cmd{dir}"))
+        self.router.escalate = False
+        self.assertFalse(self.router.should_escalate(fast, "好的Cmd{dir}"))
+
+    def test_rollback_only_removes_matching_exchange(self):
+        ai = _FakeAI({})
+        ai.messages += [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}]
+        self.assertFalse(ModelRouter.rollback(ai, "other"))
+        self.assertTrue(ModelRouter.rollback(ai, "q"))
+        self.assertEqual(ai.messages, [{"role": "system", "content": "prompt"}])
+
+    def test_escalated_turn_keeps_only_main_answer(self):
+        ai = _FakeAI({"fast": "Rcte{print(1)}", "main": "主模型的回答"})
+        system = _FakeSystem(self.router)
+        response = asyncio.run(_routed_chat(ai, system, "timer", "提醒：喝水"))
+        self.assertEqual(response, "主模型的回答")
+        self.assertEqual(ai.calls, ["fast", "main"])
+        self.assertEqual(ai.messages[1:], [{"role": "user", "content": "提醒：喝水"},
+                                           {"role": "assistant", "content": "主模型的回答"}])
+        self.assertEqual(self.router.routes["fast"].escalations, 1)
+        self.assertEqual(self.router.routes["fast"].requests, 1)
+        self.assertEqual(self.router.main.requests, 1)
+
+    def test_fast_reply_without_commands_is_kept(self):
+        ai = _FakeAI({"fast": "NULL", "main": "unused"})
+        response = asyncio.run(_routed_chat(ai, _FakeSystem(self.router), "tool", "结果"))
+        self.assertEqual(response, "NULL")
+        self.assertEqual(ai.calls, ["fast"])
+        self.assertEqual(self.router.routes["fast"].escalations, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
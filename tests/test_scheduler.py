@@ -0,0 +1,80 @@
+import threading
+import time
+import unittest
+
+from MorScheduler import ReminderScheduler
+
+
+class ReminderSchedulerTest(unittest.TestCase):
+    """提醒按触发时间先后触发，取消的提醒不再触发"""
+
+    def setUp(self):
+        self.fired = []
+        self.errors = []
+        self.done = threading.Event()
+        self.scheduler = ReminderScheduler(self._fire, on_error=self.errors.append)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _fire(self, reminder):
+        self.fired.append(reminder.content)
+        if len(self.fired) >= self.expected:
+            self.done.set()
+
+    def test_fires_in_due_order_regardless_of_insertion_order(self):
+        self.expected = 3
+        self.scheduler.add("third", 0.15)
+        self.scheduler.add("first", 0.05)
+        self.scheduler.add("second", 0.1)
+        self.assertEqual([r["content"] for r in self.scheduler.list()], ["first", "second", "third"])
+        self.scheduler.start()
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.fired, ["first", "second", "third"])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_cancelled_reminder_does_not_fire(self):
+        self.expected = 1
+        cancelled = self.scheduler.add("cancelled", 0.05)
+        self.scheduler.add("kept", 0.1)
+        self.assertTrue(self.scheduler.cancel(cancelled))
+        self.assertFalse(self.scheduler.cancel(cancelled))
+        self.scheduler.start()
+        self.assertTrue(self.done.wait(2))
+        time.sleep(0.1)
+        self.assertEqual(self.fired, ["kept"])
+
+    def test_cancel_respects_owner(self):
+        self.expected = 1
+        reminder_id = self.scheduler.add("mine", 10, owner="a")
+        self.scheduler.add("theirs", 10, owner="b")
+        self.assertFalse(self.scheduler.cancel(reminder_id, owner="b"))
+        self.assertEqual([r["content"] for r in self.scheduler.list(owner="a")], ["mine"])
+        self.assertEqual(self.scheduler.cancel_owner("b"), 1)
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_repeating_reminder_fires_requested_times(self):
+        self.expected = 3
+        self.scheduler.MIN_INTERVAL = 0.01
+        self.scheduler.add("tick", 0.02, times=3)
+        self.scheduler.start()
+        self.assertTrue(self.done.wait(2))
+        time.sleep(0.1)
+        self.assertEqual(self.fired, ["tick"] * 3)
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_callback_error_is_reported(self):
+        def fail(reminder):
+            self.done.set()
+            raise RuntimeError("boom")
+
+        self.scheduler.on_fire = fail
+        self.scheduler.add("x", 0.01)
+        self.scheduler.start()
+        self.assertTrue(self.done.wait(2))
+        time.sleep(0.05)
+        self.assertEqual([str(e) for e in self.errors], ["boom"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from AILoop import get_event_loop_thread
+from MorDaemon import HeadlessDaemon
+from MorLog import AsyncLogWriter
+from MorServer import SessionManager
+
+
+class _Events:
+    def __init__(self):
+        self.kicks = 0
+
+    def kick(self):
+        self.kicks += 1
+
+
+class _System:
+    session_id = "s1"
+
+    def __init__(self):
+        self.events = _Events()
+
+
+class _Daemon:
+    """只有换出与关闭需要的属性；保存时ai为None会失败"""
+
+    def __init__(self):
+        self.ai = None
+        self.system = None
+        self.busy = False
+        self.ready = True
+        self.clients = []
+        self.stopped = []
+
+    def stop(self, release=False):
+        self.stopped.append(release)
+
+
+class SessionManagerTest(unittest.TestCase):
+    """未完成的HTTP轮次让会话保持忙碌不被换出，换出与保存失败写入共用日志"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.workdir, "server.log")
+        self.log_writer = AsyncLogWriter(self.log_path)
+        self.manager = SessionManager(lambda session_id, reminders: None, state_dir=os.path.join(self.workdir, "sessions"),
+                                      log_writer=self.log_writer)
+        self.loop = get_event_loop_thread()
+
+    def tearDown(self):
+        self.manager.reminders.stop()
+        self.log_writer.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_turn_waiting_for_initialization_keeps_session_busy(self):
+        daemon = HeadlessDaemon(None, _System(), initialize=False)
+        self.assertFalse(daemon.busy)
+        turn = self.loop.submit(daemon.run_turn("你好"))  # 与HTTP接口一样直接调用，不经过submit_line
+        self.loop.run(asyncio.sleep(0.01))
+        self.assertTrue(daemon.busy)
+        self.manager.sessions["s1"] = daemon
+        daemon.ready = True
+        self.assertFalse(self.loop.run(self.manager.evict("s1")))
+        self.assertIn("s1", self.manager.sessions)
+        turn.cancel()
+        self.loop.run(asyncio.sleep(0.01))
+        self.assertFalse(daemon.busy)
+        self.assertEqual(daemon.system.events.kicks, 1)
+
+    def test_save_failure_is_logged(self):
+        daemon = _Daemon()
+        self.manager.sessions["broken"] = daemon
+        self.loop.run(self.manager.close())
+        self.assertEqual(daemon.stopped, [True])
+        self.log_writer.flush(timeout=5)
+        with open(self.log_path, encoding="utf-8") as f:
+            self.assertIn("[ERROR] [SERVER] 保存会话broken失败", f.read())
+
+    def test_sweep_failure_is_logged(self):
+        daemon = _Daemon()
+        daemon.last_active = 0
+        self.manager.sessions["broken"] = daemon
+        self.manager.sweep_interval = 0.01
+        sweeper = self.loop.run(self.manager._start_sweeper())
+        self.loop.run(asyncio.sleep(0.1))
+        sweeper.cancel()
+        self.assertEqual(daemon.stopped[:1], [True])
+        self.log_writer.flush(timeout=5)
+        with open(self.log_path, encoding="utf-8") as f:
+            self.assertIn("[ERROR] [SERVER] 换出会话broken失败", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from AIchat import AIWife
+from MorMemory import MemoryStore, TIER_CACHE, TIER_SUMMARY, TIER_LONG
+from MorSummarizer import SummaryWorker
+
+
+class SummaryWorkerTest(unittest.TestCase):
+    """每个层级只把最旧的一批升级，长期记忆超过上限时只合并最旧的一批，重要记忆不参与升级"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.store = MemoryStore(os.path.join(self.workdir, "memory.db"), flush_interval=0.02)
+        self.prompts = []
+        self.worker = None
+        self.clock = 1000.0  # 按写入顺序递增的created
+
+    def tearDown(self):
+        if self.worker is not None:
+            self.worker.stop()
+        self.store.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def start(self, **kwargs):
+        self.worker = SummaryWorker(self.store, AIWife(api_key="test"), **kwargs)
+
+        def fake_summarize(prompt):
+            self.prompts.append(prompt)
+            return None if "失败" in prompt else f"摘要{len(self.prompts)}"
+
+        self.worker._summarize = fake_summarize
+        self.worker._wake.set()
+
+    def add(self, count, tier=TIER_CACHE, session="s", important=False, prefix="m"):
+        for i in range(count):
+            self.clock += 1
+            self.store.add("user", f"{prefix}{i}", session=session, tier=tier, important=important, created=self.clock)
+        self.store.flush(timeout=5)
+
+    def contents(self, tier, session=None):
+        return [m["content"] for m in self.store.query(tier=tier, session=session, limit=None, newest_first=False)]
+
+    def settle(self, timeout=5.0):
+        """等到没有排队和进行中的任务"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            metrics = self.worker.metrics()
+            if not metrics["queue_depth"] and not metrics["in_flight"]:
+                time.sleep(0.05)
+                if not self.worker.metrics()["in_flight"]:
+                    return
+        self.fail("摘要任务没有结束")
+
+    def test_cache_promotes_only_the_oldest_window(self):
+        self.add(5)
+        self.start(count_threshold=3)
+        self.settle()
+        self.assertEqual(self.contents(TIER_SUMMARY), ["摘要1"])
+        self.assertEqual(self.contents(TIER_CACHE), ["m3", "m4"])
+        self.assertIn("m0", self.prompts[0])
+        self.assertNotIn("m3", self.prompts[0])
+
+    def test_long_term_merges_only_the_oldest_window_above_the_limit(self):
+        self.add(6, tier=TIER_LONG, prefix="L")
+        self.start(count_threshold=2, long_threshold=4)
+        self.settle()
+        self.assertEqual(self.contents(TIER_LONG), ["摘要2", "L3", "L4", "L5"])
+
+    def test_long_term_below_the_limit_is_left_alone(self):
+        self.add(4, tier=TIER_LONG, prefix="L")
+        self.start(count_threshold=2, long_threshold=4)
+        self.settle()
+        self.assertEqual(self.prompts, [])
+        self.assertEqual(self.contents(TIER_LONG), ["L0", "L1", "L2", "L3"])
+
+    def test_important_memories_are_never_promoted(self):
+        self.add(3, important=True, prefix="重要")
+        self.add(1)
+        self.start(count_threshold=3)
+        self.settle()
+        self.assertEqual(self.contents(TIER_SUMMARY), ["摘要1"])
+        self.assertEqual(self.contents(TIER_CACHE), ["重要0", "重要1", "重要2"])
+
+    def test_per_session_promotion_does_not_mix_sessions(self):
+        self.add(2, session="a", prefix="a")
+        self.add(2, session="b", prefix="b")
+        self.start(count_threshold=2, per_session=True)
+        self.settle()
+        summaries = self.store.query(tier=TIER_SUMMARY, limit=None)
+        self.assertEqual(sorted(m["session"] for m in summaries), ["a", "b"])
+        self.assertEqual(self.contents(TIER_CACHE), [])
+
+    def test_failed_summary_keeps_memories_and_backs_off(self):
+        self.add(2, prefix="失败")
+        self.start(count_threshold=2, retry_delay=60)
+        self.settle()
+        self.assertEqual(self.worker.metrics()["failed"], 1)
+        self.assertEqual(self.contents(TIER_CACHE), ["失败0", "失败1"])
+        self.assertEqual(len(self.prompts), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from MorTranscript import TranscriptStore, TranscriptWindow
+
+
+class TranscriptStoreTest(unittest.TestCase):
+    """写入只入队、由后台线程批量提交，未提交的记录也能分页读到"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "transcript.db")
+        self.store = TranscriptStore(self.path, session="s", flush_interval=5.0)
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def committed(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute("SELECT id, role, html FROM transcript ORDER BY id").fetchall()
+        finally:
+            conn.close()
+
+    def test_append_does_not_commit_on_caller_thread(self):
+        entries = [self.store.append("user", f"m{i}") for i in range(3)]
+        self.assertEqual([entry.id for entry in entries], [1, 2, 3])
+        self.assertEqual(self.committed(), [])
+        self.assertTrue(self.store.flush(2))
+        self.assertEqual(self.committed(), [(1, "user", "m0"), (2, "user", "m1"), (3, "user", "m2")])
+
+    def test_paging_sees_unwritten_entries(self):
+        for i in range(3):
+            self.store.append("user", f"m{i}")
+        self.store.flush(2)
+        for i in range(3, 6):
+            self.store.append("ai", f"m{i}")
+        self.assertEqual([entry.html for entry in self.store.older(None, 4)], ["m2", "m3", "m4", "m5"])
+        self.assertEqual([entry.html for entry in self.store.older(5, 2)], ["m2", "m3"])
+        self.assertEqual([entry.html for entry in self.store.newer(2, 3)], ["m2", "m3", "m4"])
+
+    def test_close_commits_queue_and_ids_continue_after_reopen(self):
+        self.store.append("user", "a")
+        self.store.close()
+        self.assertEqual(len(self.committed()), 1)
+        self.store = TranscriptStore(self.path, session="s")
+        self.assertEqual(self.store.append("ai", "b").id, 2)
+        self.assertEqual([entry.html for entry in self.store.older(None, 10)], ["a", "b"])
+
+    def test_window_pages_back_to_latest(self):
+        window = TranscriptWindow(self.store, max_items=4, page_size=2)
+        for i in range(8):
+            window.append("user", f"m{i}")
+        self.assertEqual([entry.html for entry in window.entries], ["m4", "m5", "m6", "m7"])
+        self.assertEqual(window.load_older(), 2)
+        self.assertFalse(window.at_latest)
+        self.assertEqual(window.load_newer(), 2)
+        self.assertTrue(window.at_latest)
+        self.assertEqual([entry.html for entry in window.entries], ["m4", "m5", "m6", "m7"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import asyncio
+import http.server
+import socket
+import threading
+import time
+import unittest
+
+import requests
+
+from AIchat import HttpTransport, AsyncHttpTransport, ASYNC_AVAILABLE
+
+
+class _SlowHandler(http.server.BaseHTTPRequestHandler):
+    """收到请求后迟迟不回复，用来制造请求发出之后的读取超时"""
+
+    hits = 0
+
+    def do_POST(self):
+        type(self).hits += 1
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(0.5)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def _closed_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class HttpTransportRetryTest(unittest.TestCase):
+    """只重试请求发出之前的失败，已被服务端接收的请求不重复发送"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _SlowHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        _SlowHandler.hits = 0
+
+    def test_read_timeout_is_not_retried(self):
+        transport = HttpTransport(read_timeout=0.1, backoff_base=0.01)
+        with self.assertRaises(requests.ReadTimeout):
+            transport.post(self.url, json={})
+        transport.close()
+        self.assertEqual(_SlowHandler.hits, 1)
+
+    def test_refused_connection_is_retried(self):
+        transport = HttpTransport(max_retries=2, backoff_base=0.01)
+        attempts = []
+        original = transport.session.post
+
+        def counting_post(*args, **kwargs):
+            attempts.append(1)
+            return original(*args, **kwargs)
+
+        transport.session.post = counting_post
+        with self.assertRaises(requests.ConnectionError):
+            transport.post(f"http://127.0.0.1:{_closed_port()}/", json={})
+        transport.close()
+        self.assertEqual(len(attempts), 3)
+
+    @unittest.skipUnless(ASYNC_AVAILABLE, "需要aiohttp")
+    def test_async_read_timeout_is_not_retried(self):
+        async def scenario():
+            transport = AsyncHttpTransport(read_timeout=0.1, backoff_base=0.01)
+            try:
+                with self.assertRaises(asyncio.TimeoutError):
+                    await transport.post(self.url, json={})
+            finally:
+                await transport.close()
+
+        asyncio.run(scenario())
+        self.assertEqual(_SlowHandler.hits, 1)
+
+
+@unittest.skipUnless(ASYNC_AVAILABLE, "需要aiohttp")
+class AsyncHttpTransportSessionTest(unittest.TestCase):
+    """每个事件循环各用一个会话，切换循环不替换其它循环的会话，close()全部关闭"""
+
+    def test_one_session_per_loop(self):
+        from AILoop import EventLoopThread
+
+        loop_thread = EventLoopThread("TestLoop")
+        transport = AsyncHttpTransport()
+
+        async def session():
+            return transport._get_session()
+
+        async def scenario():
+            mine = transport._get_session()
+            other = await asyncio.wrap_future(loop_thread.submit(session()))
+            again = await asyncio.wrap_future(loop_thread.submit(session()))
+            self.assertIs(other, again)
+            self.assertIsNot(mine, other)
+            await transport.close()
+            return mine, other
+
+        try:
+            mine, other = asyncio.run(scenario())
+        finally:
+            loop_thread.stop()
+        self.assertTrue(mine.closed)
+        self.assertTrue(other.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import asyncio
+import concurrent.futures
+import http.server
+import threading
+import time
+import unittest
+
+from AIchat import AIWife, HttpTransport
+from AILoop import EventLoopThread
+from MorMain import _ai_chat
+from MorTurns import TurnScheduler
+
+
+class TurnSchedulerTest(unittest.TestCase):
+    """同一会话串行执行，priority插队，supersede_key取代排队中的旧轮次"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.loop_thread = EventLoopThread("TestLoop")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop_thread.stop()
+
+    def setUp(self):
+        self.order = []
+        self.gate = threading.Event()
+        self.scheduler = TurnScheduler(self._handler, workers=2, max_pending=4, loop_thread=self.loop_thread)
+
+    def tearDown(self):
+        self.gate.set()
+        self.scheduler.close()
+        self.loop_thread.run(asyncio.sleep(0.01))  # 让被取消的工作协程结束
+
+    async def _handler(self, turn):
+        if turn.text == "raise":
+            raise asyncio.CancelledError()
+        if turn.text == "block":
+            while not self.gate.is_set():
+                await asyncio.sleep(0.005)
+        self.order.append(turn.text)
+        return turn.text.upper()
+
+    def _start_blocking_turn(self, key="s"):
+        future = self.scheduler.submit(key, "block")
+        for _ in range(200):
+            if future.running():
+                return future
+            threading.Event().wait(0.005)
+        self.fail("阻塞轮次没有开始执行")
+
+    def test_turns_of_one_session_run_in_order(self):
+        futures = [self.scheduler.submit("s", text) for text in ("a", "b", "c")]
+        self.assertEqual([f.result(2) for f in futures], ["A", "B", "C"])
+        self.assertEqual(self.order, ["a", "b", "c"])
+        self.assertEqual(self.scheduler.completed, 3)
+
+    def test_higher_priority_jumps_queue(self):
+        self._start_blocking_turn()
+        low = [self.scheduler.submit("s", text) for text in ("sys1", "sys2")]
+        high = self.scheduler.submit("s", "user", priority=10)
+        self.gate.set()
+        concurrent.futures.wait(low + [high], timeout=2)
+        self.assertEqual(self.order, ["block", "user", "sys1", "sys2"])
+
+    def test_supersede_cancels_pending_turn(self):
+        self._start_blocking_turn()
+        old = self.scheduler.submit("s", "old", supersede_key="status")
+        new = self.scheduler.submit("s", "new", supersede_key="status")
+        self.gate.set()
+        self.assertEqual(new.result(2), "NEW")
+        self.assertTrue(old.cancelled())
+        self.assertNotIn("old", self.order)
+
+    def test_queue_limit_rejects(self):
+        self._start_blocking_turn()
+        accepted = [self.scheduler.submit("s", str(i)) for i in range(4)]
+        self.assertTrue(all(accepted))
+        self.assertTrue(self.scheduler.is_full("s"))
+        self.assertIsNone(self.scheduler.submit("s", "overflow"))
+        self.assertEqual(self.scheduler.rejected, 1)
+        self.assertIsNotNone(self.scheduler.submit("other", "fine"))
+
+    def test_cancel_running_turn(self):
+        running = self._start_blocking_turn()
+        pending = self.scheduler.submit("s", "next")
+        self.assertEqual(self.scheduler.cancel("s"), 2)
+        with self.assertRaises(concurrent.futures.CancelledError):
+            running.result(2)
+        self.assertTrue(pending.cancelled())
+
+    def test_handler_cancelled_error_does_not_stop_worker(self):
+        scheduler = TurnScheduler(self._handler, workers=1, loop_thread=self.loop_thread)
+        try:
+            raised = scheduler.submit("s", "raise")
+            with self.assertRaises(concurrent.futures.CancelledError):
+                raised.result(2)
+            self.assertEqual(scheduler.submit("s", "after").result(2), "AFTER")
+            self.assertEqual(scheduler.cancelled, 1)
+        finally:
+            scheduler.close()
+
+    def test_close_stops_workers_while_a_turn_runs(self):
+        running = self._start_blocking_turn()
+        self.scheduler.close()
+        self.loop_thread.run(asyncio.sleep(0.01))
+        with self.assertRaises(concurrent.futures.CancelledError):
+            running.result(2)
+        self.assertTrue(all(task.done() for task in self.scheduler._tasks))
+        self.assertIsNone(self.scheduler.submit("s", "late"))
+
+
+class _EndlessStreamHandler(http.server.BaseHTTPRequestHandler):
+    """持续推送SSE增量、从不结束的流式回复"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for _ in range(250):
+                self.wfile.write(b'data: {"choices": [{"delta": {"content": "x"}}]}\n\n')
+                self.wfile.flush()
+                time.sleep(0.02)
+        except OSError:
+            pass  # 客户端已断开
+
+    def log_message(self, *args):
+        pass
+
+
+class ChatCancelTest(unittest.TestCase):
+    """取消轮次时同步AI请求的线程随之停止，本次提问从历史中撤回"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _EndlessStreamHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.loop_thread = EventLoopThread("TestLoop")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loop_thread.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_cancel_stops_thread_and_rolls_back_question(self):
+        transport = HttpTransport()
+        ai = AIWife(api_key="test", api_url=self.url, transport=transport)
+        history = list(ai.messages)
+        deltas = []
+
+        async def scenario():
+            first = asyncio.Event()
+            loop = asyncio.get_running_loop()
+
+            def on_delta(delta, text):
+                deltas.append(delta)
+                loop.call_soon_threadsafe(first.set)
+
+            task = asyncio.ensure_future(_ai_chat(ai, "你好", stream=True, on_delta=on_delta))
+            await first.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return len(deltas)
+
+        try:
+            started = time.monotonic()
+            count = self.loop_thread.run(scenario())
+            self.assertLess(time.monotonic() - started, 2)
+            time.sleep(0.1)
+            self.assertEqual(len(deltas), count)  # 取消返回时线程已不再读取
+            self.assertEqual(ai.messages, history)
+        finally:
+            transport.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from MorWorker import PythonWorkerPool
+
+
+class PythonWorkerPoolTest(unittest.TestCase):
+    """任务像新启动的python script.py一样执行，超时整组结束，结束后立即返回结果"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = PythonWorkerPool(size=1, timeout=5.0)
+        cls.workdir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def run_code(self, code, **kwargs):
+        return self.pool.run(code, cwd=self.workdir, **kwargs)
+
+    def test_runs_as_main_script(self):
+        result = self.run_code("import sys, os\n"
+                               "print(__name__, os.path.basename(__file__), os.path.basename(sys.argv[0]))\n"
+                               "print(sys.modules['__main__'].__dict__ is globals())")
+        self.assertTrue(result.success, result.stderr)
+        self.assertEqual(result.stdout.split(), ["__main__", "temp_execution.py", "temp_execution.py", "True"])
+
+    def test_pickles_classes_defined_by_the_job(self):
+        result = self.run_code("import pickle\n"
+                               "class Point:\n"
+                               "    def __init__(self, x): self.x = x\n"
+                               "def double(v): return v * 2\n"
+                               "p = pickle.loads(pickle.dumps(Point(3)))\n"
+                               "print(type(p) is Point, pickle.loads(pickle.dumps(double))(p.x))")
+        self.assertTrue(result.success, result.stderr)
+        self.assertEqual(result.stdout.split(), ["True", "6"])
+
+    def test_jobs_do_not_share_state(self):
+        self.assertTrue(self.run_code("import json\njson.leaked = 1").success)
+        result = self.run_code("import json\nprint(hasattr(json, 'leaked'))")
+        self.assertEqual(result.stdout.strip(), "False")
+
+    def test_exit_code_and_traceback(self):
+        result = self.run_code("import sys\nsys.exit(3)")
+        self.assertEqual(result.returncode, 3)
+        result = self.run_code("1 / 0")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("ZeroDivisionError", result.stderr)
+
+    def test_timeout_kills_the_job(self):
+        started = time.monotonic()
+        result = self.run_code("import time\ntime.sleep(30)", timeout=0.3)
+        self.assertTrue(result.timed_out)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_result_returns_as_soon_as_the_job_exits(self):
+        self.run_code("pass")  # 预热
+        durations = sorted(self.run_code("import time\ntime.sleep(0.07)").duration for _ in range(3))
+        self.assertLess(durations[1], 0.095)
+
+
+if __name__ == "__main__":
+    unittest.main()